@@ -9,3 +9,5 @@ RACS_CATALOG        =       "/data/craco/wan342/data/catalogue/racs-low.fits"
 RACS_REFFREQ        =       887.5
 
 CLEAN_MS            =       False
+
+POLSUM_MEMORY_BUDGET=       512 * 1024**2 # memory (in bytes) used for each block when summing polarisations
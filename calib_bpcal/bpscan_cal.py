@@ -8,7 +8,7 @@ import logging
 log = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-def _calibration_beam(sbid, beam):
+def _calibration_cmd(sbid, beam):
     sbidcalpath = "{}/{}/scans/00/19000101000000".format(cfg.CALIBRATION_PATH, sbid)
     beamcalpath = "{}/{:0>2}".format(sbidcalpath, beam)
     bpscanms_path = "{}/b{:0>2}.ms".format(beamcalpath, beam)
@@ -16,11 +16,14 @@ def _calibration_beam(sbid, beam):
     if not os.path.exists(bpscanms_path):
         log.warning("no measurement sets file found for {} Beam {}".format(sbid, beam))
 
-    cal_cmd = "{} -vis_ms {} -clean {} -build_dir {} -catalog {} -catfreq {}".format(
+    return "{} -vis_ms {} -clean {} -build_dir {} -catalog {} -catfreq {}".format(
         cfg.CALROUTIN_PATH, bpscanms_path, cfg.CLEAN_MS, 
         cfg.CALBUILD_DIR, cfg.RACS_CATALOG, cfg.RACS_REFFREQ,
     )
 
+def _calibration_beam(sbid, beam):
+    cal_cmd = _calibration_cmd(sbid, beam)
+
     log.info("start to calibrate with {}".format(cal_cmd))
 
     os.system(cal_cmd)
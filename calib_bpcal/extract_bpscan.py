@@ -10,7 +10,9 @@ from casacore import tables
 import bpcal_cfg as cfg # configuration file
 
 import os
+import sys
 import glob
+import shutil
 import argparse
 import numpy as np
 
@@ -18,43 +20,82 @@ import logging
 log = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-def split_bpcal_allscam(sbid, mstype="full"):
+def split_bpcal_allscam(sbid, mstype="full", flagmode="and", singlepol=False):
     """
     the structure should be: SB050677/scans/00/20230622110317/00
     """
     if isinstance(sbid, int): sbid = str(sbid)
     if not sbid.startswith("SB"): sbid = "SB{:0>6}".format(sbid)
 
-    sbidcalpath = "{}/{}/scans/00/19000101000000".format(cfg.CALIBRATION_PATH, sbid)
+    sbidcalpath = get_sbidcalpath(sbid)
 
     for beam in range(36):
-        try: _split_bpcal_beamscan(sbid, beam, sbidcalpath, mstype)
+        try: _split_bpcal_beamscan(sbid, beam, sbidcalpath, mstype, flagmode, singlepol)
         except: continue
 
-def _polsum_ms(msfname):
+def _polsum_ms(msfname, flagmode="and", singlepol=False, membudget=cfg.POLSUM_MEMORY_BUDGET):
     """
     perform polarization sum between XX and YY
+
+    the data is processed in row blocks that fit in `membudget` bytes, and
+    written back in place. the summed flag is flagged if all (`flagmode="and"`)
+    or any (`flagmode="or"`) of the polarisations are flagged. the mean is written
+    to both correlations unless `singlepol`, in which case only XX is kept
     """
+    if flagmode not in ("and", "or"): raise ValueError("flagmode should be either `and` or `or`...")
+    flagreduce = np.all if flagmode == "and" else np.any
+
     tab = tables.table(msfname, readonly=False)
     log.info("summing polarisation for hardware data...")
 
-    flagcol = tab.getcol("FLAG")
-    datacol = tab.getcol("DATA")
+    nrow = tab.nrows()
+    nchan, npol = tab.getcell("DATA", 0).shape
+    # data and flag for each row, and the temporary mean array
+    rowbytes = nchan * npol * (np.dtype(np.complex64).itemsize + 1) + nchan * np.dtype(np.complex64).itemsize
+    blockrow = max(1, int(membudget // rowbytes))
+
+    for startrow in range(0, nrow, blockrow):
+        nblock = min(blockrow, nrow - startrow)
+        log.debug("summing polarisation for row {} to {}...".format(startrow, startrow + nblock))
 
-    meandata_ = np.mean(datacol, axis=-1, keepdims=True)
-    flagdata_ = np.all(flagcol, axis=-1, keepdims=True)
+        datacol = tab.getcol("DATA", startrow=startrow, nrow=nblock)
+        flagcol = tab.getcol("FLAG", startrow=startrow, nrow=nblock)
 
-    meandata = np.concatenate([meandata_, meandata_], axis=-1)
-    flagdata = np.concatenate([flagdata_, flagdata_], axis=-1)
+        datacol[...] = np.mean(datacol, axis=-1, keepdims=True)
+        flagcol[...] = flagreduce(flagcol, axis=-1, keepdims=True)
 
-    tab.putcol("DATA", meandata)
-    tab.putcol("FLAG", flagdata)
+        tab.putcol("DATA", datacol, startrow=startrow, nrow=nblock)
+        tab.putcol("FLAG", flagcol, startrow=startrow, nrow=nblock)
 
     tab.close()
 
-def _split_bpcal_beamscan(sbid, beam, calpath, mstype="full"):
+    if singlepol: _keep_first_pol(msfname)
+
+def _keep_first_pol(msfname):
     """
-    split the bandpass observation scan for a given SBID and a given scan
+    replace the measurement set with a single polarisation (XX) copy
+    """
+    log.info("keeping XX polarisation only...")
+    singlepol_path = "{}.singlepol".format(msfname.rstrip("/"))
+    if os.path.exists(singlepol_path): shutil.rmtree(singlepol_path)
+    split(
+        vis=msfname,
+        outputvis=singlepol_path,
+        datacolumn="data",
+        correlation="XX",
+    )
+    shutil.rmtree(msfname)
+    os.rename(singlepol_path, msfname)
+
+def get_sbidcalpath(sbid):
+    return "{}/{}/scans/00/19000101000000".format(cfg.CALIBRATION_PATH, sbid)
+
+def get_bpscanms_path(calpath, beam):
+    return "{}/{:0>2}/b{:0>2}.ms".format(calpath, beam, beam)
+
+def _split_beam(sbid, beam, calpath, mstype="full"):
+    """
+    split the bandpass scan of a beam to a new folder, return the path of the splitted measurement set
     """
     beamcalpath = "{}/{:0>2}".format(calpath, beam)
     if not os.path.exists(beamcalpath):
@@ -63,7 +104,7 @@ def _split_bpcal_beamscan(sbid, beam, calpath, mstype="full"):
         log.info("beam directory found... deleting original content within the folder...")
         rmbeam_cmd = "rm -r {}/*".format(beamcalpath)
         os.system(rmbeam_cmd)
-    bpscanms_path = "{}/b{:0>2}.ms".format(beamcalpath, beam)
+    bpscanms_path = get_bpscanms_path(calpath, beam)
 
     ### find calibration
     if sbid.startswith("SB"): sbid_int = int(sbid[2:])
@@ -90,23 +131,56 @@ def _split_bpcal_beamscan(sbid, beam, calpath, mstype="full"):
             datacolumn="data",
             correlation="XX,YY",
         )
+    return bpscanms_path
 
-    ### perform polsum
-    _polsum_ms(bpscanms_path)
-
-    ### initweights
+def _initweights_ms(msfname):
     log.info("initialise spectral weights...")
     initweights(
-        vis=bpscanms_path,
+        vis=msfname,
         wtmode="weight",
         dowtsp=True,
     )
 
+def _split_bpcal_beamscan(sbid, beam, calpath, mstype="full", flagmode="and", singlepol=False):
+    """
+    split the bandpass observation scan for a given SBID and a given scan
+    """
+    bpscanms_path = _split_beam(sbid, beam, calpath, mstype)
+    if bpscanms_path is None: return None
+
+    ### perform polsum
+    _polsum_ms(bpscanms_path, flagmode=flagmode, singlepol=singlepol)
+
+    ### initweights
+    _initweights_ms(bpscanms_path)
+
     ### TODO: run fix_dir.py
     log.info("executing fix_dir.py on the splitted measurement sets...")
     fixdir_cmd = "{} {}".format(cfg.FIX_DIR_PATH, bpscanms_path)
     os.system(fixdir_cmd)
 
+def run_stage(sbid, beam, stage, mstype="full", flagmode="and", singlepol=False):
+    """
+    run a single stage (split, polsum or initweights) for a beam, used by the pipeline runner
+    return False if the stage cannot be done
+    """
+    calpath = get_sbidcalpath(sbid)
+    bpscanms_path = get_bpscanms_path(calpath, beam)
+
+    if stage == "split":
+        return _split_beam(sbid, beam, calpath, mstype) is not None
+
+    if not os.path.exists(bpscanms_path):
+        log.error("no measurement set found at {}...".format(bpscanms_path))
+        return False
+    if stage == "polsum":
+        _polsum_ms(bpscanms_path, flagmode=flagmode, singlepol=singlepol)
+    elif stage == "initweights":
+        _initweights_ms(bpscanms_path)
+    else:
+        raise ValueError("unknown stage {}...".format(stage))
+    return True
+
 if __name__ == "__main__":
     a = argparse.ArgumentParser()
     a.add_argument(
@@ -115,13 +189,24 @@ if __name__ == "__main__":
     a.add_argument(
         "-mstype", type=str, help="Type of the measurement sets, either full or single", default="single"
     )
+    a.add_argument(
+        "-flagmode", type=str, help="Flag a summed sample if `and` all or `or` any polarisation is flagged", default="and"
+    )
+    a.add_argument(
+        "-singlepol", action="store_true", help="Write a single polarisation measurement set after summing"
+    )
+    a.add_argument(
+        "-stage", type=str, help="Only run a single stage (split, polsum or initweights) for `-beam`", default=None
+    )
+    a.add_argument(
+        "-beam", type=int, help="Beam to process with `-stage`", default=None
+    )
     args = a.parse_args()
 
-    split_bpcal_allscam(args.sbid, args.mstype)
-    os.system("rm casa*.log")
-
-
-
-
-
+    if args.stage is not None:
+        sbid = args.sbid if args.sbid.startswith("SB") else "SB{:0>6}".format(args.sbid)
+        success = run_stage(sbid, args.beam, args.stage, args.mstype, args.flagmode, args.singlepol)
+        sys.exit(0 if success else 1)
 
+    split_bpcal_allscam(args.sbid, args.mstype, args.flagmode, args.singlepol)
+    os.system("rm casa*.log")
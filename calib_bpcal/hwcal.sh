@@ -1,5 +1,5 @@
 #!/bin/bash
 sbid=$1
+shift
 
-./extract_bpscan.py -sbid $sbid
-./bpscan_cal.py -sbid $sbid
\ No newline at end of file
+./run_hwcal.py -sbid $sbid "$@"
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+"""
+run the bandpass calibration for all beams of a schedule block in parallel
+
+each beam goes through split -> polsum -> initweights -> fix_dir -> calibrate,
+every stage is a subprocess with its exit code and output recorded, and a
+beam resumes from the first stage that has not finished successfully
+"""
+
+from extract_bpscan import get_sbidcalpath, get_bpscanms_path
+from bpscan_cal import _calibration_cmd
+import bpcal_cfg as cfg # configuration file
+
+import os
+import sys
+import json
+import time
+import shlex
+import contextlib
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+log = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+STAGES = ("split", "polsum", "initweights", "fix_dir", "calibrate")
+### stages limited by disk access rather than cpu
+IO_STAGES = ("split", "polsum", "initweights")
+
+EXTRACT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extract_bpscan.py")
+
+def get_pipeline_path(sbid, beam):
+    """
+    folder for logs and stage records of a beam, outside the beam folder which is cleared by split
+    """
+    return "{}/{}/pipeline/{:0>2}".format(cfg.CALIBRATION_PATH, sbid, beam)
+
+def stage_cmd(sbid, beam, stage, mstype="single", flagmode="and", singlepol=False):
+    """
+    command (as a list) to run a stage for a beam
+    """
+    if stage in IO_STAGES:
+        cmd = [
+            sys.executable, EXTRACT_SCRIPT, "-sbid", sbid, "-beam", str(beam),
+            "-stage", stage, "-mstype", mstype, "-flagmode", flagmode,
+        ]
+        if singlepol: cmd.append("-singlepol")
+        return cmd
+    if stage == "fix_dir":
+        return [cfg.FIX_DIR_PATH, get_bpscanms_path(get_sbidcalpath(sbid), beam)]
+    if stage == "calibrate":
+        return shlex.split(_calibration_cmd(sbid, beam))
+    raise ValueError("unknown stage {}...".format(stage))
+
+def load_state(statepath):
+    if not os.path.exists(statepath): return dict(completed=[], records=[])
+    with open(statepath) as fp:
+        return json.load(fp)
+
+def save_state(statepath, state):
+    with open(statepath, "w") as fp:
+        json.dump(state, fp, indent=2)
+
+class PipelineRunner:
+    """
+    run the calibration chain of beams in parallel
+
+    at most `ncpu` beams are processed at the same time, and at most `nio`
+    of them can be in the disk heavy stages (split, polsum and initweights)
+    """
+    def __init__(self, sbid, ncpu=8, nio=4, resume=True, mstype="single", flagmode="and", singlepol=False):
+        if isinstance(sbid, int): sbid = str(sbid)
+        if not sbid.startswith("SB"): sbid = "SB{:0>6}".format(sbid)
+        self.sbid = sbid
+        self.ncpu = ncpu
+        self.resume = resume
+        self.stageopts = dict(mstype=mstype, flagmode=flagmode, singlepol=singlepol)
+        self.iolock = threading.BoundedSemaphore(nio)
+
+    def _run_stage(self, beam, stage, pipepath):
+        cmd = stage_cmd(self.sbid, beam, stage, **self.stageopts)
+        logpath = "{}/{}.log".format(pipepath, stage)
+        record = dict(stage=stage, cmd=cmd, log=logpath, returncode=None, start=time.time(), elapsed=None)
+
+        log.info("BEAM{:0>2} - running {}...".format(beam, stage))
+        with open(logpath, "w") as logfp:
+            # run in the pipeline folder so that casa logs of different beams do not mix
+            try:
+                with self.iolock if stage in IO_STAGES else contextlib.nullcontext():
+                    record["start"] = time.time()
+                    proc = subprocess.run(cmd, stdout=logfp, stderr=subprocess.STDOUT, cwd=pipepath)
+                record["returncode"] = proc.returncode
+            except OSError as error:
+                logfp.write("failed to launch {}: {}\n".format(cmd, error))
+                record["returncode"] = -1
+
+        record["elapsed"] = time.time() - record["start"]
+        return record
+
+    def run_beam(self, beam):
+        """
+        run all remaining stages of a beam, return the final state of the beam
+        """
+        pipepath = get_pipeline_path(self.sbid, beam)
+        if not os.path.exists(pipepath): os.makedirs(pipepath)
+        statepath = "{}/state.json".format(pipepath)
+
+        state = load_state(statepath) if self.resume else dict(completed=[], records=[])
+        # stages are only valid if all stages before them are done
+        ndone = 0
+        while ndone < len(STAGES) and STAGES[ndone] in state["completed"]: ndone += 1
+        state["completed"] = list(STAGES[:ndone])
+        if ndone > 0: log.info("BEAM{:0>2} - resuming after {}...".format(beam, STAGES[ndone - 1]))
+
+        for stage in STAGES[ndone:]:
+            record = self._run_stage(beam, stage, pipepath)
+            state["records"].append(record)
+            if record["returncode"] != 0:
+                log.warning("BEAM{:0>2} - {} failed with exit code {}, check {}...".format(
+                    beam, stage, record["returncode"], record["log"],
+                ))
+                save_state(statepath, state)
+                break
+            state["completed"].append(stage)
+            save_state(statepath, state)
+
+        state["beam"] = beam
+        state["status"] = "success" if len(state["completed"]) == len(STAGES) else "failed"
+        return state
+
+    def run(self, beams=range(36)):
+        beams = list(beams)
+        log.info("calibrating {} beam(s) of {} with {} worker(s)...".format(len(beams), self.sbid, self.ncpu))
+        start = time.time()
+
+        with ThreadPoolExecutor(self.ncpu) as executor:
+            states = list(executor.map(self.run_beam, beams))
+
+        failed = [state["beam"] for state in states if state["status"] != "success"]
+        log.info("{}/{} beam(s) calibrated in {:.1f}s...".format(len(beams) - len(failed), len(beams), time.time() - start))
+        if failed: log.warning("failed beam(s): {}".format(failed))
+
+        summary = dict(sbid=self.sbid, elapsed=time.time() - start, beams=states)
+        with open("{}/{}/pipeline/summary.json".format(cfg.CALIBRATION_PATH, self.sbid), "w") as fp:
+            json.dump(summary, fp, indent=2)
+        return states
+
+if __name__ == "__main__":
+    a = argparse.ArgumentParser()
+    a.add_argument(
+        "-sbid", type=str, help="Schedule block used for calibration",
+    )
+    a.add_argument(
+        "-mstype", type=str, help="Type of the measurement sets, either full or single", default="single"
+    )
+    a.add_argument(
+        "-flagmode", type=str, help="Flag a summed sample if `and` all or `or` any polarisation is flagged", default="and"
+    )
+    a.add_argument(
+        "-singlepol", action="store_true", help="Write a single polarisation measurement set after summing"
+    )
+    a.add_argument(
+        "-ncpu", type=int, help="Number of beams processed in parallel", default=8
+    )
+    a.add_argument(
+        "-nio", type=int, help="Number of beams allowed in split/polsum/initweights at the same time", default=4
+    )
+    a.add_argument(
+        "-beams", type=int, nargs="+", help="Beams to calibrate", default=list(range(36))
+    )
+    a.add_argument(
+        "-noresume", action="store_true", help="Run all stages even if they finished before"
+    )
+    args = a.parse_args()
+
+    runner = PipelineRunner(
+        args.sbid, ncpu=args.ncpu, nio=args.nio, resume=not args.noresume,
+        mstype=args.mstype, flagmode=args.flagmode, singlepol=args.singlepol,
+    )
+    states = runner.run(args.beams)
+    sys.exit(0 if all(state["status"] == "success" for state in states) else 1)
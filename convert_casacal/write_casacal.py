@@ -1,6 +1,9 @@
 from casacore import tables
 import numpy as np
+import multiprocessing
 import pickle
+import shutil
+import os
 
 def load_pickle_data(fname):
     with open(fname, "rb") as fp:
@@ -167,3 +170,89 @@ def make_full_casabp(calpath, bp, freqs, datapath="./data", refant=None):
     })
 
     t.close()
+
+def get_template_casabp(nant, nchan, datapath="./data", templatedir=None):
+    """
+    path of a template bandpass table with `nant` antennas and `nchan` channels
+
+    the template is made with `make_full_casabp` the first time and reused
+    afterwards, it is cached on disk in `templatedir` (default to `{datapath}/template`)
+    """
+    if templatedir is None: templatedir = f"{datapath}/template"
+    templatepath = f"{templatedir}/template_nant{nant}_nchan{nchan}.B0"
+
+    if not os.path.exists(f"{templatepath}/table.dat"):
+        if not os.path.exists(templatedir): os.makedirs(templatedir)
+        # build in a temporary folder first, so that other processes never see a partial template
+        tmppath = f"{templatepath}.{os.getpid()}.tmp"
+        bp = np.ones((1, nant, nchan, 4), dtype=np.complex64)
+        make_full_casabp(tmppath, bp, np.arange(nchan, dtype=float) + 1., datapath=datapath, refant=0)
+        try: os.rename(tmppath, templatepath)
+        except OSError: shutil.rmtree(tmppath) # made by another process already
+
+    return templatepath
+
+def write_casabp(calpath, bp, freqs, datapath="./data", refant=None, flag=None, snr=None, templatedir=None):
+    """
+    write a bandpass table by copying a template and updating changed columns only
+
+    `bp` has a shape of (1, nant, nchan, 4) as in `make_full_casabp`, `flag` and `snr`
+    (with a shape of (nant, nchan, 2)) keep the template values (unflagged, 10) if None
+    """
+    _, nant, nchan, npol = bp.shape
+    if refant is None:
+        refant = _work_refant(bp) # bp should be a 4d array
+
+    templatepath = get_template_casabp(nant, nchan, datapath=datapath, templatedir=templatedir)
+    if os.path.exists(calpath): shutil.rmtree(calpath)
+    tables.tablecopy(templatepath, calpath, deep=True)
+
+    tab = tables.table(calpath, readonly=False, ack=False)
+    tab.putcol("ANTENNA2", np.ones(nant, dtype=int) * refant)
+    tab.putcol("CPARAM", bp[..., [0, 3]][0])
+    if flag is not None: tab.putcol("FLAG", flag)
+    if snr is not None: tab.putcol("SNR", snr)
+    tab.close()
+
+    ### frequency related columns
+    chan_width = np.mean(freqs[1:] - freqs[:-1])
+    tab = tables.table(f"{calpath}/SPECTRAL_WINDOW", readonly=False, ack=False)
+    tab.putcol("CHAN_FREQ", np.array([freqs]))
+    tab.putcol("REF_FREQUENCY", np.array([freqs[0]]))
+    tab.putcol("CHAN_WIDTH", np.ones((1, nchan)) * chan_width)
+    tab.putcol("EFFECTIVE_BW", np.ones((1, nchan)) * chan_width)
+    tab.putcol("RESOLUTION", np.array([freqs]))
+    tab.putcol("TOTAL_BANDWIDTH", np.array([chan_width * nchan]))
+    tab.close()
+
+def _write_casabp_star(args):
+    calpath, bp, freqs, kwargs = args
+    # a bad beam (e.g., no reference antenna found) should not stop the others
+    try:
+        write_casabp(calpath, bp, freqs, **kwargs)
+    except Exception as error:
+        print(f"failed to write {calpath} - {error!r}...")
+        return None
+    return calpath
+
+def write_casabp_batch(calpaths, bps, freqs, datapath="./data", refants=None, templatedir=None, nworker=4):
+    """
+    write bandpass tables (e.g., one per beam) in parallel
+
+    `bps` is a list of bandpass arrays for `calpaths`, `freqs` is either shared or a list,
+    `refants` are worked out from the bandpass if None. tables failed to be written are None
+    in the returned list
+    """
+    if refants is None: refants = [None] * len(calpaths)
+    if not isinstance(freqs, (list, tuple)): freqs = [freqs] * len(calpaths)
+
+    ### make templates before starting the workers
+    for bp in bps:
+        get_template_casabp(bp.shape[1], bp.shape[2], datapath=datapath, templatedir=templatedir)
+
+    params = [
+        (calpath, bp, freq, dict(datapath=datapath, refant=refant, templatedir=templatedir))
+        for calpath, bp, freq, refant in zip(calpaths, bps, freqs, refants)
+    ]
+    with multiprocessing.Pool(nworker) as pool:
+        return pool.map(_write_casabp_star, params)
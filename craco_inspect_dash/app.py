@@ -5,6 +5,7 @@ import dash
 import dash_bootstrap_components as dbc
 from dash.dependencies import Input, Output, State
 
+import inspect_path # modules shared with `inspect_script`, before any page is imported
 from common import header, footer
 
 server = Flask(__name__)
@@ -2,6 +2,24 @@ import dash
 import dash_bootstrap_components as dbc
 from dash import html
 
+import numpy as np
+
+from collections import OrderedDict
+import threading
+import json
+import os
+
+import inspect_path # modules shared with `inspect_script`
+from baseline_index import getnant, baseline_pairs, auto_index, ant_baselines
+from uvfits_reader import UVFitsReader
+from chunkstore import ChunkedArray, INDEX_FNAME
+
+# measurement sets can only be inspected with python-casacore installed
+try:
+    from casacore import tables
+except ImportError:
+    tables = None
+
 def header():
     return dbc.NavbarSimple(
         brand="Craco Commissioning Data Inspection",
@@ -21,9 +39,805 @@ def footer():
     )
 
 
-class MeasurementSetLoader:
+### memory (in bytes) allowed for a single reduction over the visibility cube
+CHUNK_MEMORY_BUDGET = 256 * 1024**2
+### memory (in bytes) allowed for all visibility stores kept by the dashboard
+CACHE_MEMORY_BUDGET = 4 * 1024**3
+### maximum number of visibility stores kept by the dashboard
+CACHE_MAX_ENTRIES = 72
+### maximum number of pixels (time, frequency) sent to the browser for a single image
+PLOT_MAX_NX = 1600
+PLOT_MAX_NY = 800
+### write the valid integrations found by the dashboard to a sidecar file beside the data
+### (skipped if the folder is read-only, set CRACO_DASH_WRITE_INDEX=0 to turn it off)
+WRITE_INDEX = os.environ.get("CRACO_DASH_WRITE_INDEX", "1") == "1"
+### frequencies (in MHz) of the channels in uvfits npy files
+NPY_FREQ_RANGE = (743.4, 887.4)
+
+
+def block_mean(data, tfac=1, ffac=1):
+    """
+    average the last two axes (frequency, time) of `data` in blocks of `ffac` x `tfac`
+    the last block along each axis can be shorter than the others, nan values are ignored
+    """
+    if tfac <= 1 and ffac <= 1: return data
+
+    valid = np.isfinite(data)
+    data = np.where(valid, data, 0)
+    count = valid.astype(np.float32)
+
+    for fac, axis in ((ffac, -2), (tfac, -1)):
+        if fac <= 1: continue
+        idx = np.arange(0, data.shape[axis], fac)
+        data = np.add.reduceat(data, idx, axis=axis)
+        count = np.add.reduceat(count, idx, axis=axis)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return data / count
+
+
+def block_centre(n, fac):
+    """
+    central index of each block produced by `block_mean` on an axis with `n` samples
+    """
+    start = np.arange(0, n, fac)
+    end = np.minimum(start + fac, n)
+    return (start + end - 1) / 2
+
+
+def valid_end(tvalid):
+    """
+    number of integrations up to the last valid one (all of them if none is valid)
+    """
+    nonzero = np.nonzero(tvalid)[0]
+    return int(nonzero[-1]) + 1 if nonzero.size > 0 else len(tvalid)
+
+
+def resident_nbytes(*objs):
+    """
+    memory held by arrays (or anything with `nbytes`) kept in memory, None is skipped
+    """
+    return int(sum(obj.nbytes for obj in objs if obj is not None))
+
+
+class UVFitsNpyLoader:
+    """
+    memory-mapped store for `output_beamXX.uvfits.npy` files
+
+    the file is opened with `mmap_mode`, amplitude and phase are only
+    computed for the slice a callback asks for, reductions over baselines
+    are done block by block so that no full-size float copy is kept.
+    the reduction pyramid is built (or read from beside the data) on first use
+    """
+
+    def __init__(self, npyfname, pol=0, membudget=CHUNK_MEMORY_BUDGET, writeindex=WRITE_INDEX):
+        self.npyfname = npyfname
+        self.pol = pol
+        self.membudget = membudget
+        self.writeindex = writeindex
+        self._pyramid = None
+        self._pyramid_lock = threading.Lock()
+
+        self.uvdata = self._open_data(pol)
+        self._ntraw = self.shape[-1]
+
+        ### some data contains zeros at the end (or gaps in the middle)
+        ### the end is only stripped with an exact mask (from the index or a full pass)
+        self.index_loaded = self._read_index()
+        if self.index_loaded:
+            self._strip_invalid_end()
+        else:
+            # a hint only, refined over all raw integrations by the reduction pass
+            self.tvalid = self._probe_valid_integrations()
+
+        self._init_metadata()
+
+    def _strip_invalid_end(self):
+        nvalid = valid_end(self.tvalid)
+        self._cut_time(nvalid)
+        self.tvalid = self.tvalid[:nvalid]
+
+    def _cut_time(self, nt):
+        self.uvdata = self.uvdata[:, :, :nt]
+
+    def set_valid_integrations(self, tvalid):
+        """
+        exact validity mask over all raw integrations, strip the invalid end and write the index (if allowed)
+        """
+        self.tvalid = np.asarray(tvalid, dtype=bool)
+        self._strip_invalid_end()
+        self.index_loaded = True
+        if self.writeindex: self.write_index()
+
+    def _init_metadata(self):
+        # baselines are in the dense baseline id order (with auto-correlation)
+        self.nant = getnant(self.nbl)
+        self.blpairs = baseline_pairs(self.nant)
+        self.freqs = np.linspace(*NPY_FREQ_RANGE, self.nfreq)
+
+    def _open_data(self, pol):
+        # data is stored as (nbl, nfreq, npol, nt)
+        return np.load(self.npyfname, mmap_mode="r")[:, :, pol, :]
+
+    @property
+    def indexfname(self):
+        return "{}.index.json".format(self.npyfname)
+
+    @property
+    def pyramidfname(self):
+        return "{}.pol{}.pyramid.npz".format(self.npyfname, self.pol)
+
+    def _data_mtime(self):
+        return os.path.getmtime(self.npyfname)
+
+    def _read_index(self):
+        """
+        read valid integrations from the sidecar index if it is newer than the data
+        """
+        if not os.path.exists(self.indexfname): return False
+        if os.path.getmtime(self.indexfname) < self._data_mtime(): return False
+
+        with open(self.indexfname) as fp:
+            index = json.load(fp)
+        if index["nt"] != self._ntraw: return False
+
+        self.tvalid = np.ones(index["nt"], dtype=bool)
+        for start, end in index["invalid_ranges"]:
+            self.tvalid[start:end] = False
+        return True
+
+    def write_index(self):
+        """
+        write valid integrations to a sidecar index beside the `.npy` file
+        """
+        invalid = np.diff(np.concatenate([[0], (~self.tvalid).astype(int), [0]]))
+        starts = np.nonzero(invalid == 1)[0]; ends = np.nonzero(invalid == -1)[0]
+        # integrations stripped from the end are invalid as well
+        ntraw = int(self._ntraw)
+        invalid_ranges = [[int(s), int(e)] for s, e in zip(starts, ends)]
+        if ntraw > self.nt: invalid_ranges.append([int(self.nt), ntraw])
+
+        try:
+            with open(self.indexfname, "w") as fp:
+                json.dump({"nt": ntraw, "invalid_ranges": invalid_ranges}, fp)
+        except OSError:
+            print("cannot write index file {}...".format(self.indexfname))
+
+    def _probe_valid_integrations(self, nprobe_bl=8, nprobe_freq=32):
+        """
+        find integrations containing data from a few baselines and channels
+        each (baseline, channel) is contiguous in time, so only a small part of the file is read
+        it can miss data on other baselines, so nothing is stripped with it
+        """
+        nbl, nfreq, _ = self.uvdata.shape
+        probe_bl = np.unique(np.linspace(0, nbl - 1, nprobe_bl).astype(int))
+        probe_freq = np.unique(np.linspace(0, nfreq - 1, nprobe_freq).astype(int))
+        probe = self.uvdata[np.ix_(probe_bl, probe_freq)]
+        return np.any(probe != 0, axis=(0, 1))
+
+    @property
+    def shape(self):
+        return self.uvdata.shape
+
+    @property
+    def nbytes(self):
+        """
+        memory held by the store itself, memory-mapped pages are managed by the OS
+        """
+        return resident_nbytes(self.tvalid, self.blpairs, self.freqs, self._pyramid)
+
+    def close(self):
+        """
+        drop the data, the file is unmapped once no slice of it is in use
+        """
+        self.uvdata = None
+
+    @property
+    def pyramid(self):
+        with self._pyramid_lock:
+            if self._pyramid is None: self.build_pyramid()
+        return self._pyramid
+
+    def build_pyramid(self):
+        """
+        reuse the pyramid saved beside the data if it is up to date, otherwise build (and save) it
+        """
+        self._pyramid = self._load_pyramid()
+        if self._pyramid is None:
+            self._pyramid = ReductionPyramid(self, auto_index(self.blpairs))
+            if self.writeindex: self._save_pyramid()
+        return self._pyramid
+
+    def _load_pyramid(self):
+        fname = self.pyramidfname
+        if fname is None or not os.path.exists(fname): return None
+        if os.path.getmtime(fname) < self._data_mtime(): return None
+        try:
+            pyramid, ntraw = ReductionPyramid.load(fname)
+        except (OSError, KeyError, ValueError):
+            print("cannot read pyramid file {}...".format(fname))
+            return None
+        if ntraw != self._ntraw or (pyramid.nbl, pyramid.nfreq) != (self.nbl, self.nfreq): return None
+
+        # the pyramid was built with the exact validity mask
+        if not self.index_loaded:
+            tvalid = np.zeros(self._ntraw, dtype=bool); tvalid[:pyramid.nt] = pyramid.tvalid
+            self.set_valid_integrations(tvalid)
+        if pyramid.nt != self.nt: return None
+        print("reading reduction pyramid from {}...".format(fname))
+        return pyramid
+
+    def _save_pyramid(self):
+        fname = self.pyramidfname
+        if fname is None: return
+        try:
+            # written to a temporary file first, a partial file is never read
+            with open(fname + ".tmp", "wb") as fp:
+                self._pyramid.save(fp, self._ntraw)
+            os.replace(fname + ".tmp", fname)
+        except OSError:
+            print("cannot write pyramid file {}...".format(fname))
+
+    @property
+    def itemsize(self):
+        return self.uvdata.itemsize
+
+    @property
+    def nbl(self):
+        return self.shape[0]
+
+    @property
+    def nfreq(self):
+        return self.shape[1]
+
+    @property
+    def nt(self):
+        return self.shape[2]
+
+    def _chunk_nbl(self):
+        # number of baselines can be processed within the memory budget
+        blbytes = self.nfreq * self.nt * self.itemsize
+        return max(1, int(self.membudget // blbytes))
+
+    def _bl_chunks(self, bl):
+        bl = np.arange(self.nbl) if bl is None else np.atleast_1d(bl)
+        nchunk = self._chunk_nbl()
+        for i in range(0, bl.shape[0], nchunk):
+            yield bl[i:i+nchunk]
+
+    def _reduction_chunks(self):
+        """
+        (baselines, integrations) blocks for a full pass, each baseline is contiguous in time
+        """
+        for blchunk in self._bl_chunks(None):
+            yield blchunk, slice(None)
+
+    def get_slice(self, bl=slice(None), freq=slice(None), time=slice(None)):
+        """
+        read a (baseline, frequency, time) slice of the complex visibilities
+        `freq` and `time` are applied first so only the requested window is read
+        """
+        return self.uvdata[:, freq, time][bl]
+
+    def amp(self, bl=slice(None), freq=slice(None), time=slice(None)):
+        return np.abs(self.get_slice(bl, freq, time))
+
+    def angle(self, bl=slice(None), freq=slice(None), time=slice(None)):
+        return np.angle(self.get_slice(bl, freq, time))
+
+    def blmean_amp(self, bl=None, freq=slice(None), time=slice(None)):
+        """
+        mean amplitude over baselines in `bl` (all baselines if None)
+        the returned array has a shape of (nfreq, nt)
+        """
+        blsum = None; nbl = 0
+        for blchunk in self._bl_chunks(bl):
+            chunksum = self.amp(blchunk, freq, time).sum(axis=0)
+            blsum = chunksum if blsum is None else blsum + chunksum
+            nbl += blchunk.shape[0]
+        return blsum / nbl
+
+
+class UVFitsRawLoader(UVFitsNpyLoader):
+    """
+    store reading a uvfits file directly without converting it to npy
+
+    visibilities are a strided view of the memory-mapped file, which is
+    ordered by integration, so full passes are done block by block in time
+    """
+
+    def __init__(self, uvfitsfname, pol=0, membudget=CHUNK_MEMORY_BUDGET):
+        self.reader = UVFitsReader(uvfitsfname)
+        super().__init__(uvfitsfname, pol=pol, membudget=membudget)
+
+    def _init_metadata(self):
+        self.nant = self.reader.nant
+        self.blpairs = self.reader.blpairs
+        self.freqs = self.reader.freqs / 1e6 # in MHz
+
+    def _open_data(self, pol):
+        # (nt, nbl, nfreq, npol) in the file, (nbl, nfreq, nt) for the dashboard
+        return self.reader.vis[..., pol].transpose(1, 2, 0)
+
+    def close(self):
+        super().close()
+        self.reader = None
+
+    def _probe_valid_integrations(self, nprobe_bl=8, nprobe_freq=32):
+        # each (baseline, channel) is spread over the whole file, leave it to the reduction pass
+        return np.ones(self.uvdata.shape[-1], dtype=bool)
+
+    def _reduction_chunks(self):
+        """
+        (baselines, integrations) blocks for a full pass, each integration is contiguous in the file
+        """
+        intbytes = self.nbl * self.nfreq * np.dtype(np.complex64).itemsize
+        ntchunk = max(1, int(self.membudget // intbytes))
+        for t0 in range(0, self.nt, ntchunk):
+            yield np.arange(self.nbl), slice(t0, min(t0 + ntchunk, self.nt))
+
+
+class ChunkedStoreLoader(UVFitsNpyLoader):
+    """
+    store reading a chunked (nbl, nfreq, npol, nt) store written by `chunkstore`
+
+    only chunks overlapping a slice are read, and the hint of valid
+    integrations comes from the per-chunk summaries instead of the data
+    """
+
+    def __init__(self, storepath, pol=0, membudget=CHUNK_MEMORY_BUDGET, writeindex=WRITE_INDEX):
+        super().__init__(storepath, pol=pol, membudget=membudget, writeindex=writeindex)
+
+    def _data_mtime(self):
+        # the index of the store is written after all of its chunks
+        return os.path.getmtime("{}/{}".format(self.npyfname, INDEX_FNAME))
+
+    def _open_data(self, pol):
+        store = ChunkedArray(self.npyfname)
+        self._nt = store.shape[-1]
+        return store
+
+    def _cut_time(self, nt):
+        self._nt = nt
+
+    def _probe_valid_integrations(self, nprobe_bl=8, nprobe_freq=32):
+        # summaries cover all baselines and channels, so the probe sizes are not used
+        # a time chunk has no data if the maximum amplitude over all of its chunks is zero
+        ntchunk = self.uvdata.chunks[-1]
+        tvalid = np.zeros(self._nt, dtype=bool)
+        for t0 in range(0, self._nt, ntchunk):
+            tsummary = self.uvdata.range_summary((slice(None), slice(None), self.pol, slice(t0, t0 + ntchunk)))
+            tvalid[t0:t0 + ntchunk] = tsummary["count"] > 0 and tsummary["max"] > 0
+        return tvalid
+
+    def _init_metadata(self):
+        attrs = self.uvdata.attrs
+        if "blpairs" in attrs:
+            self.blpairs = np.array(attrs["blpairs"]); self.nant = int(self.blpairs.max()) + 1
+        else:
+            self.nant = getnant(self.nbl); self.blpairs = baseline_pairs(self.nant)
+        self.freqs = np.array(attrs["freqs"]) if "freqs" in attrs else np.linspace(*NPY_FREQ_RANGE, self.nfreq)
+
+    @property
+    def shape(self):
+        return (self.uvdata.shape[0], self.uvdata.shape[1], self._nt)
+
+    def _reduction_chunks(self):
+        """
+        (baselines, integrations) blocks aligned to the chunks of the store
+        """
+        nblchunk, _, _, ntchunk = self.uvdata.chunks
+        tilebytes = nblchunk * self.nfreq * ntchunk * self.itemsize
+        ntchunk *= max(1, int(self.membudget // tilebytes))
+        for b0 in range(0, self.nbl, nblchunk):
+            for t0 in range(0, self.nt, ntchunk):
+                yield np.arange(b0, min(b0 + nblchunk, self.nbl)), slice(t0, min(t0 + ntchunk, self.nt))
+
+    def get_slice(self, bl=slice(None), freq=slice(None), time=slice(None)):
+        """
+        read a (baseline, frequency, time) slice of the complex visibilities
+        """
+        return self.uvdata[bl, freq, self.pol, np.arange(self.nt)[time]]
+
+
+class ReductionPyramid:
+    """
+    reductions of a visibility store built with a single pass at load time
+
+    it holds the baseline-averaged waterfalls for cross, auto and all
+    correlations (with 2x, 4x, 8x... time-frequency decimations), and the
+    per-baseline mean spectra and lightcurves. per-antenna products are
+    derived from the per-baseline ones
+    """
+
+    CORR_TYPES = ("cross", "auto", "all")
+
+    def __init__(self, uvstore, auto_bidx, minsize=32):
+        nbl, nfreq, nt = uvstore.shape
+        self.nbl, self.nfreq, self.nt = nbl, nfreq, nt
+
+        self.auto_bidx = np.array(auto_bidx, dtype=int)
+        isauto = np.zeros(nbl, dtype=bool); isauto[self.auto_bidx] = True
+
+        blsum = {corr: np.zeros((nfreq, nt)) for corr in self.CORR_TYPES}
+        blcount = {"all": nbl, "auto": isauto.sum(), "cross": (~isauto).sum()}
+        self.bl_spectra = np.zeros((nbl, nfreq), dtype=np.float32)
+        self.bl_lightcurves = np.zeros((nbl, nt), dtype=np.float32)
+        tnonzero = np.zeros(nt, dtype=bool)
+
+        print("building reduction pyramid...")
+        # blocks cover either all integrations of some baselines, or all baselines of some integrations
+        for blchunk, tchunk in uvstore._reduction_chunks():
+            chunkamp = uvstore.amp(blchunk, time=tchunk)
+            chunkauto = isauto[blchunk]
+
+            blsum["all"][:, tchunk] += chunkamp.sum(axis=0)
+            blsum["auto"][:, tchunk] += chunkamp[chunkauto].sum(axis=0)
+            blsum["cross"][:, tchunk] += chunkamp[~chunkauto].sum(axis=0)
+
+            # invalid integrations are zeros, so sums are not affected by them
+            self.bl_spectra[blchunk] += chunkamp.sum(axis=2)
+            self.bl_lightcurves[blchunk, tchunk] = chunkamp.mean(axis=1)
+            tnonzero[tchunk] |= np.any(chunkamp != 0, axis=(0, 1))
+
+        ### exact validity mask from the full pass - update the store and its index
+        if not uvstore.index_loaded:
+            uvstore.set_valid_integrations(tnonzero)
+            # the store can be shorter after stripping the invalid end
+            nt = self.nt = uvstore.nt
+            blsum = {corr: wf[:, :nt] for corr, wf in blsum.items()}
+            self.bl_lightcurves = self.bl_lightcurves[:, :nt]
+        self.tvalid = uvstore.tvalid
+        self.bl_spectra /= max(self.tvalid.sum(), 1)
+        self.bl_lightcurves[:, ~self.tvalid] = np.nan
+
+        ### number of levels - decimate until both axes are shorter than `minsize`
+        self.nlevel = 1
+        while max(nfreq, nt) / 2**self.nlevel >= minsize:
+            self.nlevel += 1
+
+        self.waterfalls = {}
+        for corr in self.CORR_TYPES:
+            if blcount[corr] == 0: continue
+            base = (blsum[corr] / blcount[corr]).astype(np.float32)
+            base[:, ~self.tvalid] = np.nan
+            self.waterfalls[corr] = [base] + [
+                block_mean(base, 2**level, 2**level).astype(np.float32)
+                for level in range(1, self.nlevel)
+            ]
+
+    def save(self, fname, ntraw):
+        """
+        save the pyramid to a `.npz` file, `ntraw` is the number of integrations of the data before stripping
+        """
+        arrays = dict(
+            ntraw=ntraw, shape=(self.nbl, self.nfreq, self.nt), nlevel=self.nlevel, auto_bidx=self.auto_bidx,
+            tvalid=self.tvalid, bl_spectra=self.bl_spectra, bl_lightcurves=self.bl_lightcurves,
+        )
+        for corr, levels in self.waterfalls.items():
+            for level, waterfall in enumerate(levels):
+                arrays["waterfall_{}_{}".format(corr, level)] = waterfall
+        np.savez(fname, **arrays)
+
+    @classmethod
+    def load(cls, fname):
+        """
+        read a pyramid saved by `save`, return the pyramid and `ntraw`
+        """
+        pyramid = cls.__new__(cls)
+        with np.load(fname) as data:
+            pyramid.nbl, pyramid.nfreq, pyramid.nt = (int(n) for n in data["shape"])
+            pyramid.nlevel = int(data["nlevel"])
+            pyramid.auto_bidx = data["auto_bidx"]; pyramid.tvalid = data["tvalid"]
+            pyramid.bl_spectra = data["bl_spectra"]; pyramid.bl_lightcurves = data["bl_lightcurves"]
+            pyramid.waterfalls = {
+                corr: [data["waterfall_{}_{}".format(corr, level)] for level in range(pyramid.nlevel)]
+                for corr in cls.CORR_TYPES if "waterfall_{}_0".format(corr) in data
+            }
+            ntraw = int(data["ntraw"])
+        return pyramid, ntraw
+
+    @property
+    def nbytes(self):
+        wfbytes = sum(wf.nbytes for levels in self.waterfalls.values() for wf in levels)
+        return wfbytes + self.bl_spectra.nbytes + self.bl_lightcurves.nbytes
+
+    def choose_level(self, nt_window, nfreq_window, maxnx=PLOT_MAX_NX, maxny=PLOT_MAX_NY):
+        """
+        the finest level showing a (nt_window, nfreq_window) window within (maxnx, maxny) pixels
+        """
+        level = 0
+        while level < self.nlevel - 1 and (
+            nt_window / 2**level > maxnx or nfreq_window / 2**level > maxny
+        ):
+            level += 1
+        return level
+
+    def get_waterfall(self, corr, level=0, tsel=None, fsel=None):
+        """
+        cut a window from the waterfall at a given level
+
+        `tsel` and `fsel` are (start, end) integration and channel index
+        return the waterfall, and the central integration/channel of each pixel
+        """
+        fac = 2**level
+        t0, t1 = (0, self.nt) if tsel is None else tsel
+        f0, f1 = (0, self.nfreq) if fsel is None else fsel
+
+        tslice = slice(t0 // fac, -(-t1 // fac))
+        fslice = slice(f0 // fac, -(-f1 // fac))
+
+        waterfall = self.waterfalls[corr][level][fslice, tslice]
+        tcentre = block_centre(self.nt, fac)[tslice]
+        fcentre = block_centre(self.nfreq, fac)[fslice]
+        return waterfall, tcentre, fcentre
+
+    def window_profiles(self, corr, tsel=None, fsel=None):
+        """
+        spectrum and lightcurve averaged over a (time, frequency) window at full resolution
+        """
+        t0, t1 = (0, self.nt) if tsel is None else tsel
+        f0, f1 = (0, self.nfreq) if fsel is None else fsel
+        waterfall = self.waterfalls[corr][0][f0:f1, t0:t1]
+        tvalid = self.tvalid[t0:t1]
+        if not tvalid.any():
+            return np.full(f1 - f0, np.nan), waterfall.mean(axis=0)
+        return waterfall[:, tvalid].mean(axis=1), waterfall.mean(axis=0)
+
+    def ant_profiles(self, blpairs):
+        """
+        per-antenna mean spectra and lightcurves of cross correlations
+        `blpairs` is the (ant1, ant2) of each baseline, with a shape of (2, nbl)
+        """
+        spectra = []; lightcurves = []
+        for crossbidx in ant_baselines(blpairs, auto=False):
+            spectra.append(self.bl_spectra[crossbidx].mean(axis=0))
+            lightcurves.append(self.bl_lightcurves[crossbidx].mean(axis=0))
+        return np.array(spectra), np.array(lightcurves)
+
+
+class UVDataCache:
+    """
+    server-side LRU cache for visibility stores keyed by (folder, beam)
+
+    stores are shared between sessions, each session only keeps the key of
+    the beam it is looking at. the least recently used store is evicted (and
+    closed) once the memory ceiling or the maximum number of entries is reached
+    """
+
+    def __init__(self, openfunc, membudget=CACHE_MEMORY_BUDGET, maxentries=CACHE_MAX_ENTRIES):
+        self.openfunc = openfunc # function to open a store with (folder, beam)
+        self.membudget = membudget
+        self.maxentries = maxentries
+
+        self._stores = OrderedDict()
+        self._lock = threading.Lock()
+        self._opened = threading.Condition(self._lock) # notified when a store has been opened
+        self._opening = set() # keys of stores being opened
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._stores)
+
+    def __contains__(self, key):
+        return tuple(key) in self._stores
+
+    @property
+    def nbytes(self):
+        return sum(store.nbytes for store in self._stores.values())
+
+    def get(self, folder, beam):
+        key = (folder, beam)
+        with self._lock:
+            # wait for another session opening the same store, it is opened only once
+            while key in self._opening: self._opened.wait()
+            if key in self._stores:
+                self.hits += 1
+                self._stores.move_to_end(key)
+                return self._stores[key]
+            self.misses += 1
+            self._opening.add(key)
+
+        # open outside the lock so sessions looking at other stores are not blocked
+        evicted = []
+        try:
+            store = self.openfunc(folder, beam)
+            with self._lock:
+                self._stores[key] = store
+                self._stores.move_to_end(key)
+                evicted = self._evict()
+        finally:
+            with self._lock:
+                self._opening.discard(key)
+                self._opened.notify_all()
+
+        for oldstore in evicted: oldstore.close()
+        return store
+
+    def _evict(self):
+        """
+        drop least recently used stores from the cache, return them to be closed outside the lock
+        """
+        evicted = []
+        while len(self._stores) > 1 and (
+            len(self._stores) > self.maxentries or self.nbytes > self.membudget
+        ):
+            key, store = self._stores.popitem(last=False)
+            evicted.append(store)
+            self.evictions += 1
+            print("evicting {} from the cache...".format(key))
+        return evicted
+
+    def clear(self):
+        with self._lock:
+            stores = list(self._stores.values())
+            self._stores.clear()
+        for store in stores: store.close()
+
+    def stats(self):
+        return dict(
+            hits=self.hits, misses=self.misses, evictions=self.evictions,
+            entries=len(self._stores), nbytes=self.nbytes, membudget=self.membudget,
+        )
+
+
+class MeasurementSetLoader(UVFitsNpyLoader):
+    """
+    store reading visibilities from a measurement set on demand
+
+    the table is opened once, and antennas, frequencies, baselines and the
+    time axis are cached when it is opened. rows are ordered by integration
+    then baseline, so a slice only reads the rows of the integrations (and
+    the channels) it needs, and reductions are done block by block in time
+    """
+
+    def __init__(self, mspath, pol=0, membudget=CHUNK_MEMORY_BUDGET, datacolumn="DATA"):
+        if tables is None: raise ImportError("python-casacore is required to read measurement sets...")
+        self.datacolumn = datacolumn
+        self._lock = threading.Lock() # casacore tables are not thread-safe
+        # measurement sets are not modified by the dashboard, the validity mask is kept in memory
+        super().__init__(mspath.rstrip("/"), pol=pol, membudget=membudget, writeindex=False)
+
+    @property
+    def mspath(self):
+        return self.npyfname
+
+    @property
+    def pyramidfname(self):
+        # nothing is written beside measurement sets, the pyramid is built each time the set is opened
+        return None
+
+    def _open_data(self, pol):
+        tab = tables.table(self.mspath, ack=False)
+        nrow = tab.nrows()
+
+        ### metadata from subtables
+        anttab = tables.table(f"{self.mspath}::ANTENNA", ack=False)
+        self.antnames = anttab.getcol("NAME")
+        anttab.close()
+        spwtab = tables.table(f"{self.mspath}::SPECTRAL_WINDOW", ack=False)
+        self.freqs = spwtab.getcol("CHAN_FREQ")[0] / 1e6 # in MHz
+        spwtab.close()
+
+        ### baselines from the rows of the first integration
+        nblmax = len(self.antnames) * (len(self.antnames) + 1) // 2
+        times = tab.getcol("TIME", startrow=0, nrow=min(nblmax, nrow))
+        nbl = int((times == times[0]).sum())
+        self.blpairs = np.array([
+            tab.getcol("ANTENNA1", startrow=0, nrow=nbl),
+            tab.getcol("ANTENNA2", startrow=0, nrow=nbl),
+        ])
+
+        ### time axis - one row per integration
+        self.times = tab.getcol("TIME", rowincr=nbl)[:nrow // nbl]
+        self._shape = (nbl, self.freqs.shape[0], self.times.shape[0])
+        return tab
+
+    def _read_index(self):
+        # valid integrations are found by the reduction pass each time the set is opened
+        return False
+
+    def _probe_valid_integrations(self, nprobe_bl=8, nprobe_freq=32):
+        # each (baseline, channel) is spread over all rows, leave it to the reduction pass
+        return np.ones(self._shape[-1], dtype=bool)
+
+    def _init_metadata(self):
+        self.nant = len(self.antnames)
+
+    def _cut_time(self, nt):
+        self.times = self.times[:nt]
+        self._shape = self._shape[:2] + (nt, )
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def itemsize(self):
+        return np.dtype(np.complex64).itemsize
+
+    @property
+    def nbytes(self):
+        return resident_nbytes(self.tvalid, self.blpairs, self.freqs, self.times, self._pyramid)
+
+    def _chunk_nt(self):
+        # number of integrations can be processed within the memory budget
+        intbytes = self.nbl * self.nfreq * self.itemsize
+        return max(1, int(self.membudget // intbytes))
+
+    def _reduction_chunks(self):
+        """
+        (baselines, integrations) blocks for a full pass, each integration is contiguous in rows
+        """
+        ntchunk = self._chunk_nt()
+        for t0 in range(0, self.nt, ntchunk):
+            yield np.arange(self.nbl), slice(t0, min(t0 + ntchunk, self.nt))
+
+    def _read(self, t0, t1, f0, f1, blrow=None):
+        """
+        read integrations [t0, t1) and channels [f0, f1) as a (nbl, nfreq, nt) array
+        only baseline `blrow` is read if it is not None
+        """
+        blc = [f0, self.pol]; trc = [f1 - 1, self.pol]
+        with self._lock:
+            if blrow is None:
+                data = self.uvdata.getcolslice(
+                    self.datacolumn, blc, trc, startrow=t0 * self.nbl, nrow=(t1 - t0) * self.nbl,
+                )
+            else:
+                data = self.uvdata.getcolslice(
+                    self.datacolumn, blc, trc, startrow=t0 * self.nbl + blrow, nrow=t1 - t0, rowincr=self.nbl,
+                )
+        data = data[..., 0].astype(np.complex64, copy=False)
+        nblread = self.nbl if blrow is None else 1
+        return data.reshape(t1 - t0, nblread, f1 - f0).transpose(1, 2, 0)
+
+    @staticmethod
+    def _span(sel, n):
+        """
+        covering [start, end) range of an index selection, and the selection relative to the start
+        """
+        idx = np.arange(n)[sel]
+        if idx.size == 0: return 0, 0, idx
+        start = int(idx.min())
+        return start, int(idx.max()) + 1, idx - start
+
+    def get_slice(self, bl=slice(None), freq=slice(None), time=slice(None)):
+        """
+        read a (baseline, frequency, time) slice of the complex visibilities
+        only rows of the selected integrations (and baselines if there are a few) are read
+        """
+        t0, t1, tidx = self._span(time, self.nt)
+        f0, f1, fidx = self._span(freq, self.nfreq)
+        blidx = np.arange(self.nbl)[bl]
+
+        if np.ndim(blidx) == 0:
+            return self._read(t0, t1, f0, f1, blrow=int(blidx))[0][fidx][..., tidx]
+
+        # a few baselines are read with a row stride, otherwise all rows of the integrations are read
+        if blidx.size <= max(1, self.nbl // 16):
+            data = np.array([self._read(t0, t1, f0, f1, blrow=int(b))[0] for b in blidx])
+        else:
+            data = self._read(t0, t1, f0, f1)[blidx]
+        return data[:, fidx][..., tidx]
 
-    def __init__(self, measurementsetpath):
-        ...
-        
+    def blmean_amp(self, bl=None, freq=slice(None), time=slice(None)):
+        """
+        mean amplitude over baselines in `bl` (all baselines if None)
+        the returned array has a shape of (nfreq, nt), rows are read in blocks of integrations
+        """
+        bl = np.arange(self.nbl) if bl is None else np.atleast_1d(bl)
+        tidx = np.arange(self.nt)[time]
+        ntchunk = self._chunk_nt()
+        return np.concatenate([
+            self.amp(bl, freq, tidx[i:i+ntchunk]).mean(axis=0)
+            for i in range(0, max(tidx.size, 1), ntchunk)
+        ], axis=-1)
 
+    def close(self):
+        with self._lock:
+            if self.uvdata is not None: self.uvdata.close()
+            self.uvdata = None
@@ -0,0 +1,11 @@
+"""
+make the modules shared with `inspect_script` (baseline indexing, readers, chunked stores) importable
+
+import this module before importing any of them, in the app and in every page using them
+"""
+
+import os
+import sys
+
+INSPECT_SCRIPT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "inspect_script"))
+if INSPECT_SCRIPT_PATH not in sys.path: sys.path.append(INSPECT_SCRIPT_PATH)
@@ -7,15 +7,80 @@ from dash.exceptions import PreventUpdate
 import plotly.express as px
 
 import numpy as np
-import json
+import os
 
-dash.register_page(__name__, title="UVFITS INSPECTION")
+import inspect_path # modules shared with `inspect_script`
+from common import UVFitsNpyLoader, UVFitsRawLoader, ChunkedStoreLoader, MeasurementSetLoader, UVDataCache
+from common import block_mean, block_centre, PLOT_MAX_NX, PLOT_MAX_NY
+from baseline_index import auto_index, cross_index
+from chunkstore import is_chunked
 
-with open("assets/30ants_465bls_idx.json") as fp:
-    bidx_info = json.load(fp)
+dash.register_page(__name__, title="UVFITS INSPECTION")
 
-# workout baseline index and baseline name mapping
-blnames = np.array([f"{_a1},{_a2}" for _bidx, (_a1, _a2) in bidx_info["bidx_ants"]])
+# workout baseline name mapping - antenna names are one indexed
+def get_blnames(blpairs):
+    return np.array([f"{_a1+1},{_a2+1}" for _a1, _a2 in zip(*blpairs)])
+
+def get_store_path(folder, beam):
+    return "{}/output_beam{}.uvfits.chunks".format(folder, beam)
+
+def is_direct_path(folder):
+    """
+    measurement sets and uvfits files are read directly, the beam number is not used for them
+    """
+    return folder.rstrip("/").endswith((".ms", ".uvfits"))
+
+def get_uvdata_key(folder, beam):
+    # direct paths are shared by all beam numbers, so that they are only opened once
+    if is_direct_path(folder): return {"folder": folder.rstrip("/"), "beam": None}
+    return {"folder": folder, "beam": "{:0>2}".format(beam)}
+
+def get_uvdata_label(uvdata_key):
+    if uvdata_key["beam"] is None: return os.path.basename(uvdata_key["folder"])
+    return "BEAM{}".format(uvdata_key["beam"])
+
+def open_uvstore(folder, beam):
+    folder = folder.rstrip("/") if is_direct_path(folder) else folder
+    if folder.endswith(".ms"):
+        print("Start to Loading data from {}".format(folder))
+        uvstore = MeasurementSetLoader(folder)
+    elif folder.endswith(".uvfits"):
+        print("Start to Loading data from {}".format(folder))
+        uvstore = UVFitsRawLoader(folder)
+    elif is_chunked(get_store_path(folder, beam)):
+        store_path = get_store_path(folder, beam)
+        print("Start to Loading data from {}".format(store_path))
+        uvstore = ChunkedStoreLoader(store_path)
+    else:
+        npy_fname = "{}/output_beam{}.uvfits.npy".format(folder, beam)
+        print("Start to Loading data from {}".format(npy_fname))
+        uvstore = UVFitsNpyLoader(npy_fname)
+    # the reduction pyramid is built (or read from beside the data) when it is first plotted
+    return uvstore
+
+# loaded beams are shared by all sessions, each session keeps its own (folder, beam) key
+uvcache = UVDataCache(open_uvstore)
+
+def get_uvstore(uvdata_key):
+    if uvdata_key is None: raise PreventUpdate
+    return uvcache.get(uvdata_key["folder"], uvdata_key["beam"])
+
+# correlation type in the dropdown and the one in the reduction pyramid
+corr_keys = {
+    "Cross Correlation": "cross",
+    "Auto Correlation": "auto",
+    "All Correlation": "all",
+}
+
+def window_index(axis, start, end):
+    """
+    convert a (start, end) range on a sorted axis to a (start, end) index range
+    """
+    i0 = np.searchsorted(axis, start, side="left")
+    i1 = np.searchsorted(axis, end, side="right")
+    i0 = int(min(max(i0, 0), len(axis) - 1))
+    i1 = int(min(max(i1, i0 + 1), len(axis)))
+    return i0, i1
 
 ### Layout functions...
 ### input field for npy files folder
@@ -23,7 +88,7 @@ def folder_input():
     return dbc.Container([dbc.Col(
         [
             dbc.Row(
-                html.H5("Please input the path of the folder that contains npy files..."),
+                html.H5("Please input the path of the folder that contains npy files (or a measurement set / uvfits file)..."),
                 style={"margin-top": "15px"},
                 ),
             dbc.Row(
@@ -103,19 +168,24 @@ def plot_button_layout():
             dbc.Col(dbc.Row([
                 dbc.Col(html.Button("Update", id="btn_update_waterfall", n_clicks=0)),
                 dbc.Col(dcc.Loading(id="waterfall_update_status"))
-            ]))
+            ])),
+            dbc.Col(
+                dcc.Checklist(["Zoom Aware"], value=["Zoom Aware"], id="zoom_aware_select")
+            ),
             # dbc.Col(html.Button("Update", id="btn_update_range", n_clicks=0)),
             # dbc.Col(html.Button("Reset", id="btn_reset_range", n_clicks=0)),
         ])
     )
 
 def diagnose_plot_layout():
+    # graphs are kept in the layout so that zooming can update them in place
     return dbc.Container(
         [
-            dbc.Row(id="water_fall_plot_contain"),
+            dcc.Store(id="waterfall_window"),
+            dbc.Row(dcc.Graph(id="water_fall_plot"), id="water_fall_plot_contain"),
             dbc.Row([
-                dbc.Col(id="spectrum_plot_contain"),
-                dbc.Col(id="lightcurve_plot_contain")
+                dbc.Col(dcc.Graph(id="spectrum_plot"), id="spectrum_plot_contain"),
+                dbc.Col(dcc.Graph(id="lightcurve_plot"), id="lightcurve_plot_contain")
             ])
         ]
     )
@@ -188,6 +258,7 @@ def selected_baseline_plot_layout():
     Output("tend_input", "value"),
     Output("tstart_input", "max"),
     Output("tend_input", "max"),
+    Output("uvdata_key", "data"),
     Input("btn_load_uvdata", "n_clicks"),
     State("folder_input", "value"),
     State("beam_input", "value"),
@@ -195,148 +266,178 @@ def selected_baseline_plot_layout():
 def load_uvfits_data(n_click, folder, beam):
     if n_click == 0: raise PreventUpdate
 
-    beam = "{:0>2}".format(beam)
-    npy_fname = "{}/output_beam{}.uvfits.npy".format(folder, beam)
+    uvdata_key = get_uvdata_key(folder, beam)
 
-    print("Start to Loading data from {}".format(npy_fname))
+    uvstore = get_uvstore(uvdata_key)
+    # without an index, the valid integrations are only known after the reduction pass
+    if not uvstore.index_loaded: uvstore.pyramid
+    nt = uvstore.nt
 
-    uvdata = np.load(npy_fname)[:, :, 0, :]
+    cachestats = uvcache.stats()
+    status = "{} SUCCESSFUL! (cache - {} hits, {} misses, {} beams)".format(
+        get_uvdata_label(uvdata_key),
+        cachestats["hits"], cachestats["misses"], cachestats["entries"]
+    )
 
-    ### some data contains zeros at the end - strip them
-    timeseries = np.abs(uvdata).mean(axis=0).mean(axis=0)
-    nsamp = len(timeseries)
+    return 0, status, nt, nt, nt, uvdata_key
 
-    for i in range(nsamp):
-        if timeseries[-i-1] != 0: 
-            cut = i; break
-    uvdata = uvdata[:, :, :nsamp-cut].copy()
 
-    datashape = uvdata.shape
+def zoom_window(relayout, window, tlim, flim):
+    """
+    update the (time, frequency) window of the waterfall with a relayout event
+    """
+    window = dict(window)
+    if relayout is None: return window
 
-    global nbl, nfreq, nt 
-    nbl, nfreq, nt = datashape
+    for axis, key, lim in (("xaxis", "trange", tlim), ("yaxis", "frange", flim)):
+        if relayout.get(f"{axis}.autorange"):
+            window[key] = list(lim)
+        elif f"{axis}.range[0]" in relayout:
+            window[key] = [relayout[f"{axis}.range[0]"], relayout[f"{axis}.range[1]"]]
+        elif f"{axis}.range" in relayout:
+            window[key] = list(relayout[f"{axis}.range"])
 
-    global uvdata_amp, uvdata_angle
-    uvdata_amp = np.abs(uvdata)
-    uvdata_angle = np.angle(uvdata)
+        # plotly can return the range in reversed order
+        window[key] = [float(max(min(window[key]), lim[0])), float(min(max(window[key]), lim[1]))]
 
-    global beam_idx
-    beam_idx = beam
+    return window
 
-    return 0, "BEAM{} SUCCESSFUL!".format(beam), nt, nt, nt
 
+def make_diagnose_figures(pyramid, window, fs, label):
+    """
+    make waterfall, spectrum and lightcurve for the (time, frequency) window only
+    """
+    corr_type = window["corr_type"]
+    corr = corr_keys[corr_type]
 
-@callback(
-    Output("btn_plot", "n_clicks"),
-    Output("water_fall_plot_contain", "children"),
-    Output("spectrum_plot_contain", "children"),
-    Output("lightcurve_plot_contain", "children"), 
-    Output("waterfall_plot_status", "children"),
-    State("freqstart_input", "value"),
-    State("freqend_input", "value"),
-    State("tstart_input", "value"),
-    State("tend_input", "value"),
-    State("corr_data_type_select", "value"),
-    Input("btn_plot", "n_clicks"),
-)
-def plot_diagnose_plot(freqstart, freqend, tstart, tend, corr_type, n_clicks):
-    if n_clicks == 0: raise PreventUpdate
+    ts = np.arange(pyramid.nt)
+    tsel = window_index(ts, *window["trange"])
+    fsel = window_index(fs, *window["frange"])
 
-    # only select certain correlation 
-    if corr_type == "Cross Correlation":
-        uvdata_bl_ave = uvdata_amp[bidx_info["cross_bidx"], ...].mean(axis=0)
-    elif corr_type == "Auto Correlation":
-        uvdata_bl_ave = uvdata_amp[bidx_info["auto_bidx"], ...].mean(axis=0)
-    else:
-        uvdata_bl_ave = uvdata_amp.mean(axis=0)
+    ### read the pyramid level matching the window
+    level = pyramid.choose_level(tsel[1] - tsel[0], fsel[1] - fsel[0])
+    print("reading level {} of the reduction pyramid for {} {}...".format(level, tsel, fsel))
+    uvdata_bl_ave, tcentre, fcentre = pyramid.get_waterfall(corr, level, tsel, fsel)
+    spectrum_data, lightcurve_data = pyramid.window_profiles(corr, tsel, fsel)
 
-    print("averaging on baselines...")
-    ts = np.arange(nt)
-    fs = np.linspace(743.4, 887.4, 864)
+    tfac = int(np.ceil(lightcurve_data.shape[0] / PLOT_MAX_NX))
+    lightcurve_data = block_mean(lightcurve_data[None, :], tfac)[0]
+    lightcurve_ts = block_centre(tsel[1] - tsel[0], tfac) + tsel[0]
 
     print("start plotting...")
 
     waterfall = px.imshow(
         uvdata_bl_ave, origin="lower",
-        x=ts, y=fs,
+        x=tcentre, y=np.interp(fcentre, np.arange(fs.shape[0]), fs),
         aspect="auto",
     )
 
     waterfall.update_layout(
-        title_text="WaterFall Plot for BEAM{} - {}".format(beam_idx, corr_type),
+        title_text="WaterFall Plot for {} - {}".format(label, corr_type),
         title_x = 0.5
     )
 
     waterfall.update_xaxes(
         title_text='Time (Integration)',
-        range=[tstart-0.5, tend-0.5],
+        range=window["trange"],
     )
     waterfall.update_yaxes(
         title_text='Frequency (MHz)',
-        range=[freqstart, freqend], autorange=False,
+        range=window["frange"], autorange=False,
     )
 
     print("waterfall plotted!")
 
     spectrum = px.line(
-        x = fs, y = np.mean(uvdata_bl_ave, axis=1),
+        x = fs[fsel[0]:fsel[1]], y = spectrum_data,
     )
 
     spectrum.update_xaxes(
-        title_text='Frequency (MHz)', range=[freqstart, freqend]
+        title_text='Frequency (MHz)', range=window["frange"]
     )
     spectrum.update_yaxes(title_text='Amplitude (Unit)')
     spectrum.update_layout(
-        title_text="Spectrum for BEAM{} - {}".format(beam_idx, corr_type),
+        title_text="Spectrum for {} - {}".format(label, corr_type),
         title_x = 0.5
     )
 
     lightcurve = px.line(
-        x=ts, y=np.mean(uvdata_bl_ave, axis=0)
+        x=lightcurve_ts, y=lightcurve_data
     )
     lightcurve.update_xaxes(
-        title_text='Time (Integration)', range=[tstart, tend]
+        title_text='Time (Integration)', range=window["trange"]
     )
     lightcurve.update_yaxes(title_text='Amplitude (Unit)')
     lightcurve.update_layout(
-        title_text="Lightcurve for BEAM{} - {}".format(beam_idx, corr_type),
+        title_text="Lightcurve for {} - {}".format(label, corr_type),
         title_x = 0.5
     )
 
-
-    return (
-        0, dcc.Graph(id="water_fall_plot", figure=waterfall),
-        dcc.Graph(id="spectrum_plot", figure=spectrum, ),
-        dcc.Graph(id="lightcurve_plot", figure=lightcurve, ),
-        None,
-    )
+    return waterfall, spectrum, lightcurve
 
 
 @callback(
+    Output("btn_plot", "n_clicks"),
     Output("btn_update_waterfall", "n_clicks"),
+    Output("water_fall_plot", "figure"),
     Output("spectrum_plot", "figure"),
     Output("lightcurve_plot", "figure"),
-    State("water_fall_plot", "relayoutData"),
-    State("spectrum_plot", "figure"),
-    State("lightcurve_plot", "figure"),
+    Output("waterfall_plot_status", "children"),
+    Output("waterfall_window", "data"),
+    State("freqstart_input", "value"),
+    State("freqend_input", "value"),
+    State("tstart_input", "value"),
+    State("tend_input", "value"),
+    State("corr_data_type_select", "value"),
+    Input("btn_plot", "n_clicks"),
     Input("btn_update_waterfall", "n_clicks"),
+    Input("water_fall_plot", "relayoutData"),
+    State("zoom_aware_select", "value"),
+    State("waterfall_window", "data"),
+    State("uvdata_key", "data"),
 )
-def update_spectrum_lightcurve_layout(
-    waterfall_layout, spectrum, lightcurve, n_clicks
+def plot_diagnose_plot(
+    freqstart, freqend, tstart, tend, corr_type, 
+    n_clicks, n_update_clicks, waterfall_layout, zoom_aware, window, uvdata_key,
 ):
-    if n_clicks == 0: raise PreventUpdate
+    """
+    plot waterfall, spectrum and lightcurve with the input range (`Plot` button),
+    re-render the visible window when zooming (`Update` button, or in the zoom aware mode)
+    """
+    trigger = dash.callback_context.triggered_id
+
+    if trigger == "btn_plot":
+        if n_clicks == 0: raise PreventUpdate
+    elif trigger == "btn_update_waterfall":
+        if n_update_clicks == 0 or window is None: raise PreventUpdate
+    elif trigger == "water_fall_plot":
+        if not zoom_aware or window is None: raise PreventUpdate
+    else:
+        raise PreventUpdate
+
+    uvstore = get_uvstore(uvdata_key)
+    label = get_uvdata_label(uvdata_key)
+
+    fs = uvstore.freqs
+    tlim = (-0.5, uvstore.nt - 0.5)
+    flim = (fs[0], fs[-1])
 
-    try:
-        tstart = waterfall_layout["xaxis.range[0]"]
-        tend = waterfall_layout["xaxis.range[1]"]
-        freqstart = waterfall_layout["yaxis.range[0]"]
-        freqend = waterfall_layout["yaxis.range[1]"]
-    except: raise PreventUpdate
+    if trigger == "btn_plot":
+        window = dict(
+            corr_type=corr_type,
+            trange=[tstart - 0.5, tend - 0.5],
+            frange=[freqstart, freqend],
+        )
+    else:
+        newwindow = zoom_window(waterfall_layout, window, tlim, flim)
+        if newwindow == window and trigger == "water_fall_plot": raise PreventUpdate
+        window = newwindow
 
-    spectrum["layout"]["xaxis"] = {"range": (freqstart, freqend)}
-    lightcurve["layout"]["xaxis"] = {"range": (tstart, tend)}
+    waterfall, spectrum, lightcurve = make_diagnose_figures(
+        uvstore.pyramid, window, fs, label
+    )
 
-    return 0, spectrum, lightcurve
+    return 0, 0, waterfall, spectrum, lightcurve, None, window
 
 
 @callback(
@@ -347,30 +448,38 @@ def update_spectrum_lightcurve_layout(
     Output("antenna_cross_plot_t_contain", "children"),
     Output("ant_plot_status", "value"),
     Input("btn_plot_ants", "n_clicks"),
+    State("uvdata_key", "data"),
 )
-def plot_antenna_diagnose_plot(n_clicks):
+def plot_antenna_diagnose_plot(n_clicks, uvdata_key):
     if n_clicks == 0: raise PreventUpdate
 
-    fs = np.linspace(743.4, 887.4, 864)
+    uvstore = get_uvstore(uvdata_key)
 
-    auto_bidx = bidx_info["auto_bidx"]
-    ant_bidx = bidx_info["ant_bidx"]
+    fs = uvstore.freqs
+
+    auto_bidx = auto_index(uvstore.blpairs)
+    nant = uvstore.nant
+    ants = np.arange(1, nant + 1)
+
+    nt = uvstore.nt
+    pyramid = uvstore.pyramid
 
     print("Splitting data ...")
-    auto_data = uvdata_amp[auto_bidx, ...]
+    auto_freq = pyramid.bl_spectra[auto_bidx]
+    auto_time = pyramid.bl_lightcurves[auto_bidx]
 
-    cross_data = []
-    for i in range(1, 31): # 30 antennas:
-        ant_single_bidx = np.array(ant_bidx[str(i)])
-        ant_cross_idx = ant_single_bidx[~np.isin(ant_single_bidx, auto_bidx)]
-        cross_data.append(uvdata_amp[ant_cross_idx, ...])
+    cross_freq, cross_time = pyramid.ant_profiles(uvstore.blpairs)
 
-    cross_data = np.array(cross_data).mean(axis=1)
+    ### decimate time axis to the screen size
+    tfac = int(np.ceil(nt / PLOT_MAX_NX))
+    auto_time = block_mean(auto_time, tfac)
+    cross_time = block_mean(cross_time, tfac)
+    ts = block_centre(nt, tfac)
 
     ### plot auto-correlation
     auto_freq_ant = px.imshow(
-        auto_data.mean(axis=2), aspect="auto",
-        x=fs, y=np.arange(1, 31)
+        auto_freq, aspect="auto",
+        x=fs, y=ants
     )
 
     auto_freq_ant.update_layout(
@@ -378,23 +487,23 @@ def plot_antenna_diagnose_plot(n_clicks):
     )
     auto_freq_ant.update_xaxes(title_text="Frequency (MHz)")
     auto_freq_ant.update_yaxes(
-        title_text="Antenna", range=(0.5, 30.5), autorange=False,
+        title_text="Antenna", range=(0.5, nant + 0.5), autorange=False,
     )
 
     auto_time_ant = px.imshow(
-        auto_data.mean(axis=1), aspect="auto",
-        x=np.arange(nt), y=np.arange(1, 31)
+        auto_time, aspect="auto",
+        x=ts, y=ants
     )
 
     auto_time_ant.update_xaxes(title_text="Time (Integration)", range=(-0.5, nt-1.5))
     auto_time_ant.update_yaxes(
-        title_text="Antenna", range=(0.5, 30.5), autorange=False,
+        title_text="Antenna", range=(0.5, nant + 0.5), autorange=False,
     )
 
     ### plot cross-correlation
     cross_freq_ant = px.imshow(
-        cross_data.mean(axis=2), aspect="auto",
-        x=fs, y=np.arange(1, 31)
+        cross_freq, aspect="auto",
+        x=fs, y=ants
     )
 
     cross_freq_ant.update_layout(
@@ -402,17 +511,17 @@ def plot_antenna_diagnose_plot(n_clicks):
     )
     cross_freq_ant.update_xaxes(title_text="Frequency (MHz)")
     cross_freq_ant.update_yaxes(
-        title_text="Antenna", range=(0.5, 30.5), autorange=False,
+        title_text="Antenna", range=(0.5, nant + 0.5), autorange=False,
     )
 
     cross_time_ant = px.imshow(
-        cross_data.mean(axis=1), aspect="auto",
-        x=np.arange(nt), y=np.arange(1, 31)
+        cross_time, aspect="auto",
+        x=ts, y=ants
     )
 
     cross_time_ant.update_xaxes(title_text="Time (Integration)", range=(-0.5, nt-1.5))
     cross_time_ant.update_yaxes(
-        title_text="Antenna", range=(0.5, 30.5), autorange=False,
+        title_text="Antenna", range=(0.5, nant + 0.5), autorange=False,
     )
 
 
@@ -434,18 +543,31 @@ def plot_antenna_diagnose_plot(n_clicks):
     Output("all_baselines_time_plot_contain", "children"),
     Output("all_bl_plot_status", "value"),
     Input("btn_bl_plot", "n_clicks"),
+    State("uvdata_key", "data"),
 )
-def plot_all_baselines(n_clicks):
+def plot_all_baselines(n_clicks, uvdata_key):
     if n_clicks == 0: raise PreventUpdate
 
-    fs = np.linspace(743.4, 887.4, 864)
+    uvstore = get_uvstore(uvdata_key)
+
+    fs = uvstore.freqs
+
+    nt = uvstore.nt
+    pyramid = uvstore.pyramid
 
     ### only cross-correlation (as auto-correlation can be seen via antenna tabs...)
-    cross_data = uvdata_amp[bidx_info["cross_bidx"], ...]
+    cross_bidx = cross_index(uvstore.blpairs)
+    blnames = get_blnames(uvstore.blpairs)
+    cross_freq = pyramid.bl_spectra[cross_bidx]
+    cross_time = pyramid.bl_lightcurves[cross_bidx]
+
+    ### decimate time axis to the screen size
+    tfac = int(np.ceil(nt / PLOT_MAX_NX))
+    cross_time = block_mean(cross_time, tfac)
 
     bl_freq = px.imshow(
-        cross_data.mean(axis=2), aspect="auto",
-        x=fs, y=blnames[bidx_info["cross_bidx"]],
+        cross_freq, aspect="auto",
+        x=fs, y=blnames[cross_bidx],
     )
 
     bl_freq.update_xaxes(
@@ -454,8 +576,8 @@ def plot_all_baselines(n_clicks):
     bl_freq.update_yaxes(title_text = "Baseline")
 
     bl_time = px.imshow(
-        cross_data.mean(axis=1), aspect="auto",
-        x=np.arange(1, nt+1), y=blnames[bidx_info["cross_bidx"]],
+        cross_time, aspect="auto",
+        x=block_centre(nt, tfac) + 1, y=blnames[cross_bidx],
     )
 
     bl_time.update_xaxes(
@@ -475,18 +597,27 @@ def plot_all_baselines(n_clicks):
     Output("rand_bl_full_contain", "children"),
     Output("rand_bl_plot_status", "value"),
     Input("btn_rand_bl_plot", "n_clicks"),
+    State("uvdata_key", "data"),
 )
-def plot_random_baselines(n_clicks):
+def plot_random_baselines(n_clicks, uvdata_key):
     print("`plot_random_baselines` callbacked is fired...")
 
     if n_clicks == 0: raise PreventUpdate
 
-    fs = np.linspace(743.4, 887.4, 864)
+    uvstore = get_uvstore(uvdata_key)
+
+    fs = uvstore.freqs
+
+    nt = uvstore.nt
+
+    ### decimate single baseline waterfall to the screen size
+    tfac = int(np.ceil(nt / PLOT_MAX_NX))
+    ffac = int(np.ceil(fs.shape[0] / PLOT_MAX_NY))
 
     rand_bl_nx, rand_bl_ny = 2, 4
 
-    selected_bl_idx = np.random.randint(0, 465, rand_bl_nx * rand_bl_ny)
-    selected_bl_names = blnames[selected_bl_idx]
+    selected_bl_idx = np.random.randint(0, uvstore.nbl, rand_bl_nx * rand_bl_ny)
+    selected_bl_names = get_blnames(uvstore.blpairs)[selected_bl_idx]
 
     figure_layout_content = []
     for i in range(rand_bl_ny):
@@ -494,12 +625,14 @@ def plot_random_baselines(n_clicks):
         for j in range(rand_bl_nx):
             fig_idx = i * rand_bl_nx + j
 
-            bl_waterfall = uvdata_amp[selected_bl_idx[fig_idx]]
+            bl_waterfall = uvstore.amp(selected_bl_idx[fig_idx])
+            bl_waterfall = block_mean(bl_waterfall, tfac, ffac)
             bl_name = selected_bl_names[fig_idx]
 
             bl_waterfall = px.imshow(
                 bl_waterfall, aspect="auto", 
-                x=np.arange(nt), y=fs
+                x=block_centre(nt, tfac),
+                y=np.interp(block_centre(fs.shape[0], ffac), np.arange(fs.shape[0]), fs),
             )
 
             bl_waterfall.update_layout(
@@ -526,6 +659,7 @@ def plot_random_baselines(n_clicks):
     )
 
 layout = [
+    dcc.Store(id="uvdata_key", storage_type="session"),
     folder_input(),
     load_data_button(),
     dbc.Container(html.Hr(style={"margin-bottom": "15px"})),
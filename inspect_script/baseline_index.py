@@ -0,0 +1,89 @@
+"""
+baseline indexing shared by the comparison, SEFD and dashboard code
+
+antennas are zero indexed, baselines are stored as a (2, nbl) array of
+(ant1, ant2) with ant1 <= ant2. the dense baseline id follows the upper
+triangle in row-major order, i.e., (0, 0), (0, 1), ..., (0, nant-1), (1, 1), ...
+which is the order used by both CRACO and ASKAP hardware measurement sets
+"""
+
+import numpy as np
+
+def getnbl(nant, auto=True):
+    return int(nant * (nant - 1) / 2 + nant) if auto else int(nant * (nant - 1) / 2)
+
+def getnant(nbl, auto=True):
+    """
+    number of antennas from the number of baselines
+    """
+    # nbl = nant * (nant + 1) / 2 with auto-correlation, nant * (nant - 1) / 2 without
+    nant = int(round((np.sqrt(8 * nbl + 1) + (-1 if auto else 1)) / 2))
+    assert getnbl(nant, auto) == nbl, f"{nbl} is not a valid number of baselines..."
+    return nant
+
+def baseline_pairs(nant, auto=True):
+    """
+    all (ant1, ant2) pairs in the dense baseline id order, with a shape of (2, nbl)
+    """
+    return np.array(np.triu_indices(nant, k=0 if auto else 1))
+
+def encode_bl(ant1, ant2, nant, auto=True):
+    """
+    dense baseline id for (ant1, ant2), the order of `ant1` and `ant2` does not matter
+    """
+    ant1 = np.asarray(ant1); ant2 = np.asarray(ant2)
+    a1 = np.minimum(ant1, ant2); a2 = np.maximum(ant1, ant2)
+    if auto:
+        return a1 * nant - a1 * (a1 - 1) // 2 + (a2 - a1)
+    return a1 * (nant - 1) - a1 * (a1 - 1) // 2 + (a2 - a1 - 1)
+
+def decode_bl(blid, nant, auto=True):
+    """
+    (ant1, ant2) for dense baseline ids
+    """
+    ant1, ant2 = baseline_pairs(nant, auto)
+    return ant1[blid], ant2[blid]
+
+def auto_mask(bl):
+    return bl[0] == bl[1]
+
+def cross_mask(bl):
+    return bl[0] != bl[1]
+
+def auto_index(bl):
+    return np.nonzero(auto_mask(bl))[0]
+
+def cross_index(bl):
+    return np.nonzero(cross_mask(bl))[0]
+
+def ant_mask(bl, ant):
+    """
+    baselines containing antenna `ant`
+    """
+    return (bl[0] == ant) | (bl[1] == ant)
+
+def ant_baselines(bl, nant=None, auto=True):
+    """
+    baseline indices for each antenna, return a list with `nant` arrays
+    auto-correlations are excluded if `auto` is False
+    """
+    if nant is None: nant = bl.max() + 1
+    keep = np.ones(bl.shape[-1], dtype=bool) if auto else cross_mask(bl)
+
+    # sort each baseline under both of its antennas, then split by antenna
+    blidx = np.concatenate([np.nonzero(keep)[0], np.nonzero(keep & cross_mask(bl))[0]])
+    ants = np.concatenate([bl[0][keep], bl[1][keep & cross_mask(bl)]])
+    order = np.argsort(ants, kind="stable")
+    blidx = blidx[order]; ants = ants[order]
+    splits = np.searchsorted(ants, np.arange(1, nant))
+    return [np.sort(idx) for idx in np.split(blidx, splits)]
+
+def map_baselines(bl_from, bl_to, nant=None):
+    """
+    index of each baseline of `bl_from` in `bl_to`, -1 if it is not found
+    """
+    if nant is None: nant = max(bl_from.max(), bl_to.max()) + 1
+
+    lookup = np.full(getnbl(nant), -1)
+    lookup[encode_bl(bl_to[0], bl_to[1], nant)] = np.arange(bl_to.shape[-1])
+    return lookup[encode_bl(bl_from[0], bl_from[1], nant)]
@@ -0,0 +1,73 @@
+"""
+helpers shared by the batch drivers (`run_diagnose`, `run_SEFD`)
+
+only the standard library is used, so workers do not import casacore,
+astropy or matplotlib through them
+"""
+
+import glob
+import json
+import os
+import resource
+import multiprocessing
+
+def ms_mtime(mspath):
+    """
+    modification time of a measurement set
+    """
+    # measurement sets are folders, use the newest file in the main table
+    return max(os.path.getmtime(f) for f in glob.glob(f"{mspath}/table.*") + [mspath])
+
+def limit_worker_memory(maxmem):
+    """
+    cap the address space of a worker process, `maxmem` in bytes
+    """
+    if maxmem is None: return
+    resource.setrlimit(resource.RLIMIT_AS, (maxmem, maxmem))
+
+def _run_task(args):
+    func, task = args
+    return func(*task)
+
+def run_pool(func, tasks, nworker=4, maxmem=None, logger=None):
+    """
+    run `func(*task)` for all `tasks` in a process pool, each worker is limited to `maxmem` bytes
+
+    `func` returns a record with `sbid`, `beam`, `status` and `elapsed`,
+    records are returned in the order they finish
+    """
+    if logger is not None: logger.info(f"running {len(tasks)} task(s) with {nworker} worker(s)...")
+    records = []
+    with multiprocessing.Pool(
+        nworker, initializer=limit_worker_memory, initargs=(maxmem, ), maxtasksperchild=1,
+    ) as pool:
+        for record in pool.imap_unordered(_run_task, [(func, task) for task in tasks]):
+            if logger is not None:
+                logger.info(f"{record['sbid']} BEAM{record['beam']:0>2} {record['status']} in {record['elapsed']:.1f}s...")
+            records.append(record)
+
+    nfail = sum(record["status"] != "success" for record in records)
+    if logger is not None: logger.info(f"{len(records) - nfail}/{len(records)} task(s) finished successfully...")
+    return records
+
+def write_summary(fname, records, keys=("sbid", "beam")):
+    """
+    merge `records` into the json summary `fname` by `keys`
+
+    records of earlier runs (e.g., skipped up to date outputs, earlier failures)
+    are kept unless they are run again, so the summary covers the whole output folder
+    """
+    merged = {}
+    if os.path.exists(fname):
+        try:
+            with open(fname) as fp:
+                for record in json.load(fp): merged[tuple(record[key] for key in keys)] = record
+        except (OSError, ValueError, KeyError, TypeError):
+            print(f"cannot read summary {fname}, it will be overwritten...")
+    for record in records:
+        merged[tuple(record[key] for key in keys)] = record
+
+    merged = [merged[key] for key in sorted(merged)]
+    with open(fname, "w") as fp:
+        json.dump(merged, fp, indent=2)
+    return merged
@@ -0,0 +1,169 @@
+"""
+chunked on-disk arrays with per-chunk summaries
+
+an array is stored as a folder with one file per chunk, a small `index.json`
+(shape, dtype, chunk shape, compression and user attributes) and
+`summary.npz` with the min/max/mean/count of each chunk (of the amplitude
+for complex data, nan values are not counted). uncompressed chunks are
+`.npy` files and can be memory-mapped, compressed chunks are `.npz` files
+"""
+
+import numpy as np
+import itertools
+import json
+import os
+import sys
+
+INDEX_FNAME = "index.json"
+SUMMARY_FNAME = "summary.npz"
+SUMMARY_STATS = ("min", "max", "mean", "count")
+
+def _chunk_fname(path, chunkidx, compress):
+    return "{}/c{}.{}".format(path, "_".join(str(i) for i in chunkidx), "npz" if compress else "npy")
+
+def _chunk_slices(shape, chunks, chunkidx):
+    return tuple(slice(i * c, min((i + 1) * c, n)) for i, c, n in zip(chunkidx, chunks, shape))
+
+def _chunk_summary(block):
+    values = np.abs(block) if np.iscomplexobj(block) else block
+    valid = np.isfinite(values)
+    count = int(valid.sum())
+    if count == 0: return np.nan, np.nan, np.nan, 0
+    values = values[valid]
+    return values.min(), values.max(), values.mean(), count
+
+def write_chunked(path, data, chunks, compress=False, attrs=None):
+    """
+    write `data` (any array-like supporting slicing, e.g., a memmap) to a chunked store at `path`
+
+    `chunks` is the chunk shape, `attrs` is a json serialisable dictionary
+    (e.g., axis names, frequencies) kept in the index. return the opened store
+    """
+    shape = tuple(int(n) for n in data.shape)
+    chunks = tuple(int(min(c, n)) if n > 0 else 1 for c, n in zip(chunks, shape))
+    grid = tuple(-(-n // c) for n, c in zip(shape, chunks))
+    if not os.path.exists(path): os.makedirs(path)
+
+    summary = {stat: np.zeros(grid) for stat in SUMMARY_STATS}
+    for chunkidx in itertools.product(*[range(n) for n in grid]):
+        block = np.asarray(data[_chunk_slices(shape, chunks, chunkidx)])
+        fname = _chunk_fname(path, chunkidx, compress)
+        if compress: np.savez_compressed(fname, data=block)
+        else: np.save(fname, block)
+
+        for stat, value in zip(SUMMARY_STATS, _chunk_summary(block)):
+            summary[stat][chunkidx] = value
+
+    np.savez(f"{path}/{SUMMARY_FNAME}", **summary)
+    index = dict(
+        shape=shape, dtype=np.dtype(data.dtype).str, chunks=chunks,
+        compress=compress, attrs=attrs or {},
+    )
+    with open(f"{path}/{INDEX_FNAME}", "w") as fp:
+        json.dump(index, fp, indent=2)
+
+    return ChunkedArray(path)
+
+def is_chunked(path):
+    return os.path.exists(f"{path}/{INDEX_FNAME}")
+
+class ChunkedArray:
+    """
+    read-only chunked store, indexing only reads the chunks overlapping the selection
+
+    selections are done axis by axis (outer indexing) with integers, slices or index arrays
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(f"{path}/{INDEX_FNAME}") as fp:
+            index = json.load(fp)
+        self.shape = tuple(index["shape"])
+        self.dtype = np.dtype(index["dtype"])
+        self.chunks = tuple(index["chunks"])
+        self.compress = index["compress"]
+        self.attrs = index["attrs"]
+        self.grid = tuple(-(-n // c) for n, c in zip(self.shape, self.chunks))
+
+        with np.load(f"{path}/{SUMMARY_FNAME}") as summary:
+            self.summary = {stat: summary[stat] for stat in SUMMARY_STATS}
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def itemsize(self):
+        return self.dtype.itemsize
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def read_chunk(self, chunkidx):
+        fname = _chunk_fname(self.path, chunkidx, self.compress)
+        if self.compress:
+            with np.load(fname) as chunk:
+                return chunk["data"]
+        return np.load(fname, mmap_mode="r")
+
+    def _normalise(self, key):
+        if not isinstance(key, tuple): key = (key, )
+        if any(k is Ellipsis for k in key):
+            i = [k is Ellipsis for k in key].index(True)
+            key = key[:i] + (slice(None), ) * (self.ndim - len(key) + 1) + key[i+1:]
+        key = key + (slice(None), ) * (self.ndim - len(key))
+
+        idx = [np.arange(n)[k] for k, n in zip(key, self.shape)]
+        scalar = [np.ndim(i) == 0 for i in idx]
+        return [np.atleast_1d(i) for i in idx], scalar
+
+    def __getitem__(self, key):
+        idx, scalar = self._normalise(key)
+        out = np.empty(tuple(i.shape[0] for i in idx), dtype=self.dtype)
+
+        # positions of the selected indices in each chunk along each axis
+        chunkpos = [
+            {c: np.nonzero(i // size == c)[0] for c in np.unique(i // size)}
+            for i, size in zip(idx, self.chunks)
+        ]
+        for chunkidx in itertools.product(*[sorted(pos) for pos in chunkpos]):
+            chunk = self.read_chunk(chunkidx)
+            outpos = [pos[c] for pos, c in zip(chunkpos, chunkidx)]
+            inpos = [i[p] - c * size for i, p, c, size in zip(idx, outpos, chunkidx, self.chunks)]
+            out[np.ix_(*outpos)] = chunk[np.ix_(*inpos)]
+
+        return out[tuple(0 if s else slice(None) for s in scalar)]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
+
+    def range_summary(self, key=()):
+        """
+        min/max/mean/count over all chunks overlapping a selection, from the summaries only
+        the result covers whole chunks, so it can include values outside of the selection
+        """
+        idx, _ = self._normalise(key)
+        chunksel = np.ix_(*[np.unique(i // size) for i, size in zip(idx, self.chunks)])
+        count = self.summary["count"][chunksel]
+        total = count.sum()
+        if total == 0: return dict(min=np.nan, max=np.nan, mean=np.nan, count=0)
+        return dict(
+            min=np.nanmin(self.summary["min"][chunksel]),
+            max=np.nanmax(self.summary["max"][chunksel]),
+            mean=np.nansum(self.summary["mean"][chunksel] * count) / total,
+            count=int(total),
+        )
+
+if __name__ == "__main__":
+    # convert a npy file (e.g., output_beamXX.uvfits.npy) to a chunked store
+    # python chunkstore.py <npyfname> <storepath> [chunk shape, e.g., 16,64,1,1024] [compress]
+    args = sys.argv
+    data = np.load(args[1], mmap_mode="r")
+    # default chunks are for (nbl, nchan, npol, nt) files
+    chunks = tuple(int(c) for c in args[3].split(",")) if len(args) > 3 else (16, 64, data.shape[2], 1024)
+    write_chunked(args[2], data, chunks, compress=len(args) > 4 and args[4] == "compress")
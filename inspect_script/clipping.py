@@ -0,0 +1,43 @@
+"""
+iterative sigma clipping shared by the SEFD, comparison and dashboard code
+"""
+
+import numpy as np
+import warnings
+
+MAD_TO_STD = 1.4826
+
+def sigma_clip_mask(data, axis=0, nsigma=3., maxiter=10, twosided=False, robust=False, mask=None):
+    """
+    iterative sigma clipping along `axis` for all the other axes at once
+
+    values above median + nsigma * scale (or further than nsigma * scale from
+    the median if `twosided`) are clipped, where scale is the standard deviation,
+    or the MAD-based robust one if `robust`. iterations stop once no new value is clipped.
+    non-finite values are always masked. return a boolean mask, True for clipped values
+    """
+    data = np.asarray(data)
+    clipped = ~np.isfinite(data)
+    if mask is not None: clipped |= mask
+
+    with warnings.catch_warnings():
+        # all-nan slices are expected for fully flagged channels
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+
+        for i in range(maxiter):
+            masked = np.where(clipped, np.nan, data)
+            centre = np.nanmedian(masked, axis=axis, keepdims=True)
+            if robust:
+                scale = MAD_TO_STD * np.nanmedian(np.abs(masked - centre), axis=axis, keepdims=True)
+            else:
+                scale = np.nanstd(masked, axis=axis, keepdims=True)
+
+            deviation = data - centre
+            outlier = deviation > nsigma * scale
+            if twosided: outlier |= deviation < -nsigma * scale
+
+            newclipped = clipped | outlier
+            if np.array_equal(newclipped, clipped): break
+            clipped = newclipped
+
+    return clipped
@@ -10,6 +10,9 @@ from astropy.time import Time
 
 from casacore import tables
 
+from baseline_index import getnbl, map_baselines, cross_mask, ant_mask
+from uvfits_reader import UVFitsReader
+
 ### set logger...
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -55,23 +58,51 @@ def CasaGetSpt(tabpath):
     logger.info(f"loading spectrum tab from {tabpath}...")
     return tables.table(glob.glob(f"{tabpath}/SPECTRAL_WINDOW"))
 
-def getnbl(nant, auto=True):
-    return int(nant * (nant - 1) / 2 + nant) if auto else int(nant * (nant - 1) / 2)
-
 def check_int(n, tol=1e-6):
     return True if abs(n - int(n)) <= tol else False
 
+def _nearest_index(seq, ref, tol):
+    """
+    index of the nearest sample in `ref` for each sample in `seq`, -1 if it is further than `tol`
+    """
+    if len(ref) == 0: return np.full(len(seq), -1)
+    order = np.argsort(ref, kind="stable") # sorted data is sorted in linear time
+    sortedref = ref[order]
+
+    pos = np.searchsorted(sortedref, seq)
+    left = np.clip(pos - 1, 0, len(ref) - 1)
+    right = np.clip(pos, 0, len(ref) - 1)
+    nearest = np.where(abs(seq - sortedref[left]) <= abs(seq - sortedref[right]), left, right)
+
+    return np.where(abs(seq - sortedref[nearest]) < tol, order[nearest], -1)
+
+def match_sequence_index(seq1, seq2, tol):
+    """
+    match samples between two sequences without building the full distance matrix
+
+    return the index of the nearest sample in `seq2` for each sample in `seq1`,
+    and the one in `seq1` for each sample in `seq2`, -1 if no sample is within `tol`
+    """
+    seq1 = np.asarray(seq1); seq2 = np.asarray(seq2)
+    return _nearest_index(seq1, seq2, tol), _nearest_index(seq2, seq1, tol)
+
 def find_sequence_overlap_slice(seq1, seq2, tol):
-    seq1 = np.array(seq1); seq2 = np.array(seq2)
+    """
+    find overlapping slices and averaging factors for two evenly sampled sequences
+    see `find_matched_runs` for sequences with gaps or irregular sampling
+    """
+    match1, match2 = match_sequence_index(seq1, seq2, tol)
     
-    overlap_idx1 = np.where(np.min(abs(seq1[:, None] - seq2), axis=1) < tol)[0]
-    overlap_idx2 = np.where(np.min(abs(seq1[:, None] - seq2), axis=0) < tol)[0]
+    overlap_idx1 = np.nonzero(match1 >= 0)[0]
+    overlap_idx2 = np.nonzero(match2 >= 0)[0]
+
+    assert overlap_idx1.shape[0] > 0, "No overlap found between two sequences... please check `tol`..."
     
     ave_fact1 = (overlap_idx1[1:] - overlap_idx1[:-1]).mean()
     ave_fact2 = (overlap_idx2[1:] - overlap_idx2[:-1]).mean()
     
     logger.info(f"averaging factor: `seq1` - {ave_fact1:.2f}; `seq2` - {ave_fact2:.2f}")
-    
+
     assert check_int(ave_fact1), f"No evenly sample data found in `seq1`... please check `tol`..."
     assert check_int(ave_fact2), f"No evenly sample data found in `seq2`... please check `tol`..."
     
@@ -95,6 +126,33 @@ def find_sequence_overlap_slice(seq1, seq2, tol):
         
     return slice1, slice2, int(ave_fact1), int(ave_fact2)
 
+def find_matched_runs(match2, ave1, n1):
+    """
+    runs of samples in `seq2` matched to `ave1` consecutive samples of `seq1` (of `n1` samples)
+
+    `match2` is the index of the matched sample in `seq1` for each sample in `seq2` (see
+    `match_sequence_index`), and a new run starts wherever either sequence has a gap.
+    return a list of (slice1, slice2) for the runs
+    """
+    idx2 = np.nonzero((match2 >= 0) & (match2 + ave1 <= n1))[0]
+    if idx2.size == 0: return []
+    start1 = match2[idx2]
+
+    breaks = np.nonzero((np.diff(idx2) != 1) | (np.diff(start1) != ave1))[0] + 1
+    return [
+        (slice(int(run1[0]), int(run1[-1]) + ave1), slice(int(run2[0]), int(run2[-1]) + 1))
+        for run1, run2 in zip(np.split(start1, breaks), np.split(idx2, breaks))
+    ]
+
+def resolution_ratio(coarse, fine, name):
+    """
+    number of fine samples averaged into a coarse one
+    """
+    ratio = coarse / fine
+    if ratio < 1 or not check_int(round(ratio, 2)):
+        raise ValueError(f"{name} of askap hardware data ({coarse}) should be a multiple of the craco one ({fine})...")
+    return int(round(ratio))
+
 def find_bl_bool(ant1, ant2, bl_array, zero_index=False):
     if ant1 > ant2: ant1, ant2 = ant2, ant1
         
@@ -113,22 +171,35 @@ def waterfall_compare(data1, data2, bl_arr1, bl_arr2, ant1, ant2, metrics="phase
     data1_bl = data1[:, bl_idx1, :].squeeze()
     data2_bl = data2[:, bl_idx2, :].squeeze()
     
+    return _compare_vis(data1_bl, data2_bl, metrics)
+
+def _compare_vis(data1, data2, metrics="phase"):
     if metrics == "phase":
-        phase_diff = np.angle(data1_bl, deg=True) - np.angle(data2_bl, deg=True)
-        tmp_data = np.array([phase_diff-360, phase_diff, phase_diff+360])
-        min_idx = np.argmin(np.abs(tmp_data), axis=0)
-        data_comp = np.take_along_axis(tmp_data, np.expand_dims(min_idx, axis=0), axis=0)[0]
-        
-    else:
-        data_comp = np.abs(data1_bl) / np.abs(data2_bl)
-        
-    return data_comp
+        # phase of data1 * conj(data2) is the phase difference wrapped to (-180, 180]
+        return np.angle(data1 * data2.conj(), deg=True)
+    return np.abs(data1) / np.abs(data2)
+
+def compare_all_baselines(data1, data2, bl_arr1, bl_arr2=None, metrics="phase"):
+    """
+    compare all baselines in `bl_arr1` with the same baselines in `bl_arr2` in one pass
+    both data1 and data2 have 3 dimensions - nt, nbl, nchan
+    if `bl_arr2` is None, data2 is already in the baseline order of `bl_arr1`
+
+    return a cube with a shape of (nbl, nt, nchan), following the baseline order in `bl_arr1`
+    """
+    logger.info(f"comapring {metrics} for all baselines...")
+    if bl_arr2 is not None: data2 = data2[:, find_hwbl_overlap(bl_arr1, bl_arr2), :]
+
+    data_comp = _compare_vis(data1, data2, metrics)
+    return np.ascontiguousarray(data_comp.transpose(1, 0, 2))
+
+### colour scale (vmin, vmax, cmap) of comparison waterfalls
+WATERFALL_STYLE = {"phase": (-10, 10, "bwr"), "amp": (0.1, 0.16, "PRGn")}
 
 def plot_waterfall_compare(waterfall, ax=None, metrics="phase"):
     if ax is None:
         fig = plt.figure(figsize=(4, 4)); ax = fig.add_subplot(1, 1, 1)
-    if metrics == "phase": vmin, vmax, cmap = -10, 10, "bwr"
-    else: vmin, vmax, cmap = 0.1, 0.16, "PRGn"
+    vmin, vmax, cmap = WATERFALL_STYLE.get(metrics, WATERFALL_STYLE["amp"])
     
     ax.imshow(
         waterfall, aspect="auto", vmin=vmin, vmax=vmax, cmap=cmap
@@ -136,6 +207,65 @@ def plot_waterfall_compare(waterfall, ax=None, metrics="phase"):
     
     return ax
 
+def _resample_axis(cube, n, axis):
+    """
+    resample `axis` of `cube` to `n` pixels, average (ignoring nan) if shrinking, repeat otherwise
+    """
+    size = cube.shape[axis]
+    if size < n: return np.take(cube, np.arange(n) * size // n, axis=axis)
+
+    edges = np.arange(n) * size // n
+    valid = np.isfinite(cube)
+    total = np.add.reduceat(np.where(valid, cube, 0), edges, axis=axis)
+    count = np.add.reduceat(valid, edges, axis=axis)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return total / count
+
+def baseline_mosaic(compcube, bl, nant, tilesize=(48, 48)):
+    """
+    tile comparison waterfalls (nbl, nt, nchan) into a single (nant * ny, nant * nx) image
+
+    each waterfall is resampled to `tilesize` (ny, nx), baseline (ant1, ant2) with
+    ant1 < ant2 (zero indexed) is placed at row ant2, column ant1, other tiles are nan
+    """
+    ny, nx = tilesize
+    tiles = _resample_axis(_resample_axis(np.asarray(compcube, dtype=float), ny, 1), nx, 2)
+
+    mosaic = np.full((nant, ny, nant, nx), np.nan)
+    ant1, ant2 = np.asarray(bl)[0], np.asarray(bl)[1]
+    sel = (ant1 < ant2) & (ant2 < nant)
+    mosaic[ant2[sel], :, ant1[sel], :] = tiles[sel]
+    return mosaic.reshape(nant * ny, nant * nx)
+
+def plot_baseline_mosaic(compcube, bl, nant, fname, metrics="phase", tilesize=(48, 48), title=None, dpi=100):
+    """
+    draw all baseline waterfalls as one rasterised image and save it to `fname` (png or pdf)
+    """
+    ny, nx = tilesize
+    mosaic = baseline_mosaic(compcube, bl, nant, tilesize)
+    vmin, vmax, cmap = WATERFALL_STYLE.get(metrics, WATERFALL_STYLE["amp"])
+
+    fig = plt.figure(figsize=(mosaic.shape[1] / dpi + 1.5, mosaic.shape[0] / dpi + 1), dpi=dpi)
+    ax = fig.add_subplot(1, 1, 1)
+    im = ax.imshow(
+        mosaic, aspect="auto", vmin=vmin, vmax=vmax, cmap=cmap,
+        interpolation="nearest", rasterized=True,
+    )
+
+    # grid lines between tiles and antenna labels at the centre of each tile
+    ax.hlines(np.arange(1, nant) * ny - 0.5, -0.5, nant * nx - 0.5, color="grey", lw=0.3)
+    ax.vlines(np.arange(1, nant) * nx - 0.5, -0.5, nant * ny - 0.5, color="grey", lw=0.3)
+    ax.set_xticks(np.arange(nant) * nx + nx / 2 - 0.5)
+    ax.set_xticklabels([f"ak{ant+1}" for ant in range(nant)], rotation=90)
+    ax.set_yticks(np.arange(nant) * ny + ny / 2 - 0.5)
+    ax.set_yticklabels([f"ak{ant+1}" for ant in range(nant)])
+    ax.tick_params(length=0)
+    fig.colorbar(im, ax=ax, fraction=0.02, pad=0.01, label=metrics)
+    if title is not None: ax.set_title(title)
+
+    fig.savefig(fname, bbox_inches="tight", dpi=dpi)
+    plt.close(fig)
+
 def plot_line_comp(data1, data2, bl_arr1, bl_arr2, ant1, ant2, label1, label2, t=None, f=None):
     # both data1 and data2 have 3 dimensions - nt, nbl, nchan
     if (t is None and f is None) or (t is not None and f is not None):
@@ -176,212 +306,302 @@ def plot_line_comp(data1, data2, bl_arr1, bl_arr2, ant1, ant2, label1, label2, t
     ax.set_title(f"Amplitude for ak{ant1}-ak{ant2} [{title}]")
     
 
-def load_measurement_sets(craco_tab_path, hw_tab_path):
+### memory (in bytes) allowed for a single block of visibilities read from the table
+CHUNK_MEMORY_BUDGET = 512 * 1024**2
+
+def read_vis_chunked(
+    tab, nbl, tsel, fsel, npol, tave=1, fave=1, polsum=False, 
+    membudget=CHUNK_MEMORY_BUDGET,
+):
+    """
+    read `DATA` and `UVW` block by block, blocks are aligned to whole integrations
+
+    only integrations in `tsel` and channels in `fsel` are read, averaging
+    over `tave` integrations and `fave` channels is applied to each block.
+    polarisations are summed (first and last one, i.e., XX+YY) if `polsum`,
+    otherwise only the first polarisation is kept
+
+    return data with a shape of (nt, nbl, nchan), and uvw with a shape of (nt, nbl, 3)
+    """
+    nint = tsel.stop - tsel.start
+    nchan = fsel.stop - fsel.start
+    assert nint % tave == 0, "number of integrations selected is not a multiple of `tave`..."
+    assert nchan % fave == 0, "number of channels selected is not a multiple of `fave`..."
+
+    # (channel, polarisation) selection for `getcolslice`
+    npolsel = 2 if polsum and npol > 1 else 1
+    blc = [fsel.start, 0]
+    trc = [fsel.stop - 1, npol - 1 if npolsel == 2 else 0]
+    inc = [1, max(npol - 1, 1)]
+
+    data = np.zeros((nint // tave, nbl, nchan // fave), dtype=np.complex64)
+    uvw = np.zeros((nint // tave, nbl, 3))
+
+    intbytes = nbl * nchan * npolsel * np.dtype(np.complex64).itemsize
+    blockint = max(1, int(membudget // intbytes) // tave) * tave
+    logger.debug(f"reading {nint} integrations in blocks of {blockint} integrations...")
+
+    for i0 in range(0, nint, blockint):
+        i1 = min(i0 + blockint, nint)
+        startrow = (tsel.start + i0) * nbl; nrow = (i1 - i0) * nbl
+
+        block = tab.getcolslice("DATA", blc, trc, inc, startrow=startrow, nrow=nrow)
+        block = block.reshape(i1 - i0, nbl, nchan // fave, fave, npolsel).mean(axis=3)
+        block = block.sum(axis=-1) if polsum else block[..., 0]
+        block = block.reshape(-1, tave, nbl, nchan // fave).mean(axis=1)
+
+        blockuvw = tab.getcol("UVW", startrow=startrow, nrow=nrow)
+        blockuvw = blockuvw.reshape(-1, tave, nbl, 3).mean(axis=1)
+
+        o0 = i0 // tave; o1 = i1 // tave
+        data[o0:o1] = block
+        uvw[o0:o1] = blockuvw
+
+    return data, uvw
+
+def read_vis_runs(readfunc, truns, fruns):
+    """
+    read blocks of integration runs `truns` and channel runs `fruns` (lists of slices)
+
+    `readfunc(tsel, fsel)` reads a single block as `read_vis_chunked` does, blocks are
+    concatenated in time and frequency, uvw comes from the first channel run
+    """
+    data = []; uvw = []
+    for tsel in truns:
+        blocks = [readfunc(tsel, fsel) for fsel in fruns]
+        data.append(np.concatenate([block for block, _ in blocks], axis=2))
+        uvw.append(blocks[0][1])
+    return np.concatenate(data, axis=0), np.concatenate(uvw, axis=0)
+
+### speed of light in m/s, uvw in uvfits files are in seconds
+SPEED_OF_LIGHT = 299792458.
+
+### offset (in seconds) applied to craco times
+# UTCTAI_DIFF = 37
+# UTCTAI_DIFF = 32
+# OFFSET = 4.921343999906779 # t1
+# OFFSET = 5.031936000093222 # t2
+# OFFSET = 4.866047999813557 # t3
+# OFFSET = 5.087232000186444 # t4
+CRACO_TIME_OFFSET = 4.976640000000001 # t5 => which is the half of the askap hardware integration
+# OFFSET = 5.0042880000466115 # t6
+
+def craco_utc_time(rawtime):
+    """
+    convert craco times (mjd in seconds, tai) to the time system of askap hardware data
+    """
+    logger.warning("craco and askap hardware are using different time system...")
+    return Time(rawtime / 3600 / 24, format="mjd", scale="tai").utc.value * 3600 * 24 + CRACO_TIME_OFFSET
+
+def read_uvfits_chunked(
+    reader, tsel, fsel, tave=1, fave=1, polsum=False, membudget=CHUNK_MEMORY_BUDGET,
+):
+    """
+    `read_vis_chunked` for a uvfits file opened with `UVFitsReader`, uvw are converted to meters
+    """
+    nint = tsel.stop - tsel.start
+    nchan = fsel.stop - fsel.start
+    assert nint % tave == 0, "number of integrations selected is not a multiple of `tave`..."
+    assert nchan % fave == 0, "number of channels selected is not a multiple of `fave`..."
+
+    npol = reader.npol; nbl = reader.nbl
+    pols = [0, npol - 1] if polsum and npol > 1 else [0]
+
+    data = np.zeros((nint // tave, nbl, nchan // fave), dtype=np.complex64)
+    uvw = np.zeros((nint // tave, nbl, 3))
+
+    intbytes = nbl * nchan * len(pols) * np.dtype(np.complex64).itemsize
+    blockint = max(1, int(membudget // intbytes) // tave) * tave
+
+    for i0 in range(0, nint, blockint):
+        i1 = min(i0 + blockint, nint)
+        t0 = tsel.start + i0; t1 = tsel.start + i1
+
+        block = reader.vis[t0:t1, :, fsel][..., pols].astype(np.complex64)
+        block = block.reshape(i1 - i0, nbl, nchan // fave, fave, len(pols)).mean(axis=3)
+        block = block.sum(axis=-1) if polsum else block[..., 0]
+        block = block.reshape(-1, tave, nbl, nchan // fave).mean(axis=1)
+
+        blockuvw = reader.uvw[t0:t1] * SPEED_OF_LIGHT
+        blockuvw = blockuvw.reshape(-1, tave, nbl, 3).mean(axis=1)
+
+        o0 = i0 // tave; o1 = i1 // tave
+        data[o0:o1] = block
+        uvw[o0:o1] = blockuvw
+
+    return data, uvw
+
+def read_overlap(craco, hw):
+    """
+    find overlapping channels and integrations, and read them from both data sets
+
+    `craco` and `hw` are dictionaries with `freq`, `cwid` (channel width), `time`, `tr`
+    (integration time, both in seconds), and `read`, a function to read a block with
+    `(tsel, fsel, tave, fave)`. askap hardware data is not averaged, and craco data
+    is averaged to its resolution
+    return data, uvw, central frequencies and central times as `load_measurement_sets`
+    """
+    cracofreq_s = craco["freq"] - craco["cwid"] / 2
+    hwfreq_s = hw["freq"] - hw["cwid"] / 2
+    cracotime_s = craco["time"] - craco["tr"] / 2
+    hwtime_s = hw["time"] - hw["tr"] / 2
+
+    cracofa = resolution_ratio(hw["cwid"], craco["cwid"], "channel width")
+    cracota = resolution_ratio(hw["tr"], craco["tr"], "integration time")
+
+    ### match samples by their start, gaps and irregular sampling split the overlap into runs
+    _, hwfmatch = match_sequence_index(cracofreq_s, hwfreq_s, craco["cwid"] / 2)
+    _, hwtmatch = match_sequence_index(cracotime_s, hwtime_s, craco["tr"] / 2)
+    fruns = find_matched_runs(hwfmatch, cracofa, len(craco["freq"]))
+    truns = find_matched_runs(hwtmatch, cracota, len(craco["time"]))
+    if len(fruns) == 0 or len(truns) == 0:
+        raise ValueError("No overlap found between craco and askap hardware data...")
+
+    logger.info(f"{len(fruns)} run(s) of overlapping channels, {len(truns)} run(s) of overlapping integrations")
+    logger.info(f"select {[f for f, _ in fruns]} from craco and {[f for _, f in fruns]} from askap hardware data")
+    logger.info(f"select {[t for t, _ in truns]} from craco and {[t for _, t in truns]} from askap hardware data")
+
+    central_freq = np.concatenate([hw["freq"][f] for _, f in fruns])
+    central_time = np.concatenate([hw["time"][t] for _, t in truns])
+
+    ### read overlapping data block by block
+    ### craco data is averaged on frequency and time axis, askap hardware data is summed on polarisation (XX+YY)
+    logger.info("extracting overlapping craco data...")
+    cracodata, cracouvw = read_vis_runs(
+        lambda tsel, fsel: craco["read"](tsel, fsel, cracota, cracofa),
+        [t for t, _ in truns], [f for f, _ in fruns],
+    )
+    logger.info("extracting overlapping askap hardware data...")
+    hwdata, hwuvw = read_vis_runs(
+        lambda tsel, fsel: hw["read"](tsel, fsel, 1, 1),
+        [t for _, t in truns], [f for _, f in fruns],
+    )
 
-    cracotab = tables.table(craco_tab_path)
-    hwtab = tables.table(hw_tab_path)
+    logger.info(f"shape of data now: craco - {cracodata.shape}; askap hardware - {hwdata.shape}")
+    logger.info(f"shape of overlapping uvw data: craco - {cracouvw.shape}; askap hardware - {hwuvw.shape}")
 
-    craco_nfield = CasaGetNumField(craco_tab_path)
-    hw_nfield = CasaGetNumField(hw_tab_path)
+    return cracodata, hwdata, cracouvw, hwuvw, central_freq, central_time
 
-    # craco_nant = CasaGetNumAntenna(craco_tab_path)
-    # logger.warning("Number of antenna stored in craco measurement sets is wrong... Update to 30...")
-    # craco_nant = 30
-    # hw_nant = CasaGetNumAntenna(hw_tab_path)
-    craco_nant = CasaGetNumAntenna(cracotab)
+def _open_hw_ms(hwtab, hw_tab_path, membudget=CHUNK_MEMORY_BUDGET):
+    """
+    metadata and block reader (see `read_overlap`) of an askap hardware measurement set
+    """
+    hw_nfield = CasaGetNumField(hw_tab_path)
     hw_nant = CasaGetNumAntenna(hwtab)
-
-    logger.info(f"number of antennas: craco - {craco_nant}; askap hardware - {hw_nant}")
-
-    craco_npol = CasaGetNumPol(craco_tab_path)
     hw_npol = CasaGetNumPol(hw_tab_path)
-
-    cracospttab = CasaGetSpt(craco_tab_path)
-    hwspttab = CasaGetSpt(hw_tab_path)
-
-    assert craco_npol == 1, "Cannot handle non-polsum data..."
-
-    craco_nbl = getnbl(craco_nant)
     hw_nbl = getnbl(hw_nant)
+    logger.info(f"askap hardware data - {hw_nant} antennas, {hw_nbl} baselines...")
 
-    logger.info(f"number of baselines: craco - {craco_nbl}; askap hardware - {hw_nbl}")
-
-    cracorawfreq = cracospttab.getcol("CHAN_FREQ").squeeze()
+    hwspttab = CasaGetSpt(hw_tab_path)
     hwrawfreq = hwspttab.getcol("CHAN_FREQ").squeeze()
-
-    cracorawcwid = cracospttab.getcol("CHAN_WIDTH").squeeze().mean()
     hwrawcwid = hwspttab.getcol("CHAN_WIDTH").squeeze().mean()
+    logger.info(f"askap hardware data - {hwrawfreq.shape[0]} channels, channel width of {hwrawcwid/1e6:.2f} MHz...")
 
-    craco_nchan = cracorawfreq.shape[0]
-    hw_nchan = hwrawfreq.shape[0]
-
-    logger.info(f"number of channels: craco - {craco_nchan}; askap hardware - {hw_nchan}")
-    logger.info(f"channel width: craco - {cracorawcwid/1e6:.2f} MHz; askap hardware - {hwrawcwid/1e6:.2f} MHz")
-
-    logger.info("extracting data from tables...")
-    cracodata_raw = cracotab.getcol("DATA")
-    hwdata_raw = hwtab.getcol("DATA")
-    logger.debug("data shape for craco - {}".format(cracodata_raw.shape))
-    logger.debug("data shape for askap hardware - {}".format(hwdata_raw.shape))
-    
-    logger.info("extracting UVW coordinate information from tables...")
-    craco_uvw_raw = cracotab.getcol("UVW")
-    hw_uvw_raw = hwtab.getcol("UVW")
-    logger.debug("uvw data shape for craco - {}".format(craco_uvw_raw.shape))
-    logger.debug("uvw data shape for askap hardware - {}".format(hw_uvw_raw.shape))
-
-    ### NEW PART!!!
-    logger.info("reshaping the data...")
-    cracodata = cracodata_raw.reshape(-1, craco_nbl, craco_nchan, craco_npol)
-    hwdata = hwdata_raw.reshape(-1, hw_nbl, hw_nchan, hw_npol)
-    logger.info(f"new data shape - craco: {cracodata.shape}; askap hardware: {hwdata.shape}")
-    cracouvw = craco_uvw_raw.reshape(-1, craco_nbl, 3)
-    hwuvw = hw_uvw_raw.reshape(-1, hw_nbl, 3)
-    logger.info(f"new uvw data shape - craco: {cracouvw.shape}; askap hardware: {hwuvw.shape}")
-
-    ### need a copy of reshaped data for further investigation
-#     hwdata_raw = hwdata.copy()
-#     cracodata_raw = cracodata.copy()
-#     hwuvw_raw = hwuvw.copy()
-#     cracouvw_raw = cracouvw.copy()
-
-    # UTCTAI_DIFF = 37
-#     UTCTAI_DIFF = 32
-#     OFFSET = 4.921343999906779 # t1
-#     OFFSET = 5.031936000093222 # t2
-#     OFFSET = 4.866047999813557 # t3
-#     OFFSET = 5.087232000186444 # t4
-    OFFSET = 4.976640000000001 # t5 => which is the half of the askap hardware integration
-#     OFFSET = 5.0042880000466115 # t6
+    ### an incomplete integration at the end (e.g., recording stopped) is ignored
+    hw_nt = hwtab.nrows() // hw_nbl
+    if hw_nt * hw_nbl != hwtab.nrows():
+        logger.warning("incomplete integration found at the end of askap hardware data... ignore it...")
+    hwrawtime = hwtab.getcol("TIME", rowincr=hw_nbl)[:hw_nt]
+    hwrawtr = hwtab.getcol("EXPOSURE", rowincr=hw_nbl).mean()
+    logger.info(f"askap hardware data - {hw_nt} integrations, time resolution of {hwrawtr:.2f} s...")
 
-    logger.warning("craco and askap hardware are using different time system...")
+    hw_bl = np.array([hwtab.getcol("ANTENNA1", nrow=hw_nbl), hwtab.getcol("ANTENNA2", nrow=hw_nbl)])
 
-    # cracorawtime = np.unique(cracotab.getcol("TIME")) - UTCTAI_DIFF
-    cracorawtime = Time(
-        np.unique(cracotab.getcol("TIME")) / 3600 / 24, 
-        format="mjd", scale="tai"
-    ).utc.value * 3600 * 24
-    cracorawtime = cracorawtime + OFFSET  #<============= apply the offset to check
-    hwrawtime = np.unique(hwtab.getcol("TIME"))
-
-    craco_nt = cracorawtime.shape[0]
-    hw_nt = hwrawtime.shape[0]
-    
-    logger.info(f"number of integrations - craco: {craco_nt}; askap hardware: {hw_nt}")
+    def read(tsel, fsel, tave, fave):
+        return read_vis_chunked(hwtab, hw_nbl, tsel, fsel, hw_npol, tave, fave, polsum=True, membudget=membudget)
 
-    assert craco_nt == cracodata.shape[0], "different number of integrations found in craco data..."
-    assert hw_nt == hwdata.shape[0], "different number of integrations found in craco data..."
+    return dict(freq=hwrawfreq, cwid=hwrawcwid, time=hwrawtime, tr=hwrawtr, bl=hw_bl, read=read)
 
-    logger.info(f"number of integrations - craco: {craco_nt}; askap hardware: {hw_nt}")
+def load_uvfits(craco_uvfits_path, hw_tab_path, membudget=CHUNK_MEMORY_BUDGET):
+    """
+    `load_measurement_sets` reading craco data from its uvfits file directly (without `importuvfits`)
 
-    cracorawtr = cracotab.getcol("EXPOSURE").mean()
-    hwrawtr = hwtab.getcol("EXPOSURE").mean()
+    times are expected in the same system as craco measurement sets converted from the uvfits
+    files, uvw are converted to meters, and polarisations are summed if there are more than one
+    """
+    reader = UVFitsReader(craco_uvfits_path)
+    hwtab = tables.table(hw_tab_path)
+    hw = _open_hw_ms(hwtab, hw_tab_path, membudget)
 
-    logger.info(f"time resolution: craco - {cracorawtr:.2f} s; askap hardware - {hwrawtr:.2f} s")
+    logger.info(f"craco data - {reader.nant} antennas, {reader.nbl} baselines, {reader.nchan} channels, {reader.nt} integrations...")
+    # uvfits dates are in jd, craco measurement sets use mjd in seconds
+    cracorawtime = craco_utc_time((reader.times - 2400000.5) * 3600 * 24)
+    # dates are too coarse for the craco integration time, use INTTIM or snap it to the hardware one
+    cracorawtr = reader.integration_time(hw["tr"])
+    logger.info(f"craco data - integration time of {cracorawtr:.6f} s...")
+    cracorawcwid = abs(np.median(np.diff(reader.freqs))) if reader.nchan > 1 else 0.
 
-    logger.info("get baseline information...") # they are sorted in the same order for different integration...
+    def read(tsel, fsel, tave, fave):
+        return read_uvfits_chunked(reader, tsel, fsel, tave, fave, polsum=reader.npol > 1, membudget=membudget)
 
-    ###
-    craco_bl = np.array([
-        cracotab.getcol("ANTENNA1")[:craco_nbl], cracotab.getcol("ANTENNA2")[:craco_nbl]
-    ])
-    hw_bl = np.array([
-        hwtab.getcol("ANTENNA1")[:hw_nbl], hwtab.getcol("ANTENNA2")[:hw_nbl]
-    ])
+    craco = dict(freq=reader.freqs, cwid=cracorawcwid, time=cracorawtime, tr=cracorawtr, read=read)
 
-    cracorawfreq_s = cracorawfreq - cracorawcwid / 2
-    hwrawfreq_s = hwrawfreq - hwrawcwid / 2
+    cracodata, hwdata, cracouvw, hwuvw, central_freq, central_time = read_overlap(craco, hw)
+    hwtab.close()
 
-    cracofs, hwfs, cracofa, hwfa = find_sequence_overlap_slice(
-        cracorawfreq_s, hwrawfreq_s, cracorawcwid / 2 # 100 Hz
-    )
+    return cracodata, hwdata, cracouvw, hwuvw, central_freq, central_time, reader.blpairs, hw["bl"]
 
-    assert hwfa == 1, "there should be no averaging for askap hardware data..."
-    logger.info(f"select {cracofs} from craco and {hwfs} from askap hardware data")
 
-    logger.info("extracting overlapping data on frequency axis...")
-    cracodata = cracodata[:, :, cracofs, :].copy()
-    hwdata = hwdata[:, :, hwfs, :].copy()
-    logger.info(f"shape of overlapping data: craco - {cracodata.shape}; askap hardware - {hwdata.shape}")
+def load_measurement_sets(craco_tab_path, hw_tab_path, membudget=CHUNK_MEMORY_BUDGET):
 
-    logger.info("averaging craco data on frequency axis...")
-    cracodata_tmp = cracodata.reshape(craco_nt, craco_nbl, -1, cracofa, craco_npol)
-    cracodata = cracodata_tmp.mean(axis=3)
-    logger.info(f"shape of data after frequency averaging: craco - {cracodata.shape}; askap hardware - {hwdata.shape}")
+    cracotab = tables.table(craco_tab_path)
+    hwtab = tables.table(hw_tab_path)
 
-    central_freq = hwrawfreq[hwfs]
-    nchan = central_freq.shape[0]
+    craco_nfield = CasaGetNumField(craco_tab_path)
 
-    cracorawtime_s = cracorawtime - cracorawtr / 2
-    hwrawtime_s = hwrawtime - hwrawtr / 2
+    # craco_nant = CasaGetNumAntenna(craco_tab_path)
+    # logger.warning("Number of antenna stored in craco measurement sets is wrong... Update to 30...")
+    # craco_nant = 30
+    craco_nant = CasaGetNumAntenna(cracotab)
+    craco_npol = CasaGetNumPol(craco_tab_path)
+    cracospttab = CasaGetSpt(craco_tab_path)
 
-    cracots, hwts, cracota, hwta = find_sequence_overlap_slice(
-        cracorawtime_s, hwrawtime_s, cracorawtr / 2 
-    )
+    assert craco_npol == 1, "Cannot handle non-polsum data..."
 
-    assert hwta == 1, "there should be no averaging for askap hardware data..."
-    logger.info(f"select {cracots} from craco and {hwts} from askap hardware data")
+    craco_nbl = getnbl(craco_nant)
+    logger.info(f"craco data - {craco_nant} antennas, {craco_nbl} baselines...")
 
-    logger.info("extracting overlapping data on time axis...")
-    cracodata = cracodata[cracots, :, :, :].copy()
-    hwdata = hwdata[hwts, :, :, :].copy()
-    ### add code for averaging uvw data...
-    cracouvw = cracouvw[cracots, :, :].copy()
-    hwuvw = hwuvw[hwts, :, :].copy()
+    cracorawfreq = cracospttab.getcol("CHAN_FREQ").squeeze()
+    cracorawcwid = cracospttab.getcol("CHAN_WIDTH").squeeze().mean()
+    logger.info(f"craco data - {cracorawfreq.shape[0]} channels, channel width of {cracorawcwid/1e6:.2f} MHz...")
 
-    logger.info(f"shape of overlapping data: craco - {cracodata.shape}; askap hardware - {hwdata.shape}")
-    logger.info(f"shape of overlapping uvw data: craco - {cracouvw.shape}; askap hardware - {hwuvw.shape}")
+    ### rows are sorted by integration and then baseline - only read the first row of each integration
+    ### an incomplete integration at the end (e.g., recording stopped) is ignored
+    craco_nt = cracotab.nrows() // craco_nbl
+    if craco_nt * craco_nbl != cracotab.nrows():
+        logger.warning("incomplete integration found at the end of craco data... ignore it...")
+    # cracorawtime = np.unique(cracotab.getcol("TIME")) - UTCTAI_DIFF
+    cracorawtime = craco_utc_time(cracotab.getcol("TIME", rowincr=craco_nbl)[:craco_nt])  #<============= apply the offset to check
+    cracorawtr = cracotab.getcol("EXPOSURE", rowincr=craco_nbl).mean()
+    logger.info(f"craco data - {craco_nt} integrations, time resolution of {cracorawtr:.2f} s...")
 
-    logger.info("averaging craco data on time axis...")
-    cracodata_tmp = cracodata.reshape(-1, cracota, craco_nbl, nchan, craco_npol)
-    cracodata = cracodata_tmp.mean(axis=1)
-    cracouvw_tmp = cracouvw.reshape(-1, cracota, craco_nbl, 3)
-    cracouvw = cracouvw_tmp.mean(axis=1)
-    logger.info(f"shape of data after time averaging: craco - {cracodata.shape}; askap hardware - {hwdata.shape}")
-    logger.info(f"shape of overlapping uvw data: craco - {cracouvw.shape}; askap hardware - {hwuvw.shape}")
+    logger.info("get baseline information...") # they are sorted in the same order for different integration...
+    craco_bl = np.array([
+        cracotab.getcol("ANTENNA1", nrow=craco_nbl), cracotab.getcol("ANTENNA2", nrow=craco_nbl)
+    ])
 
-    central_time = hwrawtime[hwts]
-    nt = central_time.shape[0]
+    def read(tsel, fsel, tave, fave):
+        return read_vis_chunked(cracotab, craco_nbl, tsel, fsel, craco_npol, tave, fave, membudget=membudget)
 
-    logger.info("summing up polarisation (XX+YY)...")
-    if hw_npol == 4: #XX, XY, YX, YY
-        hwdata = hwdata[..., (0, -1)].sum(axis=-1)
-    elif hw_npol == 2:
-        hwdata = hwdata.sum(axis=-1)
-        
-    logger.info("drop polarisation dimension...")
-    cracodata = cracodata[..., 0].copy()
+    craco = dict(freq=cracorawfreq, cwid=cracorawcwid, time=cracorawtime, tr=cracorawtr, read=read)
+    hw = _open_hw_ms(hwtab, hw_tab_path, membudget)
 
-    logger.info(f"shape of data now: craco - {cracodata.shape}; askap hardware - {hwdata.shape}")
+    cracodata, hwdata, cracouvw, hwuvw, central_freq, central_time = read_overlap(craco, hw)
 
     cracotab.close(); hwtab.close()
 
-    return cracodata, hwdata, cracouvw, hwuvw, central_freq, central_time, craco_bl, hw_bl
+    return cracodata, hwdata, cracouvw, hwuvw, central_freq, central_time, craco_bl, hw["bl"]
 
 
 ### only extract corresponding baselines to make comparision more easily
 def find_hwbl_overlap(craco_bl, hw_bl):
-    hw_bl_sel = np.full((craco_bl.shape[-1],), -1)
-    for idx in range(craco_bl.shape[-1]):
-        ant1 = craco_bl[0][idx]; ant2 = craco_bl[1][idx]
-        hw_bl_sel[idx] = np.where((hw_bl[0] == ant1) & (hw_bl[1] == ant2))[0][0]
-        
+    hw_bl_sel = map_baselines(craco_bl, hw_bl)
+    assert (hw_bl_sel >= 0).all(), "some craco baselines are not found in askap hardware data..."
     return hw_bl_sel
 
 def find_crosscor(bl):
-    bl_sel = np.full((bl.shape[-1],), False)
-    for idx in range(bl.shape[-1]):
-        ant1, ant2 = bl[:, idx]
-        if ant1 != ant2:
-            bl_sel[idx] = True
-    return bl_sel
+    return cross_mask(bl)
 
 def find_ant_bl(bl, ant, zero_index=False):
     if not zero_index: ant -= 1
-        
-    bl_sel = np.full((bl.shape[-1],), False)
-    for idx in range(bl.shape[-1]):
-        ant1, ant2 = bl[:, idx]
-        if ant1 == ant or ant2 == ant:
-            bl_sel[idx] = True
-    return bl_sel
\ No newline at end of file
+    return ant_mask(bl, ant)
@@ -1,9 +1,12 @@
 ### Derive system temperature from a known calibrator observation
 
-from scipy.optimize import leastsq
 from casacore import tables
 import numpy as np
 
+from baseline_index import getnbl, baseline_pairs, cross_index
+from clipping import sigma_clip_mask
+from chunkstore import write_chunked
+
 import logging
 import sys
 
@@ -35,19 +38,15 @@ def CasaGetSpt(tabpath):
     logger.info(f"loading spectrum tab from {tabpath}...")
     return tables.table(f"{tabpath}::SPECTRAL_WINDOW")
 
-def getnbl(nant, auto=True):
-    return int(nant * (nant - 1) / 2 + nant) if auto else int(nant * (nant - 1) / 2)
-
-
 def get_crosspair_index(nant):
-    idx = 0
-    crossidx = []
-    for ant1 in range(nant):
-        for ant2 in range(ant1, nant):
-            if ant1 != ant2: crossidx.append(idx)
-            idx += 1
-    return crossidx
+    return cross_index(baseline_pairs(nant))
+
 
+### memory (in bytes) allowed for a single block of visibilities read from the table
+CHUNK_MEMORY_BUDGET = 512 * 1024**2
+### chunk shape and attributes of the (cross baseline, channel, polarisation) SEFD stores
+SEFD_CHUNKS = (64, 64, 4)
+SEFD_ATTRS = dict(dims=["baseline", "channel", "pol"])
 
 ### tweak the data a little bit
 def _tweak_time_slice(sample_ave, nsamp):
@@ -58,52 +57,164 @@ def _tweak_time_slice(sample_ave, nsamp):
     return slice(start, -end)
 
 
-def SEFD_pairs_function(SEFD_ants, SEFD_pairs):
+def _merge_running_stats(count, mean, m2, values):
     """
-    function passed to `leastsq` function to do final fitting...
+    merge a block of values (first axis) into running count, mean and sum of squared deviation
+    nan values are ignored
     """
-    SEFD_pairs = SEFD_pairs.reshape(-1)
-    
-    nant = len(SEFD_ants)
-    nbl = int(nant * (nant - 1) / 2)
-    
-    assert nbl == len(SEFD_pairs), "non-matched baseline numbers..."
-    
-    prod_list = []; index = 0
-    for i in range(nant):
-        for j in range(i+1, nant):
-            if np.isnan(SEFD_pairs[index]):
-                # set to zero for error value, otherwise it will give initial value...
-                prod_list.append(0)
-            else:
-                prod_list.append(SEFD_ants[i]*SEFD_ants[j] - SEFD_pairs[index])
-                
-            index += 1
-            
-    return np.array(prod_list)
-
-
-def SEFD_ant_fit(SEFD_pairs, nant, defaultSEFD):
+    valid = np.isfinite(values)
+    bcount = valid.sum(axis=0)
+    bsum = np.where(valid, values, 0).sum(axis=0)
+    bmean = np.divide(bsum, bcount, out=np.zeros_like(bsum), where=bcount > 0)
+    bm2 = (np.where(valid, values - bmean, 0)**2).sum(axis=0)
+
+    total = count + bcount
+    delta = bmean - mean
+    ratio = np.divide(bcount, total, out=np.zeros_like(bsum), where=total > 0)
+    mean = mean + delta * ratio
+    m2 = m2 + bm2 + delta**2 * count * ratio
+    return total, mean, m2
+
+
+def stream_time_average_stats(
+    caltab, nbl, crossidx, nchan, npol, sample_ave, tsel,
+    membudget=CHUNK_MEMORY_BUDGET,
+):
     """
-    SEFD fitting for a single antenna...
+    mean and standard deviation of the real part of `sample_ave` averaged cross-correlations
+
+    the table is read in blocks aligned to `sample_ave` integrations, flagged
+    visibilities are excluded from the averages, and mean/variance over the
+    averaged samples are accumulated with Welford-style running sums.
+    `tsel` is the (start, end) integration range used.
+    return mean and std with a shape of (ncross, nchan, npol)
     """
-    x0 = np.ones(nant) * defaultSEFD
-    SEFD_ant, cov = leastsq(SEFD_pairs_function, x0, args=SEFD_pairs)
-    return SEFD_ant
+    ncross = len(crossidx)
+    count = np.zeros((ncross, nchan, npol))
+    mean = np.zeros((ncross, nchan, npol))
+    m2 = np.zeros((ncross, nchan, npol))
 
-def mask_extreme_value(series, loop = 10, stdtor = 3):
-    series = series.copy()
+    intbytes = nbl * nchan * npol * (np.dtype(np.complex64).itemsize + 1) # data and flag
+    blockint = max(1, int(membudget // intbytes) // sample_ave) * sample_ave
+
+    tstart, tend = tsel
+    for i0 in range(tstart, tend, blockint):
+        i1 = min(i0 + blockint, tend)
+        startrow = i0 * nbl; nrow = (i1 - i0) * nbl
+        logger.debug(f"reading integrations {i0} to {i1}...")
+
+        blockdata = caltab.getcol("DATA", startrow=startrow, nrow=nrow)
+        blockdata = blockdata.reshape(-1, nbl, nchan, npol)[:, crossidx]
+        blockvalid = ~caltab.getcol("FLAG", startrow=startrow, nrow=nrow)
+        blockvalid = blockvalid.reshape(-1, nbl, nchan, npol)[:, crossidx]
+
+        ### flag-aware average over `sample_ave` integrations
+        blockshape = (-1, sample_ave, ncross, nchan, npol)
+        blocksum = np.where(blockvalid, blockdata.real, 0).reshape(blockshape).sum(axis=1)
+        blockcount = blockvalid.reshape(blockshape).sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            tave_crossreal = blocksum / blockcount # nan if all samples are flagged
+
+        count, mean, m2 = _merge_running_stats(count, mean, m2, tave_crossreal)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(count > 0, mean, np.nan)
+        std = np.sqrt(m2 / count)
+    return mean, std
+
+
+def SEFD_pairs_function(SEFD_ants, SEFD_pairs, ant1, ant2):
+    """
+    residual between the product of antenna SEFDs and the baseline SEFDs
+
+    SEFD_ants has a shape of (nchan, nant), SEFD_pairs has a shape of (nchan, nbl),
+    `ant1` and `ant2` are the antenna indices of each baseline
+    """
+    return SEFD_ants[:, ant1] * SEFD_ants[:, ant2] - SEFD_pairs
+
+
+def _solve_normal(normal, rhs, antvalid, ridge=1e-10):
+    """
+    solve batched normal equations, antennas without any valid baseline are fixed to zero
+    """
+    nant = normal.shape[-1]
+    diag = np.arange(nant)
+
+    normal = np.where(antvalid[:, :, None] & antvalid[:, None, :], normal, 0.)
+    normal[:, diag, diag] += ~antvalid
+    # small ridge to keep the system solvable for poorly connected antennas
+    normal[:, diag, diag] += ridge * normal[:, diag, diag].mean(axis=1, keepdims=True)
+    rhs = np.where(antvalid, rhs, 0.)
+
+    return np.linalg.solve(normal, rhs[..., None])[..., 0]
 
-    for i in range(loop):
-        median = np.nanmedian(series)
-        std = np.nanstd(series)
 
-        series[series > median + stdtor * std] = np.nan
+def SEFD_ant_fit_batch(SEFD_pairs, nant, niter=20, tol=1e-8, damping=1e-6):
+    """
+    SEFD fitting for all channels together...
+
+    `SEFD_pairs` has a shape of (nbl, nchan) for cross-correlations, nan baselines are masked.
+    log(SEFD_i) + log(SEFD_j) = log(SEFD_ij) is solved as a linear problem first,
+    then refined with Gauss-Newton iterations on SEFD_i * SEFD_j - SEFD_ij with
+    an analytic jacobian. return antenna SEFDs with a shape of (nchan, nant)
+    """
+    ant1, ant2 = baseline_pairs(nant, auto=False)
+    SEFD_pairs = np.asarray(SEFD_pairs, dtype=float).T
+    assert SEFD_pairs.shape[-1] == ant1.shape[0], "non-matched baseline numbers..."
+
+    valid = np.isfinite(SEFD_pairs) & (SEFD_pairs > 0)
+    weight = valid.astype(float)
+    pairs = np.where(valid, SEFD_pairs, 1.)
+
+    # one-hot matrices to sum baseline values onto antennas
+    onehot1 = np.eye(nant)[ant1]; onehot2 = np.eye(nant)[ant2]
+    antvalid = (weight @ onehot1 + weight @ onehot2) > 0
+
+    def normal_matrix(diag, offdiag):
+        normal = np.zeros((SEFD_pairs.shape[0], nant, nant))
+        normal[:, ant1, ant2] = offdiag
+        normal[:, ant2, ant1] = offdiag
+        normal[:, np.arange(nant), np.arange(nant)] = diag
+        return normal
+
+    ### log-linear initialisation
+    logpairs = weight * np.log(pairs)
+    normal = normal_matrix(weight @ onehot1 + weight @ onehot2, weight)
+    SEFD_ants = np.exp(_solve_normal(normal, logpairs @ onehot1 + logpairs @ onehot2, antvalid))
+
+    ### Gauss-Newton refinement, jacobian of SEFD_i * SEFD_j is (SEFD_j, SEFD_i)
+    for i in range(niter):
+        SEFD1 = SEFD_ants[:, ant1]; SEFD2 = SEFD_ants[:, ant2]
+        resid = weight * SEFD_pairs_function(SEFD_ants, pairs, ant1, ant2)
+
+        diag = (weight * SEFD2**2) @ onehot1 + (weight * SEFD1**2) @ onehot2
+        normal = normal_matrix(diag * (1 + damping), weight * SEFD1 * SEFD2)
+        grad = (resid * SEFD2) @ onehot1 + (resid * SEFD1) @ onehot2
+
+        step = _solve_normal(normal, -grad, antvalid)
+        SEFD_ants = SEFD_ants + step
+
+        if np.nanmax(np.abs(step) / np.abs(SEFD_ants)) < tol: break
+
+    logger.info(f"SEFD fitting finished after {i+1} iteration(s)...")
+
+    SEFD_ants[~antvalid] = np.nan
+    return SEFD_ants
 
+
+def SEFD_ant_fit(SEFD_pairs, nant):
+    """
+    SEFD fitting for a single channel...
+    """
+    return SEFD_ant_fit_batch(np.reshape(SEFD_pairs, (-1, 1)), nant)[0]
+
+def mask_extreme_value(series, loop = 10, stdtor = 3):
+    series = series.copy()
+    series[sigma_clip_mask(series, nsigma=stdtor, maxiter=loop)] = np.nan
     return series
 
 
-def main(calmspath, sample_ave=30, srcflux=15, defaultSEFD=2., pathdir="."):
+def main(calmspath, sample_ave=30, srcflux=15, pathdir=".", membudget=CHUNK_MEMORY_BUDGET):
     if calmspath.endswith("/"): calmspath = calmspath[:-1]
     calmsname = calmspath.split("/")[-1]
     
@@ -117,74 +228,46 @@ def main(calmspath, sample_ave=30, srcflux=15, defaultSEFD=2., pathdir="."):
 
     nchan = spttab.getcol("CHAN_WIDTH").shape[-1]
     fres = spttab.getcol("CHAN_WIDTH").mean()
-    tres = caltab.getcol("EXPOSURE").mean()
+    tres = caltab.getcol("EXPOSURE", rowincr=nbl).mean()
 
     logger.info(f"number of channel: {nchan}...")
     logger.info(f"frequency resolution: {fres/1e6:.3f}MHz, time resolution: {tres:3f}s...")
 
-    logger.info("getting `DATA` column...")
-    visdata = caltab.getcol("DATA")
-    logger.info("getting `FLAG` column...")
-    visflag = caltab.getcol("FLAG")
-
-    logger.info("replacing flagged data as nan...")
-    visdata[visflag] = np.nan
-
-    logger.info("reshaping the vis data...")
-    visdata = visdata.reshape(-1, nbl, nchan, npol)
-    logger.info(f"reshaped data shape: {visdata.shape}")
-
     crossidx = get_crosspair_index(nant)
-    logger.info("getting cross-correlation...")
-    crossdata = visdata[:, crossidx, :, :]
 
-    nsamp_raw = crossdata.shape[0]
+    nsamp_raw = caltab.nrows() // nbl
     tsel = _tweak_time_slice(sample_ave, nsamp_raw)
+    tsel = tsel.indices(nsamp_raw)[:2]
     logger.info(f"selecting data to do further formatting... data selected - {tsel}")
-    crossdata = crossdata[tsel, ...]
-
-    logger.info(f"averaging data over {sample_ave} samples...")
-    tave_crossdata = crossdata.reshape(-1, sample_ave, nbl-nant, nchan, npol)
-    tave_crossdata = np.nanmean(tave_crossdata, axis=1)
 
-    logger.info("extracting real part of the visibility data...")
-    tave_crossreal = tave_crossdata.real
-
-    logger.info("calculating snr of the observation...")
-    tavem_ = np.nanmean(tave_crossreal, axis=0)
-    taves_ = np.nanstd(tave_crossreal, axis=0)
+    logger.info(f"averaging data over {sample_ave} samples and calculating snr of the observation...")
+    tavem_, taves_ = stream_time_average_stats(
+        caltab, nbl, crossidx, nchan, npol, sample_ave, tsel, membudget=membudget,
+    )
     snr = tavem_ / taves_
     
     flagged_ratio = 0.2
     SEFD_pairs = (srcflux/snr * np.sqrt(1 - flagged_ratio))**2 * 2 * 2 * fres * sample_ave * tres / 1e6 # in the unit of (K Kelvin)**2
 
-    ### save SEFD pairs to numpy files
-    logger.info("saving raw SEFD baseline value to file...")
-    np.save(f"{pathdir}/{calmsname}.SEFD.baseline.npy", SEFD_pairs)
+    ### save SEFD pairs to a chunked store
+    logger.info("saving raw SEFD baseline value to a chunked store...")
+    write_chunked(f"{pathdir}/{calmsname}.SEFD.baseline.chunks", SEFD_pairs, SEFD_CHUNKS, attrs=SEFD_ATTRS)
 
     ### mask out extreme values and keep a copy
     logger.info("masking extreme values...")
-    for ichan in range(nchan):
-        SEFD_pairs[:, ichan, 0] = mask_extreme_value(SEFD_pairs[:, ichan, 0])
+    SEFD_clipped = sigma_clip_mask(SEFD_pairs, axis=0, nsigma=3, maxiter=10)
+    SEFD_pairs[SEFD_clipped] = np.nan
 
     ### check how many data has been masked...
     nnum = SEFD_pairs.size
     nflag = np.isnan(SEFD_pairs).sum()
     logger.info(f"{nflag}/{nnum} = {100*nflag/nnum:.2f}% data has been flagged...")
 
-    logger.info("saving masked SEFD baseline value to file...")
-    np.save(f"{pathdir}/{calmsname}.SEFD.baseline.mask.npy", SEFD_pairs)
+    logger.info("saving masked SEFD baseline value to a chunked store...")
+    write_chunked(f"{pathdir}/{calmsname}.SEFD.baseline.mask.chunks", SEFD_pairs, SEFD_CHUNKS, attrs=SEFD_ATTRS)
 
     logger.info("fitting antenna temperatures...")
-    SEFD_ants = []
-    for ichan in range(nchan):
-        if ichan % 32 == 0: logger.info(f"{ichan} finished...")
-        SEFD_ant = SEFD_ant_fit(SEFD_pairs[:, ichan, 0], nant, defaultSEFD)
-        SEFD_ants.append(SEFD_ant.reshape(1, -1))
-
-    SEFD_ants = np.vstack(SEFD_ants)
-
-    SEFD_ants[SEFD_ants == defaultSEFD] = np.nan # it cannot be the initial value after fitting...
+    SEFD_ants = SEFD_ant_fit_batch(SEFD_pairs[:, :, 0], nant)
 
     logger.info(f"saving final antenna temperature to {pathdir}/{calmsname}.SEFDant.npy...")
     np.save(f"{pathdir}/{calmsname}.SEFDant.npy", SEFD_ants)
@@ -0,0 +1,128 @@
+"""
+per-beam products of the craco/askap hardware comparison
+
+products are kept in a folder with one file per array and a `manifest.json`
+listing the shape, dtype and file of every array, which arrays are the
+frequency/time axes and which are the baseline maps. small arrays are `.npy`
+files opened with a memory map, visibility cubes are chunked stores, so
+nothing is read until it is indexed
+"""
+
+import numpy as np
+import json
+import os
+
+from chunkstore import ChunkedArray, write_chunked, is_chunked
+
+MANIFEST_FNAME = "manifest.json"
+PRODUCTS_DIRNAME = "products"
+
+def get_products_path(outpath):
+    return f"{outpath}/{PRODUCTS_DIRNAME}"
+
+def write_products(path, arrays, stores=None, chunks=None, dims=None, axes=None, baselines=None):
+    """
+    write `arrays` as `.npy` files and `stores` as chunked stores (with chunk shape `chunks`) to `path`
+
+    `dims` maps an array name to the names of its dimensions, `axes` maps an axis name
+    (e.g., freq, time) to an array name, and `baselines` maps a dataset (e.g., craco, hw)
+    to its baseline array name
+    """
+    stores = stores or {}; dims = dims or {}
+    if not os.path.exists(path): os.makedirs(path)
+    if is_products(path): os.remove(f"{path}/{MANIFEST_FNAME}")
+
+    entries = {}
+    for key, value in arrays.items():
+        value = np.asarray(value)
+        np.save(f"{path}/{key}.npy", value)
+        entries[key] = dict(file=f"{key}.npy", format="npy", shape=value.shape, dtype=value.dtype.str)
+    for key, value in stores.items():
+        store = write_chunked(f"{path}/{key}.chunks", value, chunks, attrs=dict(dims=dims.get(key)))
+        entries[key] = dict(file=f"{key}.chunks", format="chunked", shape=store.shape, dtype=store.dtype.str)
+    for key, entry in entries.items():
+        entry["dims"] = dims.get(key)
+
+    manifest = dict(arrays=entries, axes=axes or {}, baselines=baselines or {})
+    # write the manifest last, an output without it is incomplete
+    with open(f"{path}/{MANIFEST_FNAME}", "w") as fp:
+        json.dump(manifest, fp, indent=2)
+
+def is_products(path):
+    return os.path.exists(f"{path}/{MANIFEST_FNAME}")
+
+class DiagnoseProducts:
+    """
+    lazy view of a products folder, arrays are opened when accessed and kept open
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(f"{path}/{MANIFEST_FNAME}") as fp:
+            self.manifest = json.load(fp)
+        self._arrays = {}
+
+    def keys(self):
+        return self.manifest["arrays"].keys()
+
+    def __contains__(self, key):
+        return key in self.manifest["arrays"]
+
+    def __getitem__(self, key):
+        if key not in self._arrays:
+            entry = self.manifest["arrays"][key]
+            fname = f"{self.path}/{entry['file']}"
+            if entry["format"] == "chunked": self._arrays[key] = ChunkedArray(fname)
+            else: self._arrays[key] = np.load(fname, mmap_mode="r")
+        return self._arrays[key]
+
+    def shape(self, key):
+        return tuple(self.manifest["arrays"][key]["shape"])
+
+    def axis(self, name):
+        return self[self.manifest["axes"][name]]
+
+    def baselines(self, name):
+        return self[self.manifest["baselines"][name]]
+
+class LegacyProducts:
+    """
+    lazy view of an older output, small arrays are in `loaded_data.npz` and visibility
+    cubes are either in the npz or `{key}.chunks` stores next to it. the npz is kept
+    open and each array is only read from it once
+    """
+
+    def __init__(self, outpath):
+        self.outpath = outpath
+        self.npz = np.load(f"{outpath}/loaded_data.npz")
+        self._arrays = {}
+
+    def _store_path(self, key):
+        return f"{self.outpath}/{key}.chunks"
+
+    def keys(self):
+        keys = list(self.npz.keys())
+        for key in ("cracodata", "hwdata"):
+            if key not in keys and is_chunked(self._store_path(key)): keys.append(key)
+        return keys
+
+    def __contains__(self, key):
+        return key in self.npz or is_chunked(self._store_path(key))
+
+    def __getitem__(self, key):
+        if key not in self._arrays:
+            if key in self.npz: self._arrays[key] = self.npz[key]
+            elif is_chunked(self._store_path(key)): self._arrays[key] = ChunkedArray(self._store_path(key))
+            else: raise KeyError(key)
+        return self._arrays[key]
+
+    def close(self):
+        self.npz.close()
+
+def open_products(outpath):
+    """
+    open the products of a beam, older outputs only have `loaded_data.npz` (and possibly chunked visibility stores)
+    """
+    path = get_products_path(outpath)
+    if is_products(path): return DiagnoseProducts(path)
+    return LegacyProducts(outpath)
@@ -1,6 +1,7 @@
 import glob
 import numpy as np
 from compare_craco_askaphw import *
+from diagnose_products import open_products
 
 def plot_uvw_difference(craco_hw_uvw_diff, manual_bl_sel=None, title=None):
     if manual_bl_sel is not None:
@@ -25,27 +26,26 @@ def plot_uvw_difference(craco_hw_uvw_diff, manual_bl_sel=None, title=None):
     return fig
 
 def load_summarized_data(SBID, beam):
-    ms_data = np.load(f"../workdir/HW_compare/{SBID}/{beam:0>2}/loaded_data.npz")
+    """
+    read the products of a beam, all arrays are returned as numpy arrays
+    """
+    ms_data = open_products(f"../workdir/HW_compare/{SBID}/{beam:0>2}")
     
-    cracodata = ms_data["cracodata"]
-    hwdata = ms_data["hwdata"]
-    craco_bl = ms_data["craco_bl"]
-    hw_bl = ms_data["hw_bl"]
-    cracouvw = ms_data["cracouvw"]
-    hwuvw = ms_data["hwuvw"]
+    cracodata = ms_data["cracodata"][...]
+    hwdata = ms_data["hwdata"][...]
+    craco_bl = ms_data["craco_bl"][...]
+    hw_bl = ms_data["hw_bl"][...]
+    cracouvw = ms_data["cracouvw"][...]
+    hwuvw = ms_data["hwuvw"][...]
     hwuvw = hwuvw[:, find_hwbl_overlap(craco_bl, hw_bl), :]
     
     return cracodata, hwdata, craco_bl, hw_bl, cracouvw, hwuvw
 
-def plot_main(SBID, beam, nant=30, plotwaterfall=True, plotuvw=True):
-    ms_data = np.load(f"./{SBID}/{beam:0>2}/loaded_data.npz")
+def plot_main(SBID, beam, nant=30, plotwaterfall=True, plotuvw=True, figformat="png", tilesize=(48, 48)):
+    ms_data = open_products(f"./{SBID}/{beam:0>2}")
     
-    cracodata = ms_data["cracodata"]
-    hwdata = ms_data["hwdata"]
     craco_bl = ms_data["craco_bl"]
     hw_bl = ms_data["hw_bl"]
-    cracouvw = ms_data["cracouvw"]
-    hwuvw = ms_data["hwuvw"]
     
 #     manual_bl_sel = None
 ############### CHANGE HERE IF YOU WANNA CHANGE FLAGGING ################
@@ -54,61 +54,27 @@ def plot_main(SBID, beam, nant=30, plotwaterfall=True, plotuvw=True):
 ############### CHANGE HERE IF YOU WANNA CHANGE FLAGGING ################
 
     if plotwaterfall:
-    
-        fig, ax = plt.subplots(nant, nant, figsize=(nant, nant), sharex=True, sharey=True, dpi=100)
-        plt.subplots_adjust(wspace=0, hspace=0)
-
-        for ant1 in range(1, nant+1):
-            for ant2 in range(1, nant+1):
-
-                if ant1 == 1:
-                    ax[ant2-1, ant1-1].set_ylabel(f"ak{ant2}")
-                if ant2 == nant:
-                    ax[ant2-1, ant1-1].set_xlabel(f"ak{ant1}")
 
-                if ant1 >= ant2: continue
+        # hardware data is only read for the overlapping baselines, and only once for both metrics
+        cracodata = ms_data["cracodata"][...]
+        hwdata = ms_data["hwdata"][:, find_hwbl_overlap(craco_bl, hw_bl), :]
 
-                waterfall = waterfall_compare(cracodata, hwdata, craco_bl, hw_bl, ant1, ant2, metrics="phase")
-
-                plot_waterfall_compare(waterfall, ax[ant2-1, ant1-1], metrics="phase")
-
-
-                ax[ant2-1, ant1-1].set_xticks([])
-                ax[ant2-1, ant1-1].set_yticks([])
-
-        fig.savefig(f"./{SBID}/{beam:0>2}/hw_craco_phase_beam{beam:0>2}.pdf", bbox_inches="tight")
-        plt.close()
+        for metrics, figname in (("phase", "hw_craco_phase_beam"), ("amp", "hw_craco_phase_amp")):
 
+            compcube = compare_all_baselines(cracodata, hwdata, craco_bl, metrics=metrics)
 
-        fig, ax = plt.subplots(nant, nant, figsize=(nant, nant), sharex=True, sharey=True, dpi=100)
-        plt.subplots_adjust(wspace=0, hspace=0)
-
-        for ant1 in range(1, nant+1):
-            for ant2 in range(1, nant+1):
-
-                if ant1 == 1:
-                    ax[ant2-1, ant1-1].set_ylabel(f"ak{ant2}")
-                if ant2 == nant:
-                    ax[ant2-1, ant1-1].set_xlabel(f"ak{ant1}")
-
-                if ant1 >= ant2: continue
-
-                waterfall = waterfall_compare(cracodata, hwdata, craco_bl, hw_bl, ant1, ant2, metrics="amp")
-
-                plot_waterfall_compare(waterfall, ax[ant2-1, ant1-1], metrics="amp")
-
-
-                ax[ant2-1, ant1-1].set_xticks([])
-                ax[ant2-1, ant1-1].set_yticks([])
-
-        fig.savefig(f"./{SBID}/{beam:0>2}/hw_craco_phase_amp{beam:0>2}.pdf", bbox_inches="tight")
-        plt.close()
+            logger.info(f"plotting {metrics} mosaic for beam{beam}...")
+            plot_baseline_mosaic(
+                compcube, craco_bl, nant, f"./{SBID}/{beam:0>2}/{figname}{beam:0>2}.{figformat}",
+                metrics=metrics, tilesize=tilesize, title=f"BEAM{beam:0>2} {metrics}",
+            )
         
     if plotuvw:
 
         logger.info(f"plotting uvw differences for beam{beam}...")
 
-        hwuvw = hwuvw[:, find_hwbl_overlap(craco_bl, hw_bl), :]
+        cracouvw = ms_data["cracouvw"]
+        hwuvw = ms_data["hwuvw"][:, find_hwbl_overlap(craco_bl, hw_bl), :]
         craco_hw_uvw_diff = cracouvw - hwuvw
         fig = plot_uvw_difference(craco_hw_uvw_diff, manual_bl_sel, f"BEAM{beam:0>2}")
 
@@ -0,0 +1,186 @@
+### Derive SEFDs for many calibrator measurement sets in parallel
+
+import glob
+import numpy as np
+from derive_SEFD import main as derive_SEFD, logger, formatter, CHUNK_MEMORY_BUDGET
+from batch_utils import ms_mtime, run_pool, write_summary
+from chunkstore import write_chunked
+
+import os
+import re
+import time
+import logging
+import argparse
+import traceback
+
+### chunk shape of the consolidated (sbid, beam, channel, antenna) SEFD store, one schedule block per chunk
+SEFD_SUMMARY_CHUNKS = (1, 36, 1024, 64)
+
+def parse_sbid_beam(mspath):
+    """
+    get schedule block and beam from a path like .../{sbid}/{beam}/.../*.ms
+    """
+    sbid = re.findall(r"SB\d+", mspath)
+    beam = re.findall(r"/(\d{2})/", mspath) or re.findall(r"BEAM(\d+)", mspath)
+    if not sbid or not beam:
+        raise ValueError(f"cannot get sbid or beam from {mspath}...")
+    return sbid[-1], int(beam[-1])
+
+def load_manifest(manifestpath):
+    """
+    load a list of (mspath, sbid, beam) from a text file
+
+    each line contains a measurement set path, optionally followed by sbid and beam
+    """
+    msinfo = []
+    with open(manifestpath) as fp:
+        for line in fp:
+            line = line.split("#")[0].split()
+            if not line: continue
+            if len(line) >= 3: msinfo.append((line[0], line[1], int(line[2])))
+            else: msinfo.append((line[0], *parse_sbid_beam(line[0])))
+    return msinfo
+
+def glob_measurement_sets(patterns):
+    """
+    list of (mspath, sbid, beam) for all measurement sets matching `patterns`
+    """
+    msinfo = []
+    for pattern in patterns:
+        for mspath in sorted(glob.glob(pattern)):
+            msinfo.append((mspath, *parse_sbid_beam(mspath)))
+    return msinfo
+
+def get_outpath(sbid, beam, outdir="."):
+    return f"{outdir}/{sbid}/{beam:0>2}"
+
+def get_SEFDant_path(mspath, outpath):
+    msname = mspath.rstrip("/").split("/")[-1]
+    return f"{outpath}/{msname}.SEFDant.npy"
+
+def is_ms_uptodate(mspath, outpath):
+    """
+    check if the antenna SEFD of a measurement set is newer than the measurement set itself
+    """
+    antpath = get_SEFDant_path(mspath, outpath)
+    if not os.path.exists(antpath): return False
+    try:
+        return os.path.getmtime(antpath) >= ms_mtime(mspath)
+    except (OSError, ValueError):
+        return False
+
+def run_ms(mspath, sbid, beam, outdir=".", membudget=CHUNK_MEMORY_BUDGET):
+    """
+    derive SEFDs for a single measurement set
+    return a record with status, timing and error traceback (if any)
+    """
+    outpath = get_outpath(sbid, beam, outdir)
+    record = dict(
+        sbid=sbid, beam=beam, ms=mspath, status="failed",
+        start=time.time(), elapsed=None, error=None,
+    )
+
+    try:
+        if not os.path.exists(outpath): os.makedirs(outpath)
+        derive_SEFD(calmspath=mspath, pathdir=outpath, membudget=membudget)
+        record["status"] = "success"
+    except Exception:
+        record["error"] = traceback.format_exc()
+        logger.critical(f"Error occurs for {mspath}... Please check later...")
+
+    record["elapsed"] = time.time() - record["start"]
+    return record
+
+def check_msinfo(msinfo, nbeam=36):
+    """
+    check beams are within `nbeam` and each (sbid, beam) has a single measurement set
+    repeated entries of the same measurement set are dropped
+    """
+    checked = {}
+    for mspath, sbid, beam in msinfo:
+        if not 0 <= beam < nbeam:
+            raise ValueError(f"beam {beam} of {mspath} is out of range, only {nbeam} beams are allowed...")
+        if (sbid, beam) in checked:
+            if os.path.abspath(checked[(sbid, beam)]) != os.path.abspath(mspath):
+                raise ValueError(f"{checked[(sbid, beam)]} and {mspath} are both {sbid} BEAM{beam:0>2}...")
+            logger.warning(f"{mspath} is listed more than once... skip...")
+            continue
+        checked[(sbid, beam)] = mspath
+    return [(mspath, sbid, beam) for (sbid, beam), mspath in checked.items()]
+
+def consolidate_SEFD(msinfo, outdir=".", nbeam=36):
+    """
+    collect antenna SEFDs of all measurement sets into one array
+
+    return sbids and an array with a shape of (nsbid, nbeam, nchan, nant),
+    missing beams/channels/antennas are filled with nan
+    """
+    SEFD_ants = {}
+    for mspath, sbid, beam in check_msinfo(msinfo, nbeam):
+        antpath = get_SEFDant_path(mspath, get_outpath(sbid, beam, outdir))
+        if os.path.exists(antpath): SEFD_ants[(sbid, beam)] = np.load(antpath)
+
+    sbids = sorted(set(sbid for sbid, _ in SEFD_ants))
+    nchan = max([value.shape[0] for value in SEFD_ants.values()], default=0)
+    nant = max([value.shape[1] for value in SEFD_ants.values()], default=0)
+
+    SEFD_store = np.full((len(sbids), nbeam, nchan, nant), np.nan)
+    for (sbid, beam), value in SEFD_ants.items():
+        SEFD_store[sbids.index(sbid), beam, :value.shape[0], :value.shape[1]] = value
+    return np.array(sbids), SEFD_store
+
+def run_batch(msinfo, outdir=".", nworker=4, maxmem=None, resume=True, nbeam=36):
+    """
+    derive SEFDs for measurement sets in a process pool
+
+    `msinfo` is a list of (mspath, sbid, beam). each worker is limited to
+    `maxmem` bytes (no limit if None), and a quarter of it is used for reading
+    visibilities block by block. measurement sets with up to date outputs are
+    skipped if `resume`. records are merged into `{outdir}/run_SEFD_summary.json`
+    and all antenna SEFDs are saved to the `{outdir}/SEFD_summary.chunks` store
+    """
+    membudget = CHUNK_MEMORY_BUDGET if maxmem is None else maxmem // 4
+    msinfo = check_msinfo(msinfo, nbeam)
+
+    todo = []
+    for mspath, sbid, beam in msinfo:
+        if resume and is_ms_uptodate(mspath, get_outpath(sbid, beam, outdir)):
+            logger.info(f"outputs for {mspath} are up to date... skip...")
+            continue
+        todo.append((mspath, sbid, beam, outdir, membudget))
+
+    records = run_pool(run_ms, todo, nworker=nworker, maxmem=maxmem, logger=logger)
+
+    if not os.path.exists(outdir): os.makedirs(outdir)
+    # records of skipped measurement sets (and earlier failures) are kept from previous runs
+    write_summary(f"{outdir}/run_SEFD_summary.json", records)
+
+    logger.info(f"saving antenna SEFDs to {outdir}/SEFD_summary.chunks...")
+    sbids, SEFD_store = consolidate_SEFD(msinfo, outdir, nbeam)
+    write_chunked(
+        f"{outdir}/SEFD_summary.chunks", SEFD_store, SEFD_SUMMARY_CHUNKS,
+        attrs=dict(dims=["sbid", "beam", "channel", "antenna"], sbid=[str(sbid) for sbid in sbids]),
+    )
+
+    return records
+
+if __name__ == "__main__":
+    a = argparse.ArgumentParser()
+    a.add_argument("patterns", type=str, nargs="*", help="Glob patterns of calibrator measurement sets")
+    a.add_argument("-manifest", type=str, help="Text file listing measurement sets (path [sbid beam])", default=None)
+    a.add_argument("-outdir", type=str, help="Folder to save SEFDs", default=".")
+    a.add_argument("-nworker", type=int, help="Number of measurement sets processed in parallel", default=4)
+    a.add_argument("-maxmem", type=float, help="Memory limit for each worker in GB", default=None)
+    a.add_argument("-noresume", action="store_true", help="Process all measurement sets even if outputs are up to date")
+    args = a.parse_args()
+
+    filehandler = logging.FileHandler("run_SEFD.log", "w")
+    filehandler.setLevel(logging.DEBUG)
+    filehandler.setFormatter(formatter)
+    logger.addHandler(filehandler)
+
+    msinfo = glob_measurement_sets(args.patterns)
+    if args.manifest is not None: msinfo += load_manifest(args.manifest)
+
+    maxmem = None if args.maxmem is None else int(args.maxmem * 1024**3)
+    run_batch(msinfo, outdir=args.outdir, nworker=args.nworker, maxmem=maxmem, resume=not args.noresume)
@@ -1,7 +1,19 @@
 import glob
 import numpy as np
 from compare_craco_askaphw import *
+from batch_utils import ms_mtime, run_pool, write_summary
+from diagnose_products import write_products, get_products_path, is_products, MANIFEST_FNAME
 
+import os
+import json
+import time
+import argparse
+import traceback
+
+
+### chunk shape of the (time, baseline, channel) visibility stores
+VIS_CHUNKS = (256, 16, 256)
+VIS_DIMS = ["time", "baseline", "channel"]
 
 def find_craco_ms(sbid, beam):
     beam = f"{beam:0>2}"
@@ -16,41 +28,126 @@ def find_hw_ms(sbid, beam):
     
     return msfile
 
+def is_beam_uptodate(sbid, beam):
+    """
+    check if the output of a beam is newer than both measurement sets, and the last run succeeded
+    """
+    outpath = f"./{sbid}/{beam:0>2}"
+    recordpath = f"{outpath}/result.json"
+    productpath = get_products_path(outpath)
+    if not os.path.exists(recordpath) or not is_products(productpath): return False
+
+    with open(recordpath) as fp:
+        record = json.load(fp)
+    if record["status"] != "success": return False
+
+    try:
+        inmtime = max(ms_mtime(record["craco_ms"]), ms_mtime(record["hw_ms"]))
+    except (OSError, ValueError):
+        return False
+    return os.path.getmtime(f"{productpath}/{MANIFEST_FNAME}") >= inmtime
+
+def run_beam(sbid, beam, membudget=CHUNK_MEMORY_BUDGET):
+    """
+    compare craco and askap hardware data for a single beam
+    return a record with status, timing, shapes and error traceback (if any)
+    """
+    outpath = f"./{sbid}/{beam:0>2}"
+    record = dict(
+        sbid=sbid, beam=beam, status="failed", craco_ms=None, hw_ms=None,
+        start=time.time(), elapsed=None, shapes={}, error=None,
+    )
+    # created first so that every failure is recorded in `result.json`
+    if not os.path.exists(outpath): os.makedirs(outpath)
+
+    try:
+        record["craco_ms"] = craco_tab_path = find_craco_ms(sbid, beam)
+        record["hw_ms"] = hw_tab_path = find_hw_ms(sbid, beam)
+
+        cracodata, hwdata, cracouvw, hwuvw, central_freq, central_time, craco_bl, hw_bl = load_measurement_sets(
+            craco_tab_path = craco_tab_path,
+            hw_tab_path = hw_tab_path,
+            membudget = membudget,
+        )
+
+        logger.info("Saving data to products folder...")
+        logger.info(f"cracouvw shape: {cracouvw.shape}, hwuvw shape: {hwuvw.shape}...")
+
+        # visibility cubes are chunked stores, the rest are memory-mappable npy files
+        write_products(
+            get_products_path(outpath),
+            arrays = dict(
+                cracouvw = cracouvw, hwuvw = hwuvw,
+                central_freq = central_freq, central_time = central_time,
+                craco_bl = craco_bl, hw_bl = hw_bl,
+            ),
+            stores = dict(cracodata = cracodata, hwdata = hwdata),
+            chunks = VIS_CHUNKS,
+            dims = dict(
+                cracodata = VIS_DIMS, hwdata = VIS_DIMS,
+                cracouvw = ["time", "baseline", "uvw"], hwuvw = ["time", "baseline", "uvw"],
+                central_freq = ["channel"], central_time = ["time"],
+                craco_bl = ["baseline", "antenna"], hw_bl = ["baseline", "antenna"],
+            ),
+            axes = dict(freq = "central_freq", time = "central_time"),
+            baselines = dict(craco = "craco_bl", hw = "hw_bl"),
+        )
+
+        record["shapes"] = dict(
+            cracodata = cracodata.shape, hwdata = hwdata.shape,
+            cracouvw = cracouvw.shape, hwuvw = hwuvw.shape,
+        )
+        record["status"] = "success"
+
+    except Exception:
+        record["error"] = traceback.format_exc()
+        logger.critical(f"Error occurs for BEAM{beam} data... Please check later...")
+
+    record["elapsed"] = time.time() - record["start"]
+
+    with open(f"{outpath}/result.json", "w") as fp:
+        json.dump(record, fp, indent=2)
+
+    return record
+
+def run_sbid(sbid, beams=range(36), nworker=4, maxmem=None, resume=True):
+    """
+    run comparison for beams in a process pool
+
+    each worker is limited to `maxmem` bytes (no limit if None), and a
+    quarter of it is used for reading visibilities block by block.
+    beams with up to date outputs are skipped if `resume`, and records
+    are merged into `./{sbid}/run_diagnose_summary.json`
+    """
+    membudget = CHUNK_MEMORY_BUDGET if maxmem is None else maxmem // 4
+
+    todo = []
+    for beam in beams:
+        if resume and is_beam_uptodate(sbid, beam):
+            logger.info(f"outputs for BEAM{beam} are up to date... skip...")
+            continue
+        todo.append((sbid, beam, membudget))
+
+    records = run_pool(run_beam, todo, nworker=nworker, maxmem=maxmem, logger=logger)
+
+    if not os.path.exists(f"./{sbid}"): os.makedirs(f"./{sbid}")
+    # records of skipped beams (and earlier failures) are kept from previous runs
+    write_summary(f"./{sbid}/run_diagnose_summary.json", records)
+
+    return records
+
 if __name__ == "__main__":
-    
-    SBID = "SB047619"
-    
+    a = argparse.ArgumentParser()
+    a.add_argument("-sbid", type=str, help="Schedule block to compare", default="SB047619")
+    a.add_argument("-nworker", type=int, help="Number of beams processed in parallel", default=4)
+    a.add_argument("-maxmem", type=float, help="Memory limit for each worker in GB", default=None)
+    a.add_argument("-noresume", action="store_true", help="Process all beams even if outputs are up to date")
+    args = a.parse_args()
+
     filehandler = logging.FileHandler("run_diagnose.log", "w")
     filehandler.setLevel(logging.DEBUG)
     filehandler.setFormatter(formatter)
     logger.addHandler(filehandler)
-    
-    
-    for beam in range(36):
-        craco_tab_path = find_craco_ms(SBID, beam)
-        hw_tab_path = find_hw_ms(SBID, beam)
-        
-        try:
-        
-            cracodata, hwdata, cracouvw, hwuvw, central_freq, central_time, craco_bl, hw_bl = load_measurement_sets(
-                craco_tab_path = craco_tab_path,
-                hw_tab_path = hw_tab_path
-            )
-            
-            logger.info("Saving data to `.npz` file...")
-            logger.info(f"cracouvw shape: {cracouvw.shape}, hwuvw shape: {hwuvw.shape}...")
-            
-            np.savez(
-                f"./{SBID}/{beam:0>2}/loaded_data.npz",
-                cracodata = cracodata, hwdata = hwdata,
-                cracouvw = cracouvw, hwuvw = hwuvw,
-                central_freq = central_freq, central_time = central_time,
-                craco_bl = craco_bl, hw_bl = hw_bl,
-            )
-            
-        except:
-            logger.critical(f"Error occurs for BEAM{beam} data... Please check later...")
-            
-        
-        
-        
+
+    maxmem = None if args.maxmem is None else int(args.maxmem * 1024**3)
+    run_sbid(args.sbid, nworker=args.nworker, maxmem=maxmem, resume=not args.noresume)
@@ -1,7 +1,10 @@
 import os
+import time
 import numpy as np
 import multiprocessing
 
+from baseline_index import getnbl, baseline_pairs
+
 import logging
 
 ### set logger...
@@ -14,60 +17,308 @@ console.setLevel(logging.DEBUG)
 console.setFormatter(formatter)
 logger.addHandler(console)
 
-def sim_ant_data(nant, nt, srcflux=0.01, ave=True):
-    logger.info(f"creating noise vector for antennas - shape: ({nant}, {nt})")
-    n = 1/np.sqrt(2) * np.random.randn(nant, nt) + 1j * 1/np.sqrt(2) * np.random.randn(nant, nt)
-    logger.info(f"creating noise vector for antennas - shape: ({nant}, {nt})")
-    s = np.repeat(np.sqrt(srcflux) * np.random.randn(1, nt), nant, axis=0)
+### number of samples generated at once for each antenna
+CHUNK_SAMPLES = 65536
+### data type of simulated series (`main` and `main_multipro` outputs)
+SERIES_DTYPE = np.complex128
+
+def _fill_noise(rng, buf):
+    """
+    fill complex64 `buf` with unit power circular gaussian noise in place
+    """
+    # view the complex buffer as (..., 2) float32 to generate real and imaginary parts together
+    rng.standard_normal(out=buf.view(np.float32), dtype=np.float32)
+    buf *= 1/np.sqrt(2)
+    return buf
+
+def _correlate(nant, nt, srcflux, rng, chunksize=CHUNK_SAMPLES):
+    """
+    correlation of `nt` simulated samples, return (signal plus noise, noise only)
+    averages with a shape of (nbl, )
+
+    `srcflux` can be an array of fluxes with a shape of (nbatch, ), e.g., all
+    channels and polarisations of an integration, which are simulated with
+    independent noise by one batched matrix product, and the averages then have
+    a shape of (nbatch, nbl). at most `chunksize` samples per antenna (over the
+    whole batch) are generated at once
+    """
+    flux = np.atleast_1d(np.asarray(srcflux, dtype=np.float32))
+    nbatch = flux.shape[0]
+    nsampmax = max(1, min(chunksize // nbatch, nt))
+
+    # flat buffers so that the (nbatch, nant, nsamp) views of the last chunk stay contiguous
+    nbuf = np.empty(nbatch * nant * nsampmax, dtype=np.complex64)
+    sbuf = np.empty(nbatch * nsampmax, dtype=np.float32)
+    abuf = np.empty_like(nbuf)
+
+    c_sum = np.zeros((nbatch, nant, nant), dtype=np.complex128)
+    n_sum = np.zeros((nbatch, nant, nant), dtype=np.complex128)
+    for i0 in range(0, nt, nsampmax):
+        nsamp = min(nsampmax, nt - i0)
+        n = _fill_noise(rng, nbuf[:nbatch * nant * nsamp].reshape(nbatch, nant, nsamp))
+        s = rng.standard_normal(out=sbuf[:nbatch * nsamp], dtype=np.float32).reshape(nbatch, 1, nsamp)
+        s *= np.sqrt(flux)[:, None, None]
+        a = np.add(n, s, out=abuf[:nbatch * nant * nsamp].reshape(nbatch, nant, nsamp))
+
+        c_sum += a @ a.conj().transpose(0, 2, 1)
+        n_sum += n @ n.conj().transpose(0, 2, 1)
 
-    a = n + s
+    ant1, ant2 = baseline_pairs(nant)
+    c_ave = c_sum[:, ant1, ant2] / nt; n_ave = n_sum[:, ant1, ant2] / nt
+    if np.ndim(srcflux) == 0: return c_ave[0], n_ave[0]
+    return c_ave, n_ave
 
+def sim_ant_data(nant, nt, srcflux=0.01, ave=True, rng=None, chunksize=CHUNK_SAMPLES):
+    """
+    simulate `nt` voltage samples for `nant` antennas and correlate them
+
+    samples are generated in chunks of `chunksize` with complex64 buffers, and
+    all baselines (in the dense baseline order, auto-correlation included) are
+    accumulated with one matrix product per chunk.
+    return the averaged correlation of signal plus noise and of noise only,
+    both with a shape of (nbl, 1)
+    """
     if not ave: raise NotImplementedError("Do not support non-average at this point...")
-    
+    if rng is None: rng = np.random.default_rng()
+
+    logger.info(f"creating noise and signal vector for antennas - shape: ({nant}, {nt})")
     logger.info("performing correlation...")
-    c_ave = np.array([(a[i] * a[j].conj()).mean() for i in range(nant) for j in range(i, nant)])
-    n_ave = np.array([(n[i] * n[j].conj()).mean() for i in range(nant) for j in range(i, nant)])
-        
+    c_ave, n_ave = _correlate(nant, nt, srcflux, rng, chunksize)
+
     return c_ave.reshape(-1, 1), n_ave.reshape(-1, 1)
 
-def sim_series_data(nant=36, nt=20, nave=1000000, srcflux=0.01):
+def sim_series_data(nant=36, nt=20, nave=1000000, srcflux=0.01, seed=None, c_out=None, n_out=None):
+    """
+    simulate `nt` integrations, the results are written to `c_out` and `n_out`
+    (with a shape of (nbl, nt)) if provided
+    """
     logger.info(f"creating simulated sigal from {nant} antennas, with {nave/1e6}M samples averaging, and {nt} integrations...")
     logger.info(f"source signal flux is {srcflux} unit...")
+    rng = np.random.default_rng(seed)
+
+    nbl = getnbl(nant)
+    if c_out is None: c_out = np.empty((nbl, nt), dtype=SERIES_DTYPE)
+    if n_out is None: n_out = np.empty((nbl, nt), dtype=SERIES_DTYPE)
     
-    c_data = []; n_data = []
     for i in range(nt):
         if i % 5 == 0:
             logger.info("*" * 80); logger.info(f"{i} integration..."); logger.info("*" * 80)
-        c_, n_ = sim_ant_data(nant, nave, srcflux)
-        
-        c_data.append(c_); n_data.append(n_)
+        c_, n_ = sim_ant_data(nant, nave, srcflux, rng=rng)
+        c_out[:, i] = c_[:, 0]; n_out[:, i] = n_[:, 0]
+
+    return c_out, n_out
+
+### frequency, spectrum and transients for band simulations
+
+### dispersion delay constant in s MHz^2 pc^-1 cm^3
+DISPERSION_CONSTANT = 4.148808e3
+
+def get_freqs(nchan=864, fstart=743.4, fend=887.4):
+    """
+    channel frequencies in MHz, default to the CRACO band used in the dashboard
+    """
+    return np.linspace(fstart, fend, nchan)
+
+def source_spectrum(freqs, srcflux, spindex=0., reffreq=None):
+    """
+    power-law source flux for each channel, `reffreq` defaults to the band centre
+    """
+    if reffreq is None: reffreq = freqs.mean()
+    return srcflux * (freqs / reffreq) ** spindex
+
+def dispersed_transient(freqs, tidx, tint, t0, dm, flux, width=None):
+    """
+    flux of a dispersed boxcar pulse in each channel and integration
+
+    the pulse arrives at `t0` (in seconds) at the highest frequency, lasts `width`
+    seconds (one integration by default) and is delayed by DISPERSION_CONSTANT * dm / f^2.
+    the flux is spread over integrations by their overlap with the pulse.
+    return an array with a shape of (nchan, len(tidx))
+    """
+    if width is None: width = tint
+    tarrive = t0 + DISPERSION_CONSTANT * dm * (freqs**-2 - freqs.max()**-2)
+
+    tidx = np.asarray(tidx)
+    tlow = tidx * tint; thigh = tlow + tint
+    overlap = np.minimum(thigh[None, :], tarrive[:, None] + width) - np.maximum(tlow[None, :], tarrive[:, None])
+    return flux * np.clip(overlap, 0, None) / tint
+
+def sky_flux(freqs, tidx, tint, spectrum, transients=()):
+    """
+    source flux in each channel and integration with a shape of (nchan, len(tidx))
+
+    `transients` is a list of keyword dictionaries for `dispersed_transient`
+    """
+    flux = np.repeat(np.asarray(spectrum, dtype=float)[:, None], len(tidx), axis=1)
+    for transient in transients:
+        flux += dispersed_transient(freqs, tidx, tint, **transient)
+    return flux
+
+def sim_band_block(nant, flux, npol=2, nave=1000, rng=None, chunksize=CHUNK_SAMPLES):
+    """
+    simulate a block of integrations for all channels and polarisations
+
+    `flux` is the source flux with a shape of (nchan, nt), channels and
+    polarisations have independent noise and are correlated together as one
+    batch for each integration. return complex64 visibilities with a shape of
+    (nbl, nchan, npol, nt), i.e., the layout of uvfits npy files
+    """
+    if rng is None: rng = np.random.default_rng()
+    nchan, nt = flux.shape
+    nbl = getnbl(nant)
+
+    block = np.empty((nbl, nchan, npol, nt), dtype=np.complex64)
+    for it in range(nt):
+        # batch is ordered by channel then polarisation
+        c_ave, _ = _correlate(nant, nave, np.repeat(flux[:, it], npol), rng, chunksize)
+        block[..., it] = c_ave.reshape(nchan, npol, nbl).transpose(2, 0, 1)
+    return block
 
-    return c_data, n_data
+def _block_nt(nbl, nchan, npol, nt, membudget):
+    return int(np.clip(membudget // (nbl * nchan * npol * np.dtype(np.complex64).itemsize), 1, nt))
+
+def sim_beam(
+    fname, nant=36, nt=100, npol=2, nave=1000, freqs=None,
+    spectrum=0., transients=(), tint=0.013824, seed=None, membudget=256 * 1024**2,
+):
+    """
+    simulate a single beam and write it to `fname` as a (nbl, nchan, npol, nt) npy file
+
+    integrations are simulated in blocks (sized by `membudget` in bytes) and
+    written to a memory-mapped output, so the full file is never held in memory
+    """
+    if freqs is None: freqs = get_freqs()
+    spectrum = np.broadcast_to(spectrum, freqs.shape)
+    rng = np.random.default_rng(seed)
+    nbl = getnbl(nant); nchan = freqs.shape[0]
+
+    logger.info(f"creating {fname} with a shape of ({nbl}, {nchan}, {npol}, {nt})...")
+    out = np.lib.format.open_memmap(fname, mode="w+", dtype=np.complex64, shape=(nbl, nchan, npol, nt))
+
+    ntblock = _block_nt(nbl, nchan, npol, nt, membudget)
+    for i0 in range(0, nt, ntblock):
+        i1 = min(i0 + ntblock, nt)
+        logger.info(f"simulating integrations {i0} to {i1} of {nt}...")
+        flux = sky_flux(freqs, np.arange(i0, i1), tint, spectrum, transients)
+        out[..., i0:i1] = sim_band_block(nant, flux, npol, nave, rng)
+
+    out.flush()
+    del out
+
+def simulate_beams(
+    folder="./sim", beams=range(36), nant=36, nt=100, npol=2, nave=1000, freqs=None,
+    srcflux=0.01, spindex=0., beam_gains=None, transients=(), tint=0.013824, seed=None,
+):
+    """
+    simulate `output_beamXX.uvfits.npy` files for multiple beams
+
+    the source spectrum and transients are scaled by the gain of each beam
+    (`beam_gains` indexed by beam number, 1 for all beams by default), each
+    beam has independent noise
+    """
+    if freqs is None: freqs = get_freqs()
+    if not os.path.exists(folder): os.makedirs(folder)
+    beams = list(beams)
+    seeds = np.random.SeedSequence(seed).spawn(len(beams))
+
+    for beam, beamseed in zip(beams, seeds):
+        gain = 1. if beam_gains is None else beam_gains[beam]
+        beamtransients = [dict(transient, flux=transient["flux"] * gain) for transient in transients]
+        sim_beam(
+            f"{folder}/output_beam{beam:0>2}.uvfits.npy", nant=nant, nt=nt, npol=npol, nave=nave, freqs=freqs,
+            spectrum=source_spectrum(freqs, srcflux * gain, spindex), transients=beamtransients,
+            tint=tint, seed=beamseed,
+        )
 
 def dump_data(c_data, n_data, fname):
+    """
+    save simulated data from lists of (nbl, 1) arrays (or (nbl, nt) arrays), as `main` writes them
+    """
     ### combine data together...
-    c_ = np.concatenate(c_data, axis = 1)
-    n_ = np.concatenate(n_data, axis = 1)
+    c_ = np.concatenate(c_data, axis = 1) if isinstance(c_data, list) else np.asarray(c_data)
+    n_ = np.concatenate(n_data, axis = 1) if isinstance(n_data, list) else np.asarray(n_data)
     logger.info(f"saving simulated data to {fname}... final data shape is {c_.shape}")
-    np.save(fname, c_)
+    np.save(fname, c_.astype(SERIES_DTYPE, copy=False))
     logger.info(f"saving corresponding noise data...")
-    np.save(fname.replace(".npy", "_n.npy"), n_)
-    
-    
-def main(folder="./sim", nant=36, nt=100, nave=1000000, srcflux=0.01, prefix="sim"):
+    np.save(fname.replace(".npy", "_n.npy"), n_.astype(SERIES_DTYPE, copy=False))
+
+def _open_series_output(folder, nant, nt, nave, srcflux, prefix):
+    """
+    memory-mapped outputs for simulated signal plus noise and noise only, with a shape of (nbl, nt)
+    """
+    fname = f"{folder}/{prefix}_nant{nant}_nt{nt}_nave{nave/1e6:.0f}M_srcflux{srcflux:.2f}.npy"
+    logger.info(f"saving simulated data to {fname}... final data shape is ({getnbl(nant)}, {nt})")
+    c_out = np.lib.format.open_memmap(fname, mode="w+", dtype=SERIES_DTYPE, shape=(getnbl(nant), nt))
+    logger.info(f"saving corresponding noise data...")
+    n_out = np.lib.format.open_memmap(fname.replace(".npy", "_n.npy"), mode="w+", dtype=SERIES_DTYPE, shape=(getnbl(nant), nt))
+    return c_out, n_out
+
+def main(folder="./sim", nant=36, nt=100, nave=1000000, srcflux=0.01, prefix="sim", seed=None):
     if srcflux < 0.01: return None
     if not os.path.exists(folder): os.makedirs(folder)
-        
-    c_data, n_data =sim_series_data(nant, nt, nave, srcflux)
-    fname = f"{prefix}_nant{nant}_nt{nt}_nave{nave/1e6:.0f}M_srcflux{srcflux:.2f}.npy"
-    
-    dump_data(c_data, n_data, f"{folder}/{fname}")
-    
-def main_multipro(folder="./sim", nant=36, nt=200, nave=1000000, srclist=[], prefix="test_multi", ncpu=6):
-    params = [(folder, nant, nt, nave, srcflux, prefix) for srcflux in srclist]
+
+    c_out, n_out = _open_series_output(folder, nant, nt, nave, srcflux, prefix)
+    sim_series_data(nant, nt, nave, srcflux, seed=seed, c_out=c_out, n_out=n_out)
+    c_out.flush(); n_out.flush()
     
+def _sim_series_chunk(isrc, nant, nave, srcflux, i0, i1, seed):
+    """
+    simulate integrations `i0` to `i1` of a single source flux with its own random stream
+    """
+    rng = np.random.default_rng(seed)
+    c_chunk = np.empty((getnbl(nant), i1 - i0), dtype=SERIES_DTYPE)
+    n_chunk = np.empty_like(c_chunk)
+    for i in range(i1 - i0):
+        c_chunk[:, i], n_chunk[:, i] = _correlate(nant, nave, srcflux, rng)
+    return isrc, i0, i1, c_chunk, n_chunk
+
+def _sim_series_chunk_star(args):
+    return _sim_series_chunk(*args)
+
+def main_multipro(
+    folder="./sim", nant=36, nt=200, nave=1000000, srclist=[], prefix="test_multi", ncpu=6, seed=None, ntchunk=10,
+):
+    """
+    simulate several source fluxes in a process pool
+
+    the work is split into (source flux, `ntchunk` integrations) tasks, each
+    task has an independent random stream spawned from `seed`, so the results
+    do not depend on the number of workers or the order tasks finish in.
+    finished chunks are written to the memory-mapped outputs of `main`
+    """
+    srclist = [srcflux for srcflux in srclist if srcflux >= 0.01]
+    if not os.path.exists(folder): os.makedirs(folder)
+    outputs = [_open_series_output(folder, nant, nt, nave, srcflux, prefix) for srcflux in srclist]
+
+    tasks = [(isrc, i0, min(i0 + ntchunk, nt)) for isrc in range(len(srclist)) for i0 in range(0, nt, ntchunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+    params = [
+        (isrc, nant, nave, srclist[isrc], i0, i1, seeds[itask])
+        for itask, (isrc, i0, i1) in enumerate(tasks)
+    ]
+
+    logger.info(f"simulating {len(srclist)} source flux(es) as {len(tasks)} task(s) with {ncpu} worker(s)...")
+    ndone = 0; ntotal = len(srclist) * nt; start = time.time()
     pool = multiprocessing.Pool(ncpu)
-    pool.starmap(main, params)
+    try:
+        for isrc, i0, i1, c_chunk, n_chunk in pool.imap_unordered(_sim_series_chunk_star, params):
+            c_out, n_out = outputs[isrc]
+            c_out[:, i0:i1] = c_chunk; n_out[:, i0:i1] = n_chunk
+
+            ndone += i1 - i0; elapsed = time.time() - start
+            logger.info(
+                f"{ndone}/{ntotal} integrations finished ({100*ndone/ntotal:.1f}%)... "
+                f"{ndone/elapsed:.2f} integrations/s, {ndone*nave/elapsed/1e6:.1f}M samples/s..."
+            )
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    for c_out, n_out in outputs:
+        c_out.flush(); n_out.flush()
     
 if __name__ == "__main__":
     nt = 200
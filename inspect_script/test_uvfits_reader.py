@@ -0,0 +1,66 @@
+import numpy as np
+
+from uvfits_reader import UVFitsReader
+
+### craco and askap hardware integration times (in seconds)
+CRACO_TR = 0.110592
+HW_TR = 9.95328
+
+def write_uvfits(fname, nt, tr, nant=3, nchan=4, npol=2, inttim=None):
+    """
+    write a small random groups file with float64 parameters and dates `tr` seconds apart
+    """
+    pairs = [(i, j) for i in range(nant) for j in range(i, nant)]
+    ptypes = ["UU", "VV", "WW", "DATE", "BASELINE"] + (["INTTIM"] if inttim is not None else [])
+    cards = [
+        ("SIMPLE", "T"), ("BITPIX", -64), ("NAXIS", 6), ("NAXIS1", 0), ("NAXIS2", 3), ("NAXIS3", npol),
+        ("NAXIS4", nchan), ("NAXIS5", 1), ("NAXIS6", 1), ("EXTEND", "T"), ("GROUPS", "T"),
+        ("PCOUNT", len(ptypes)), ("GCOUNT", nt * len(pairs)),
+        ("CTYPE2", "'COMPLEX'"), ("CTYPE3", "'STOKES'"), ("CTYPE4", "'FREQ'"), ("CRVAL4", 8e8),
+        ("CDELT4", 1e6), ("CRPIX4", 1.0), ("CTYPE5", "'RA'"), ("CTYPE6", "'DEC'"),
+    ] + [(f"PTYPE{i+1}", f"'{ptype}'") for i, ptype in enumerate(ptypes)]
+    header = "".join(f"{key:<8}= {str(value):>20}".ljust(80) for key, value in cards) + "END".ljust(80)
+    header = header.ljust(2880 * ((len(header) + 2879) // 2880))
+
+    groups = []
+    for it in range(nt):
+        # dates are stored as full jd values, as craco does
+        date = 2460000.5 + it * tr / 86400
+        for a1, a2 in pairs:
+            params = [0., 0., 0., date, 256 * (a1 + 1) + (a2 + 1)] + ([inttim] if inttim is not None else [])
+            groups.append(np.array(params, dtype=">f8").tobytes() + np.ones(nchan * npol * 3, dtype=">f8").tobytes())
+    data = b"".join(groups)
+    with open(fname, "wb") as fp:
+        fp.write(header.encode() + data + b"\0" * ((-len(data)) % 2880))
+
+def test_integration_time_snapped_at_craco_cadence(tmp_path):
+    fname = str(tmp_path / "craco.uvfits")
+    write_uvfits(fname, nt=200, tr=CRACO_TR)
+    reader = UVFitsReader(fname, cache_index=False)
+
+    # the date step alone is not a whole fraction of the hardware integration time
+    rawtr = reader.integration_time()
+    assert abs(rawtr - CRACO_TR) < 1e-4
+    assert round(HW_TR / rawtr, 2) != round(HW_TR / rawtr)
+
+    tr = reader.integration_time(HW_TR)
+    assert np.isclose(tr, CRACO_TR, rtol=1e-12, atol=0)
+    assert round(HW_TR / tr, 2) == 90
+
+def test_integration_time_not_snapped_to_other_cadence(tmp_path):
+    fname = str(tmp_path / "craco.uvfits")
+    write_uvfits(fname, nt=20, tr=1.)
+    reader = UVFitsReader(fname, cache_index=False)
+
+    assert np.isclose(reader.integration_time(10.), 1., rtol=1e-12, atol=0)
+    # 2.5 s is not a multiple of 1 s, so the date step is kept
+    assert reader.integration_time(2.5) == reader.integration_time()
+
+def test_integration_time_from_inttim(tmp_path):
+    fname = str(tmp_path / "craco.uvfits")
+    write_uvfits(fname, nt=10, tr=CRACO_TR, inttim=CRACO_TR)
+    reader = UVFitsReader(fname)
+
+    assert reader.integration_time(HW_TR) == CRACO_TR
+    # the cached index keeps the integration time
+    assert UVFitsReader(fname).inttim == CRACO_TR
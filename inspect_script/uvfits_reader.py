@@ -0,0 +1,190 @@
+"""
+memory-mapped reader for uvfits (random groups) files
+
+the file is never converted, group parameters (UU, VV, WW, DATE, BASELINE)
+are parsed into a compact index (cached beside the file), and visibilities
+are exposed as a strided (time, baseline, channel, pol) view of the file.
+groups are expected to be ordered by integration then baseline, with the
+same baselines in every integration, which is how CRACO writes them
+"""
+
+import numpy as np
+import os
+
+FITS_BLOCK = 2880
+FITS_CARD = 80
+
+### data types for BITPIX values, fits files are big-endian
+BITPIX_DTYPES = {8: "u1", 16: ">i2", 32: ">i4", 64: ">i8", -32: ">f4", -64: ">f8"}
+COMPLEX_DTYPES = {-32: ">c8", -64: ">c16"}
+
+### tolerance (in units in the last place of the dates) when snapping integration times
+DATE_PRECISION_ULP = 4
+
+def _parse_value(value):
+    value = value.strip()
+    if value.startswith("'"): return value[1:].split("'")[0].strip()
+    value = value.split("/")[0].strip()
+    if value in ("T", "F"): return value == "T"
+    try: return int(value)
+    except ValueError: pass
+    try: return float(value.replace("D", "E"))
+    except ValueError: return value
+
+def read_header(fname):
+    """
+    read the primary header, return the header as a dictionary and its size in bytes
+    """
+    header = {}
+    with open(fname, "rb") as fp:
+        ncard = 0
+        while True:
+            block = fp.read(FITS_BLOCK)
+            if len(block) < FITS_BLOCK: raise ValueError(f"{fname} is not a valid fits file...")
+            for i in range(0, FITS_BLOCK, FITS_CARD):
+                card = block[i:i+FITS_CARD].decode("ascii")
+                ncard += 1
+                key = card[:8].strip()
+                if key == "END":
+                    return header, FITS_BLOCK * int(np.ceil(ncard * FITS_CARD / FITS_BLOCK))
+                if card[8:10] == "= ": header[key] = _parse_value(card[10:])
+
+class UVFitsReader:
+    """
+    random groups uvfits file opened with a memory map
+
+    `vis` and `weights` are (nt, nbl, nchan, npol) views of the file (`weights`
+    is None if the file has no weights), `uvw`
+    (in seconds), `times` (in jd), `inttim` (in seconds, nan if not recorded),
+    `blpairs` (zero indexed) and `freqs` (in Hz) come from the index
+    """
+
+    def __init__(self, fname, cache_index=True):
+        self.fname = fname
+        self.header, self.hdrbytes = read_header(fname)
+        hdr = self.header
+        if not hdr.get("GROUPS", False): raise ValueError(f"{fname} is not a random groups file...")
+
+        self.bitpix = hdr["BITPIX"]
+        self.itemsize = abs(self.bitpix) // 8
+        self.pcount = hdr["PCOUNT"]; self.gcount = hdr["GCOUNT"]
+
+        ### data axes, NAXIS1 is zero for random groups, NAXIS2 is the fastest axis
+        self.axes = [hdr[f"CTYPE{i}"].strip() for i in range(2, hdr["NAXIS"] + 1)]
+        self.axislen = [hdr[f"NAXIS{i}"] for i in range(2, hdr["NAXIS"] + 1)]
+        if self.axes[0] != "COMPLEX": raise NotImplementedError("COMPLEX should be the fastest axis...")
+        self.groupbytes = (self.pcount + int(np.prod(self.axislen))) * self.itemsize
+
+        self._mmap = np.memmap(
+            fname, dtype="u1", mode="r", offset=0,
+            shape=(self.hdrbytes + self.gcount * self.groupbytes, ),
+        )
+
+        self.freqs = self._axis_values("FREQ")
+        self.nchan = self.freqs.shape[0]
+        self.npol = self.axislen[self.axes.index("STOKES")]
+
+        self._load_index(cache_index)
+        self.vis = self._data_view(0, COMPLEX_DTYPES.get(self.bitpix))
+        self.weights = self._data_view(2, BITPIX_DTYPES[self.bitpix])
+
+    def _axis_values(self, ctype):
+        i = self.axes.index(ctype) + 2
+        n = self.header[f"NAXIS{i}"]
+        crval = self.header.get(f"CRVAL{i}", 0.); cdelt = self.header.get(f"CDELT{i}", 1.)
+        crpix = self.header.get(f"CRPIX{i}", 1.)
+        return crval + (np.arange(n) + 1 - crpix) * cdelt
+
+    @property
+    def indexfname(self):
+        return f"{self.fname}.index.npz"
+
+    def group_params(self):
+        """
+        scaled group parameters, repeated parameters (e.g., DATE) are added together
+        """
+        raw = np.ndarray(
+            (self.gcount, self.pcount), dtype=BITPIX_DTYPES[self.bitpix], buffer=self._mmap,
+            offset=self.hdrbytes, strides=(self.groupbytes, self.itemsize),
+        )
+        params = {}
+        for i in range(self.pcount):
+            name = self.header[f"PTYPE{i+1}"].strip()
+            value = raw[:, i].astype(np.float64) * self.header.get(f"PSCAL{i+1}", 1.) + self.header.get(f"PZERO{i+1}", 0.)
+            params[name] = params[name] + value if name in params else value
+        return params
+
+    def _index_uptodate(self):
+        return os.path.exists(self.indexfname) and os.path.getmtime(self.indexfname) >= os.path.getmtime(self.fname)
+
+    def _load_index(self, cache_index=True):
+        index = np.load(self.indexfname) if cache_index and self._index_uptodate() else None
+        # index files written before `inttim` was recorded are rebuilt
+        if index is not None and "inttim" in index:
+            self.baselines = index["baselines"]; self.times = index["times"]; self.uvw = index["uvw"]
+            self.inttim = float(index["inttim"])
+        else:
+            self._build_index()
+            if cache_index:
+                try: np.savez(self.indexfname, baselines=self.baselines, times=self.times, uvw=self.uvw, inttim=self.inttim)
+                except OSError: print(f"cannot write index file {self.indexfname}...")
+
+        self.nbl = self.baselines.shape[0]; self.nt = self.times.shape[0]
+        # aips baseline encoding - 256 * ant1 + ant2, one indexed
+        self.blpairs = np.array([self.baselines // 256 - 1, self.baselines % 256 - 1]).astype(int)
+        self.nant = int(self.blpairs.max()) + 1
+
+    def _build_index(self):
+        params = self.group_params()
+        date = params["DATE"]; baseline = params["BASELINE"].astype(int)
+
+        nbl = int((date == date[0]).sum())
+        if self.gcount % nbl != 0 or not np.all(baseline.reshape(-1, nbl) == baseline[:nbl]):
+            raise ValueError(f"{self.fname} does not have the same baselines in every integration...")
+
+        self.baselines = baseline[:nbl]
+        self.times = date[::nbl]
+        # uvw parameters can be named as UU, UU---SIN, etc.
+        uvwkeys = [next(key for key in params if key.startswith(prefix)) for prefix in ("UU", "VV", "WW")]
+        self.uvw = np.stack([params[key] for key in uvwkeys], axis=-1).reshape(-1, nbl, 3).astype(np.float32)
+        # integration time from the INTTIM group parameter or header keyword if there is one
+        if "INTTIM" in params: self.inttim = float(np.median(params["INTTIM"]))
+        else: self.inttim = float(self.header.get("INTTIM", np.nan))
+
+    def integration_time(self, reftime=None):
+        """
+        integration time in seconds, `inttim` if it is recorded, otherwise the median step of the dates
+
+        dates are jd values quantised to a few tens of microseconds, so the step is snapped
+        to `reftime / n` (e.g., the hardware integration time) if it agrees within that precision
+        """
+        if np.isfinite(self.inttim) and self.inttim > 0: return self.inttim
+        if self.nt < 2: return 0.
+        inttim = np.median(np.diff(self.times)) * 86400
+        if reftime is None: return inttim
+        # the step between two dates is off by up to one unit in the last place of each
+        tol = DATE_PRECISION_ULP * np.spacing(np.abs(self.times).max()) * 86400
+        nsnap = max(1, int(round(reftime / inttim)))
+        if abs(reftime / nsnap - inttim) <= tol: return reftime / nsnap
+        return inttim
+
+    def _data_view(self, icomplex, dtype):
+        """
+        strided (nt, nbl, nchan, npol) view starting at the `icomplex` component (real, imag, weight)
+        """
+        # weights are only present if COMPLEX has 3 values (real, imag, weight)
+        if dtype is None or icomplex >= self.axislen[0]: return None
+        # strides of the data axes within a group, NAXIS2 is the fastest one
+        axisstrides = np.cumprod([self.itemsize] + self.axislen[:-1])
+        for axis in self.axes:
+            if axis not in ("COMPLEX", "STOKES", "FREQ") and self.axislen[self.axes.index(axis)] != 1:
+                raise NotImplementedError(f"axis {axis} with more than one pixel is not supported...")
+
+        return np.ndarray(
+            (self.nt, self.nbl, self.nchan, self.npol), dtype=dtype, buffer=self._mmap,
+            offset=self.hdrbytes + (self.pcount + icomplex) * self.itemsize,
+            strides=(
+                self.groupbytes * self.nbl, self.groupbytes,
+                axisstrides[self.axes.index("FREQ")], axisstrides[self.axes.index("STOKES")],
+            ),
+        )